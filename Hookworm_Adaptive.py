@@ -0,0 +1,178 @@
+import numpy as np
+import scipy.stats as stat
+import Hookworm_InputData as Data
+import Hookworm_ParameterClasses as P
+import Hookworm_MarkovModel as MarkovCls
+import Hookworm_OnlineStats as Online
+
+
+class AdaptiveOutputs:
+    def __init__(self, simOutputs_ref, simOutputs_new, paired, half_lengths, converged):
+        """ outputs of simulate_until_precision
+        :param simOutputs_ref: outputs of all patients simulated under the reference therapy
+        :param simOutputs_new: outputs of all patients simulated under the new therapy
+        :param paired: True if both therapies were simulated for the same patients
+        :param half_lengths: dictionary of the CI half-lengths of the incremental outcomes
+        :param converged: True if the requested precision was reached within the budget
+        """
+        self._simOutputsRef = simOutputs_ref
+        self._simOutputsNew = simOutputs_new
+        self._paired = paired
+        self._halfLengths = half_lengths
+        self._converged = converged
+
+    def get_outputs(self):
+        """ :returns: outputs of the reference and the new therapy """
+        return self._simOutputsRef, self._simOutputsNew
+
+    def get_if_paired(self):
+        return self._paired
+
+    def get_pop_size(self):
+        """ :returns: number of patients simulated under each therapy """
+        return len(self._simOutputsRef.get_costs())
+
+    def get_half_lengths(self):
+        return self._halfLengths
+
+    def get_if_converged(self):
+        return self._converged
+
+
+def simulate_until_precision(cost_tolerance=None, utility_tolerance=None, ICER_tolerance=None,
+                             batch_size=None, max_pop_size=100000, paired=True, first_id=0, n_workers=1,
+                             therapies=(P.Therapies.ANNUAL, P.Therapies.SEMI)):
+    """ simulates cohorts in batches until the Data.ALPHA-level CI half-lengths of the incremental
+    discounted cost, utility and/or ICER of the second therapy with respect to the first are within
+    the given tolerances, or until max_pop_size patients are simulated under each therapy
+    :param cost_tolerance: target half-length of the CI of incremental discounted cost (None to ignore)
+    :param utility_tolerance: target half-length of the CI of incremental discounted utility (None to ignore)
+    :param ICER_tolerance: target half-length of the CI of the ICER (None to ignore)
+    :param batch_size: number of patients added in each batch (Data.POP_SIZE if None)
+    :param max_pop_size: maximum number of patients simulated under each therapy (compute budget)
+    :param paired: set to True to simulate both therapies for the same patients (PairedCohort)
+    :param first_id: id of the first batch; batch b uses cohort ids first_id + b (paired) or
+        first_id + 2b and first_id + 2b + 1 (independent)
+    :param n_workers: number of worker processes used to simulate each batch
+    :param therapies: the reference and the new therapy
+    :returns: AdaptiveOutputs
+    """
+    if batch_size is None:
+        batch_size = Data.POP_SIZE
+
+    states_ref = []
+    states_new = []
+    # means and covariance of the utility and cost of all batches so far, updated with each batch
+    if paired:
+        stats = [Online.OnlineCovarianceStat('incremental utility and cost')]
+    else:
+        stats = [Online.OnlineCovarianceStat('utility and cost of ' + therapy.name) for therapy in therapies]
+    batch = 0
+    while True:
+        # simulate the next batch
+        if paired:
+            outputs = MarkovCls.PairedCohort(
+                id=first_id + batch, therapies=therapies, pop_size=batch_size).simulate(n_workers)
+        else:
+            outputs = [MarkovCls.Cohort(id=first_id + 2*batch + i, therapy=therapy, pop_size=batch_size).simulate(
+                n_workers) for i, therapy in enumerate(therapies)]
+        states_ref.append(outputs[0].get_cohort_state())
+        states_new.append(outputs[1].get_cohort_state())
+        batch += 1
+
+        # fold this batch into the statistics of all batches so far
+        for stat_all, stat_batch in zip(stats, _get_incremental_stats(outputs[0], outputs[1], paired)):
+            stat_all.merge(stat_batch)
+
+        half_lengths = _get_half_lengths(stats, paired)
+        converged = (_within(half_lengths['cost'], cost_tolerance)
+                     and _within(half_lengths['utility'], utility_tolerance)
+                     and _within(half_lengths['ICER'], ICER_tolerance))
+
+        if converged or batch * batch_size >= max_pop_size:
+            # outputs of all batches (merged once)
+            return AdaptiveOutputs(_merge_outputs(first_id, therapies[0], states_ref),
+                                   _merge_outputs(first_id, therapies[1], states_new),
+                                   paired, half_lengths, converged)
+
+
+def get_incremental_half_lengths(simOutputs_ref, simOutputs_new, paired):
+    """ :returns: dictionary of the Data.ALPHA-level CI half-lengths of the incremental discounted cost
+    and utility (t-CI, as in print_comparative_outcomes) and of the ICER (delta method) """
+    return _get_half_lengths(_get_incremental_stats(simOutputs_ref, simOutputs_new, paired), paired)
+
+
+def print_adaptive_outputs(adaptive_outputs):
+    """ prints the sample size and the precision reached by simulate_until_precision """
+    half_lengths = adaptive_outputs.get_half_lengths()
+    print("Adaptive sample size: {} patients per therapy ({}, {})".format(
+        adaptive_outputs.get_pop_size(),
+        'paired' if adaptive_outputs.get_if_paired() else 'independent',
+        'target precision reached' if adaptive_outputs.get_if_converged() else 'budget reached'))
+    for key, name in (('cost', 'incremental discounted cost'), ('utility', 'incremental discounted utility'),
+                      ('ICER', 'ICER')):
+        print("  Half-length of the {:.{prec}%} CI of {}: {:.4f}".format(
+            1 - Data.ALPHA, name, half_lengths[key], prec=0))
+    print("")
+
+
+def _merge_outputs(cohort_id, therapy, states):
+    """ :returns: the outputs of all patients in the given cohort states """
+    cohort = MarkovCls.Cohort(id=cohort_id, therapy=therapy, pop_size=0)
+    return MarkovCls.BatchCohortOutputs(cohort, MarkovCls.CohortState.concatenate(states))
+
+
+def _get_incremental_stats(simOutputs_ref, simOutputs_new, paired):
+    """ :returns: list of the OnlineCovarianceStat of the paired differences in utility and cost (paired), or
+    of the OnlineCovarianceStat of the utility and cost of the reference and of the new therapy """
+    if paired:
+        return [Online.summarize_covariance('incremental utility and cost',
+                                            simOutputs_new.get_utilities(), simOutputs_new.get_costs(),
+                                            simOutputs_ref.get_utilities(), simOutputs_ref.get_costs())]
+    return [simOutputs_ref.get_sumStat_utility_cost(), simOutputs_new.get_sumStat_utility_cost()]
+
+
+def _get_half_lengths(stats, paired):
+    """ :returns: dictionary of the CI half-lengths of the incremental discounted cost, utility and ICER
+    :param stats: statistics of the utility and cost returned by _get_incremental_stats
+    """
+    if paired:
+        delta_stat = stats[0]
+        diffs = {'utility': delta_stat.get_linear_combination('utility', 1, 0),
+                 'cost': delta_stat.get_linear_combination('cost', 0, 1)}
+        means = delta_stat.get_mean()
+        # covariance matrix of the mean incremental utility and cost
+        cov = delta_stat.get_covariance() / delta_stat.get_n()
+    else:
+        stat_ref, stat_new = stats
+        diffs = {key: Online.OnlineDifferenceStatIndp(key, x=stat_new.get_linear_combination(key, *weights),
+                                                      y_ref=stat_ref.get_linear_combination(key, *weights))
+                 for key, weights in (('utility', (1, 0)), ('cost', (0, 1)))}
+        means = stat_new.get_mean() - stat_ref.get_mean()
+        cov = stat_new.get_covariance() / stat_new.get_n() + stat_ref.get_covariance() / stat_ref.get_n()
+
+    half_lengths = {}
+    for key, diff in diffs.items():
+        interval = diff.get_t_CI(alpha=Data.ALPHA)
+        half_lengths[key] = (interval[1] - interval[0]) / 2
+
+    half_lengths['ICER'] = _get_ICER_half_length(means[1], means[0], cov)
+    return half_lengths
+
+
+def _get_ICER_half_length(delta_cost, delta_utility, cov):
+    """ :returns: the half-length of the Data.ALPHA-level CI of the ICER (delta method)
+    :param delta_cost: mean incremental cost
+    :param delta_utility: mean incremental utility
+    :param cov: covariance matrix of the mean incremental utility and cost
+    """
+    if delta_utility == 0:
+        return np.inf
+
+    icer = delta_cost / delta_utility
+    var_icer = (cov[1, 1] - 2 * icer * cov[0, 1] + icer**2 * cov[0, 0]) / delta_utility**2
+    return stat.norm.ppf(1 - Data.ALPHA / 2) * np.sqrt(max(var_icer, 0))
+
+
+def _within(half_length, tolerance):
+    return tolerance is None or half_length <= tolerance
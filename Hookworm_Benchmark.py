@@ -0,0 +1,250 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import Hookworm_InputData as Data
+import Hookworm_ParameterClasses as P
+import Hookworm_MarkovModel as MarkovCls
+
+# population sizes and simulation lengths (years) of the full benchmark
+POP_SIZES = [10**2, 10**3, 10**4, 10**5, 10**6]
+SIM_LENGTHS = [10, 20, 50]
+# largest population simulated with the per-patient engine or with one parameter object per patient
+MAX_PER_PATIENT_POP_SIZE = 10**4
+
+
+def run_benchmarks(pop_sizes=None, sim_lengths=None, measure_memory=True, repeats=1):
+    """ times the simulation, output and reporting hot paths for all population sizes and simulation lengths
+    :param pop_sizes: list of population sizes (POP_SIZES if None)
+    :param sim_lengths: list of simulation lengths in years (SIM_LENGTHS if None)
+    :param measure_memory: set to True to also measure the peak memory of each case (in a separate run)
+    :param repeats: number of timed runs of each case (the fastest is reported)
+    :returns: dictionary with the environment and one result per case
+    """
+    if pop_sizes is None:
+        pop_sizes = POP_SIZES
+    if sim_lengths is None:
+        sim_lengths = SIM_LENGTHS
+
+    # store the settings that the benchmarks change (each case runs one cohort without PSA or transmission)
+    settings = (Data.SIM_LENGTH, Data.BATCH_ON, Data.EVENT_DRIVEN, Data.PSA_ON, Data.DYNAMIC_ON)
+    Data.PSA_ON = False
+    Data.DYNAMIC_ON = False
+    results = []
+    try:
+        for sim_length in sim_lengths:
+            Data.SIM_LENGTH = sim_length
+            for pop_size in pop_sizes:
+                for name, setup in _CASES:
+                    if name in _PER_PATIENT_CASES and pop_size > MAX_PER_PATIENT_POP_SIZE:
+                        continue
+                    results.append(_measure(name, setup, pop_size, sim_length, measure_memory, repeats))
+                    print(_format_result(results[-1]))
+    finally:
+        Data.SIM_LENGTH, Data.BATCH_ON, Data.EVENT_DRIVEN, Data.PSA_ON, Data.DYNAMIC_ON = settings
+
+    return dict(environment=_get_environment(), results=results)
+
+
+def save_results(benchmarks, file_name):
+    """ writes the results of run_benchmarks to a json file """
+    with open(file_name, 'w') as file:
+        json.dump(benchmarks, file, indent=2)
+
+
+def compare_results(file_name_ref, file_name_new):
+    """ prints the speed-up and the change in peak memory of each case between two json files of results
+    (e.g. of two commits) """
+    with open(file_name_ref) as file:
+        results_ref = {_get_case_key(r): r for r in json.load(file)['results']}
+    with open(file_name_new) as file:
+        results_new = {_get_case_key(r): r for r in json.load(file)['results']}
+
+    print("{:<28} {:>9} {:>6} {:>10} {:>12}".format('case', 'pop size', 'years', 'speed-up', 'memory'))
+    for key, result in results_new.items():
+        if key not in results_ref:
+            continue
+        ref = results_ref[key]
+        memory = ''
+        if result['peak_memory_mb'] is not None and ref['peak_memory_mb']:
+            memory = '{:+.0%}'.format(result['peak_memory_mb'] / ref['peak_memory_mb'] - 1)
+        print("{:<28} {:>9} {:>6} {:>9.2f}x {:>12}".format(
+            key[0], key[1], key[2], ref['seconds'] / result['seconds'], memory))
+
+
+def _measure(name, setup, pop_size, sim_length, measure_memory, repeats):
+    """ :returns: the result of a benchmark case
+    :param setup: function(pop_size) that prepares the case and returns the function to time
+    """
+    seconds = np.inf
+    for i in range(repeats):
+        run = setup(pop_size)
+        start = time.perf_counter()
+        run()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    peak_memory_mb = None
+    if measure_memory:
+        run = setup(pop_size)
+        tracemalloc.start()
+        run()
+        peak_memory_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    patient_steps = pop_size * P.get_fixed_parameters(P.Therapies.ANNUAL).get_num_steps(sim_length)
+    return dict(case=name,
+                pop_size=pop_size,
+                sim_length=sim_length,
+                seconds=seconds,
+                patients_per_sec=pop_size / seconds,
+                patient_steps_per_sec=patient_steps / seconds if name in _SIMULATION_CASES else None,
+                peak_memory_mb=peak_memory_mb)
+
+
+def _setup_patient_simulate(pop_size):
+    # the per-patient engine (Patient.simulate) with the random numbers of the cohort, as Cohort.simulate runs it
+    param = P.get_fixed_parameters(P.Therapies.ANNUAL)
+    patients = [MarkovCls.Patient(i, param) for i in range(pop_size)]
+    n_steps = param.get_num_steps(Data.SIM_LENGTH)
+    counter = MarkovCls.PrevalenceCounter(n_steps, param.get_delta_t())
+
+    def run():
+        uniforms = MarkovCls.get_patient_uniforms(0, 0, pop_size, n_steps)
+        for i, patient in enumerate(patients):
+            patient.simulate(Data.SIM_LENGTH, counter, None, uniforms[i].tolist())
+    return run
+
+
+def _setup_cohort_simulate(batch_on, event_driven):
+    def setup(pop_size):
+        Data.BATCH_ON = batch_on
+        Data.EVENT_DRIVEN = event_driven
+        cohort = MarkovCls.Cohort(id=0, therapy=P.Therapies.ANNUAL, pop_size=pop_size)
+        # in this process, so the timings and peak memory do not depend on the number of cores
+        return lambda: cohort.simulate(n_workers=1)
+    return setup
+
+
+def _setup_cohort_outputs(pop_size):
+    # constructing the outputs (summary statistics and curves) of a simulated cohort
+    cohort, state = _simulate(P.Therapies.ANNUAL, pop_size)
+    return lambda: MarkovCls.BatchCohortOutputs(cohort, state)
+
+
+def _setup_parameters_probabilistic(pop_size):
+    return lambda: [P.ParametersProbabilistic(i, P.Therapies.ANNUAL) for i in range(pop_size)]
+
+
+def _setup_sample_parameters(pop_size):
+    return lambda: P.get_sampled_parameters(P.Therapies.ANNUAL,
+                                            P.sample_parameters(P.Therapies.ANNUAL, pop_size, seed=0))
+
+
+def _setup_print_comparative_outcomes(pop_size):
+    import Hookworm_SupportMarkov as SupportMarkov
+    simOutputs_annual, simOutputs_semi = _simulate_outputs(pop_size)
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            SupportMarkov.print_comparative_outcomes(simOutputs_annual, simOutputs_semi)
+    return run
+
+
+def _setup_report_CEA_CBA(pop_size):
+    import Hookworm_SupportMarkov as SupportMarkov
+    simOutputs_annual, simOutputs_semi = _simulate_outputs(pop_size)
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            SupportMarkov.report_CEA_CBA(simOutputs_annual, simOutputs_semi)
+        # close the figures (if the report drew any with matplotlib)
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+    return run
+
+
+def _simulate(therapy, pop_size):
+    """ :returns: a cohort simulated with the batched engine and its state """
+    Data.BATCH_ON = True
+    Data.EVENT_DRIVEN = False
+    cohort = MarkovCls.Cohort(id=therapy.value, therapy=therapy, pop_size=pop_size)
+    return cohort, cohort.simulate().get_cohort_state()
+
+
+def _simulate_outputs(pop_size):
+    return [MarkovCls.BatchCohortOutputs(*_simulate(therapy, pop_size))
+            for therapy in (P.Therapies.ANNUAL, P.Therapies.SEMI)]
+
+
+# benchmark cases (name, setup function)
+_CASES = [('Patient.simulate', _setup_patient_simulate),
+          ('Cohort.simulate (per patient)', _setup_cohort_simulate(batch_on=False, event_driven=False)),
+          ('Cohort.simulate (batched)', _setup_cohort_simulate(batch_on=True, event_driven=False)),
+          ('Cohort.simulate (events)', _setup_cohort_simulate(batch_on=True, event_driven=True)),
+          ('CohortOutputs', _setup_cohort_outputs),
+          ('ParametersProbabilistic', _setup_parameters_probabilistic),
+          ('sample_parameters', _setup_sample_parameters),
+          ('print_comparative_outcomes', _setup_print_comparative_outcomes),
+          ('report_CEA_CBA', _setup_report_CEA_CBA)]
+_PER_PATIENT_CASES = ('Patient.simulate', 'Cohort.simulate (per patient)', 'ParametersProbabilistic')
+# cases that simulate patients over time steps (reported in patient-steps per second)
+_SIMULATION_CASES = ('Patient.simulate', 'Cohort.simulate (per patient)', 'Cohort.simulate (batched)',
+                     'Cohort.simulate (events)')
+
+
+def _get_case_key(result):
+    return result['case'], result['pop_size'], result['sim_length']
+
+
+def _format_result(result):
+    text = "{:<30} pop size {:>8}, {:>3} years: {:9.4f} s".format(
+        result['case'], result['pop_size'], result['sim_length'], result['seconds'])
+    if result['patient_steps_per_sec'] is not None:
+        text += ", {:12,.0f} patient-steps/s".format(result['patient_steps_per_sec'])
+    if result['peak_memory_mb'] is not None:
+        text += ", peak memory {:8.1f} MB".format(result['peak_memory_mb'])
+    return text
+
+
+def _get_environment():
+    """ :returns: the commit, versions and machine the benchmarks were run on """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return dict(commit=commit or None,
+                time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                python=platform.python_version(),
+                numpy=np.__version__,
+                machine=platform.machine(),
+                processor=platform.processor(),
+                cpu_count=os.cpu_count())
+
+
+if __name__ == '__main__':
+    # render figures off-screen
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+
+    parser = argparse.ArgumentParser(description='Benchmarks of the hookworm model.')
+    parser.add_argument('--quick', action='store_true', help='only population sizes up to 10^4 and 10 years')
+    parser.add_argument('--no-memory', action='store_true', help='do not measure peak memory')
+    parser.add_argument('--repeats', type=int, default=1, help='number of timed runs of each case')
+    parser.add_argument('--output', default='Hookworm_Benchmark.json', help='json file of the results')
+    parser.add_argument('--compare', help='json file of earlier results to compare with')
+    args = parser.parse_args()
+
+    benchmarks = run_benchmarks(pop_sizes=POP_SIZES[:3] if args.quick else None,
+                                sim_lengths=SIM_LENGTHS[:1] if args.quick else None,
+                                measure_memory=not args.no_memory,
+                                repeats=args.repeats)
+    save_results(benchmarks, args.output)
+    if args.compare:
+        compare_results(args.compare, args.output)
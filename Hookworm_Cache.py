@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import zipfile
+from enum import Enum
+import numpy as np
+import Hookworm_InputData as Data
+import Hookworm_ParameterClasses as P
+import Hookworm_MarkovModel as MarkovCls
+import Hookworm_RandomStreams as Streams
+import Hookworm_Transmission as Transmission
+
+# increase when a change of the model changes the simulation results (invalidates all cached results)
+MODEL_VERSION = 1
+
+# the source code of these modules is part of the key of cached results
+_MODEL_MODULES = (MarkovCls, P, Streams, Transmission)
+
+
+def simulate_cohort(id, therapy, pop_size=None, parameters=None, n_workers=1, cache_dir=None):
+    """ simulates a cohort (see Cohort), or reloads the outcomes of its patients from the cache if the cohort
+    was already simulated with the same inputs, parameters, seeds and model version
+    :param cache_dir: directory of the cache (Data.CACHE_DIR if None)
+    :returns: outputs of the cohort
+    """
+    cohort = MarkovCls.Cohort(id=id, therapy=therapy, pop_size=pop_size, parameters=parameters)
+    if not Data.CACHE_ON:
+        return cohort.simulate(n_workers)
+
+    key = get_key('cohort', id, cohort.get_initial_pop_size(), [therapy], [cohort.get_params()])
+    states = load(key, cache_dir)
+    if states is None:
+        outputs = cohort.simulate(n_workers)
+        save(key, [outputs.get_cohort_state()], cache_dir)
+        return outputs
+
+    return MarkovCls.BatchCohortOutputs(cohort, states[0])
+
+
+def simulate_paired_cohort(id, therapies, pop_size=None, parameters=None, n_workers=1, cache_dir=None):
+    """ simulates a cohort under several therapies with common random numbers (see PairedCohort), or reloads
+    the outcomes of its patients from the cache
+    :param cache_dir: directory of the cache (Data.CACHE_DIR if None)
+    :returns: list of outputs of the cohort (one per therapy)
+    """
+    paired_cohort = MarkovCls.PairedCohort(id=id, therapies=therapies, pop_size=pop_size, parameters=parameters)
+    if not Data.CACHE_ON:
+        return paired_cohort.simulate(n_workers)
+
+    cohorts = paired_cohort.get_cohorts()
+    key = get_key('paired', id, cohorts[0].get_initial_pop_size(), therapies,
+                  [cohort.get_params() for cohort in cohorts])
+    states = load(key, cache_dir)
+    if states is None:
+        outputs = paired_cohort.simulate(n_workers)
+        save(key, [output.get_cohort_state() for output in outputs], cache_dir)
+        return outputs
+
+    return [MarkovCls.BatchCohortOutputs(cohort, state) for cohort, state in zip(cohorts, states)]
+
+
+def get_key(kind, cohort_id, pop_size, therapies, params_of_arms):
+    """ :returns: the key of simulation results (a hash of everything the results depend on)
+    :param kind: 'cohort' or 'paired'
+    :param cohort_id: cohort id
+    :param pop_size: cohort population size
+    :param therapies: list of therapies
+    :param params_of_arms: list of the parameter objects of each therapy
+    """
+    # the key never records conflicting settings
+    MarkovCls.check_settings()
+    content = dict(kind=kind,
+                   cohort_id=cohort_id,
+                   pop_size=pop_size,
+                   therapies=therapies,
+                   parameters=[[_get_parameter_values(param) for param in params] for params in params_of_arms],
+                   # (not the chunk size: the random numbers of a patient do not depend on the chunks)
+                   settings=dict(sim_length=Data.SIM_LENGTH, delta_t=Data.DELTA_T,
+                                 batch_on=Data.BATCH_ON, event_driven=Data.EVENT_DRIVEN,
+                                 force_of_infection=None if not Data.DYNAMIC_ON
+                                 else Transmission.get_force_of_infection().get_settings()),
+                   seed_scheme=MarkovCls.SEED_SCHEME,
+                   model_version=MODEL_VERSION,
+                   model_source=_get_model_source_hash())
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=_to_json).encode()).hexdigest()
+
+
+def load(key, cache_dir=None):
+    """ :returns: the list of cohort states stored under the key (None if not in the cache; a damaged entry
+    is removed, so that the results are simulated and stored again) """
+    file_name = _get_file_name(key, cache_dir)
+    try:
+        with np.load(file_name) as data:
+            n_arms = int(data['n_arms'])
+            states = []
+            for i in range(n_arms):
+                counter = MarkovCls.PrevalenceCounter(0, float(data['delta_t']))
+                counter.occupancy = data['{}_occupancy'.format(i)]
+                counter.incidence = data['{}_incidence'.format(i)]
+                counter.treatments = data['{}_treatments'.format(i)]
+                state = MarkovCls.CohortState(0, counter=counter)
+                for name in MarkovCls.CohortState._patient_arrays + MarkovCls.CohortState._episode_arrays:
+                    setattr(state, name, data['{}_{}'.format(i, name)])
+                states.append(state)
+    except FileNotFoundError:
+        # not in the cache
+        return None
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        # an unreadable entry (e.g. truncated or overwritten)
+        invalidate(key, cache_dir)
+        return None
+
+    # mark the entry as recently used
+    os.utime(file_name)
+    return states
+
+
+def save(key, states, cache_dir=None):
+    """ stores a list of cohort states under the key, then evicts the least recently used entries
+    if the cache is larger than Data.CACHE_MAX_SIZE """
+    if cache_dir is None:
+        cache_dir = Data.CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+
+    arrays = dict(n_arms=len(states), delta_t=states[0].counter.delta_t)
+    for i, state in enumerate(states):
+        for name in MarkovCls.CohortState._patient_arrays + MarkovCls.CohortState._episode_arrays:
+            arrays['{}_{}'.format(i, name)] = getattr(state, name)
+        arrays['{}_occupancy'.format(i)] = state.counter.occupancy
+        arrays['{}_incidence'.format(i)] = state.counter.incidence
+        arrays['{}_treatments'.format(i)] = state.counter.treatments
+
+    # write to a temporary file first so that an interrupted write never leaves a corrupt entry
+    file_name = _get_file_name(key, cache_dir)
+    temp_file_name = file_name + '.{}.tmp'.format(os.getpid())
+    with open(temp_file_name, 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(temp_file_name, file_name)
+
+    evict(cache_dir, Data.CACHE_MAX_SIZE)
+
+
+def evict(cache_dir=None, max_size=None):
+    """ removes the least recently used entries until the cache is not larger than max_size bytes
+    (Data.CACHE_MAX_SIZE if None) """
+    if cache_dir is None:
+        cache_dir = Data.CACHE_DIR
+    if max_size is None:
+        max_size = Data.CACHE_MAX_SIZE
+
+    entries = _get_entries(cache_dir)
+    total_size = sum(entry.stat().st_size for entry in entries)
+    for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+        if total_size <= max_size:
+            break
+        total_size -= entry.stat().st_size
+        os.remove(entry.path)
+
+
+def invalidate(key, cache_dir=None):
+    """ removes the entry stored under the key (if any) """
+    try:
+        os.remove(_get_file_name(key, cache_dir))
+    except FileNotFoundError:
+        pass
+
+
+def clear(cache_dir=None):
+    """ removes all entries of the cache """
+    for entry in _get_entries(Data.CACHE_DIR if cache_dir is None else cache_dir):
+        os.remove(entry.path)
+
+
+def _get_entries(cache_dir):
+    if not os.path.isdir(cache_dir):
+        return []
+    return [entry for entry in os.scandir(cache_dir) if entry.name.endswith('.npz')]
+
+
+def _get_file_name(key, cache_dir):
+    return os.path.join(Data.CACHE_DIR if cache_dir is None else cache_dir, key + '.npz')
+
+
+def _get_parameter_values(param):
+    """ :returns: the values of a parameter object that the simulation results depend on """
+    return dict(type=type(param).__name__,
+                initial_state=param.get_initial_health_state(),
+                delta_t=param.get_delta_t(),
+                discount_rate=param.get_discount_rate(),
+                rate_matrix=param.get_rate_matrix(),
+                prob_matrix=[param.get_transition_prob(s) for s in P.HealthStats],
+                state_costs=[param.get_annual_state_cost(s) for s in P.HealthStats],
+                state_utilities=[param.get_annual_state_utility(s) for s in P.HealthStats],
+                treatment_cost=param.get_annual_treatment_cost())
+
+
+_modelSourceHash = None
+
+
+def _get_model_source_hash():
+    """ :returns: a hash of the source code of the model modules """
+    global _modelSourceHash
+    if _modelSourceHash is None:
+        source_hash = hashlib.sha256()
+        for module in _MODEL_MODULES:
+            with open(module.__file__, 'rb') as file:
+                source_hash.update(file.read())
+        _modelSourceHash = source_hash.hexdigest()
+    return _modelSourceHash
+
+
+def _to_json(value):
+    """ converts the values that json cannot serialize """
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('Cannot build a cache key from {!r}.'.format(value))
@@ -1,16 +1,14 @@
 import Hookworm_ParameterClasses as P
-import Hookworm_MarkovModel as MarkovCls
+import Hookworm_Cache as Cache
 import Hookworm_SupportMarkov as SupportMarkov
 
 # ANNUAL TREATMENT
-# create a cohort
-cohort_annual = MarkovCls.Cohort(id=0, therapy=P.Therapies.ANNUAL)
-simOutputs_annual = cohort_annual.simulate()
+# simulate a cohort (or reload it from the cache)
+simOutputs_annual = Cache.simulate_cohort(id=0, therapy=P.Therapies.ANNUAL)
 
 # SEMIANNUAL
-# create a cohort
-cohort_semi = MarkovCls.Cohort(id=1, therapy=P.Therapies.SEMI)
-simOutputs_semi = cohort_semi.simulate()
+# simulate a cohort (or reload it from the cache)
+simOutputs_semi = Cache.simulate_cohort(id=1, therapy=P.Therapies.SEMI)
 
 # draw survival curves and histograms
 SupportMarkov.draw_infection_curves_and_histograms(simOutputs_annual, simOutputs_semi)
@@ -0,0 +1,21 @@
+import Hookworm_ParameterClasses as P
+import Hookworm_Cache as Cache
+import Hookworm_SupportMarkov as SupportMarkov
+
+# ANNUAL AND SEMIANNUAL TREATMENT
+# one cohort simulated under both therapies with common random numbers (or reloaded from the cache)
+simOutputs_annual, simOutputs_semi = Cache.simulate_paired_cohort(
+    id=0, therapies=[P.Therapies.ANNUAL, P.Therapies.SEMI])
+
+# draw survival curves and histograms
+SupportMarkov.draw_infection_curves_and_histograms(simOutputs_annual, simOutputs_semi)
+
+# print the estimates
+SupportMarkov.print_outcomes(simOutputs_annual, "Annual MDA")
+SupportMarkov.print_outcomes(simOutputs_semi, "Semi-Annual MDA")
+
+# print paired comparative outcomes
+SupportMarkov.print_comparative_outcomes(simOutputs_annual, simOutputs_semi, paired=True)
+
+# report the paired CEA results
+SupportMarkov.report_CEA_CBA(simOutputs_annual, simOutputs_semi, paired=True)
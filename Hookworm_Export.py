@@ -0,0 +1,115 @@
+import json
+import os
+import numpy as np
+import Hookworm_MarkovModel as MarkovCls
+import Hookworm_OnlineStats as Online
+
+# per-patient outcomes stored as columns
+COLUMNS = MarkovCls.CohortState._patient_arrays
+# infection episodes stored as columns of a second table
+EPISODE_COLUMNS = MarkovCls.CohortState._episode_arrays
+# arrays of the prevalence counter
+COUNTER_ARRAYS = ('occupancy', 'incidence', 'treatments')
+
+
+def export_outputs(simOutputs, path, file_format='npy'):
+    """ writes the per-patient outcomes and the prevalence counter of a simulated cohort to a directory
+    :param simOutputs: outputs of a simulated cohort (not streaming)
+    :param path: directory to write to (created if needed)
+    :param file_format: 'npy' (one .npy file per column, which can be memory-mapped) or 'parquet'
+        (one Parquet file with a column per outcome, needs pyarrow; read back into memory)
+    """
+    state = simOutputs.get_cohort_state()
+    os.makedirs(path, exist_ok=True)
+
+    if file_format == 'npy':
+        for name in COLUMNS + EPISODE_COLUMNS:
+            np.save(os.path.join(path, name + '.npy'), getattr(state, name))
+    elif file_format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.table({name: getattr(state, name) for name in COLUMNS})
+        # one row group, so that each column is read back as one contiguous array
+        pq.write_table(table, os.path.join(path, 'outcomes.parquet'), row_group_size=max(1, len(state)))
+        table = pa.table({name: getattr(state, name) for name in EPISODE_COLUMNS})
+        pq.write_table(table, os.path.join(path, 'episodes.parquet'),
+                       row_group_size=max(1, len(state.episode_patients)))
+    else:
+        raise ValueError('Unknown file format {!r} (use npy or parquet).'.format(file_format))
+
+    for name in COUNTER_ARRAYS:
+        np.save(os.path.join(path, 'counter_' + name + '.npy'), getattr(state.counter, name))
+
+    with open(os.path.join(path, 'metadata.json'), 'w') as file:
+        json.dump(dict(cohort_id=simOutputs.get_cohort_id(), file_format=file_format, n_patients=len(state),
+                       delta_t=state.counter.delta_t), file)
+
+
+def load_outputs(path, mmap=True, chunk_size=1000000):
+    """ reads the outputs of a cohort written by export_outputs
+    :param path: directory written by export_outputs
+    :param mmap: set to True to memory-map the per-patient outcomes instead of reading them into memory
+        (only for the npy format: the columns of Parquet files are decoded into memory either way)
+    :param chunk_size: number of patients per chunk when calculating summary statistics
+    :returns: LoadedCohortOutputs
+    """
+    with open(os.path.join(path, 'metadata.json')) as file:
+        metadata = json.load(file)
+
+    counter = MarkovCls.PrevalenceCounter(0, metadata['delta_t'])
+    for name in COUNTER_ARRAYS:
+        setattr(counter, name, np.load(os.path.join(path, 'counter_' + name + '.npy')))
+
+    state = MarkovCls.CohortState(0, counter=counter)
+    if metadata['file_format'] == 'npy':
+        for name in COLUMNS + EPISODE_COLUMNS:
+            setattr(state, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None))
+    else:
+        # the columns are decoded into new arrays, so Parquet outputs are never memory-mapped
+        import pyarrow.parquet as pq
+        for file_name, columns in (('outcomes.parquet', COLUMNS), ('episodes.parquet', EPISODE_COLUMNS)):
+            table = pq.read_table(os.path.join(path, file_name))
+            for name in columns:
+                setattr(state, name, table.column(name).to_numpy())
+
+    return LoadedCohortOutputs(metadata['cohort_id'], state, chunk_size)
+
+
+class LoadedCohortOutputs(MarkovCls.CohortOutputs):
+    def __init__(self, cohort_id, cohort_state, chunk_size=1000000):
+        """ outputs of a cohort read by load_outputs; the summary statistics are calculated in chunks,
+        so the per-patient outcomes can stay memory-mapped (npy format)
+        :param cohort_id: id of the simulated cohort
+        :param cohort_state: the cohort state with (memory-mapped) per-patient arrays
+        :param chunk_size: number of patients per chunk when calculating summary statistics
+        """
+        # the summary statistics are calculated in chunks of this size
+        self._chunkSize = chunk_size
+        self._set_state(cohort_id, cohort_state)
+
+    def _calculate_summary_stats(self):
+
+        # summary statistics (calculated in chunks)
+        self._sumStat_infectionTime = Online.summarize(
+            'Patient infection time', self._infectionTimes, self._chunkSize)
+        self._sumStat_episodeDuration = Online.summarize_difference(
+            'Infection episode duration', self._cohortState.episode_ends, self._cohortState.episode_starts,
+            self._chunkSize)
+        self._sumStat_number_infections = Online.summarize(
+            'Time until infection', self._count_infections, self._chunkSize)
+        self._sumStat_cost = Online.summarize('Patient discounted cost', self._costs, self._chunkSize)
+        self._sumStat_utility = Online.summarize('Patient discounted utility', self._utilities, self._chunkSize)
+        self._sumStat_treated = Online.summarize(
+            'Number of Infections Treated', self._count_treated, self._chunkSize)
+        self._sumStat_infection_episodes = Online.summarize(
+            'Number of infections', self._count_infection_episodes, self._chunkSize)
+        self._sumStat_treatment_episodes = Online.summarize(
+            'Number of treatments', self._count_treatment_episodes, self._chunkSize)
+        self._sumStat_utilityCost = Online.summarize_covariance(
+            'Patient discounted utility and cost', self._utilities, self._costs, chunk_size=self._chunkSize)
+
+    def is_memory_mapped(self):
+        return isinstance(self._costs, np.memmap)
+
+    def get_chunk_size(self):
+        return self._chunkSize
@@ -1,3 +1,4 @@
+import os
 import numpy as np
 
 # simulation settings
@@ -9,6 +10,32 @@ DISCOUNT = 0.03     # daily discount rate
 DELTA_T = 1/12
 
 PSA_ON = False
+PSA_N_DRAWS = 1000  # number of parameter draws in a probabilistic sensitivity analysis
+PSA_TRANS_SAMPLE_SIZE = 1000    # effective sample size of the Dirichlet distributions of transition probabilities
+
+BATCH_ON = True     # simulate the whole cohort at once with the vectorized engine
+EVENT_DRIVEN = False    # simulate in continuous time from the transition rates (no time steps)
+CHUNK_SIZE = 10000  # number of patients in each chunk of a (parallel) cohort simulation
+PARAM_CACHE_SIZE = 128  # maximum number of cached transition probability matrices
+
+# dynamic transmission: the rate of infection (S-->I) at each time step depends on the infected fraction of the
+# cohort (see Hookworm_Transmission), so all patients are simulated together with the batched engine (EVENT_DRIVEN
+# must be off)
+DYNAMIC_ON = False
+FORCE_OF_INFECTION = 'linear'   # shape of the force of infection ('linear' or 'saturating')
+BASELINE_PREVALENCE = 0.067     # infected fraction at which the rate of infection is a (equilibrium under annual MDA)
+WITHIN_POPULATION_TRANSMISSION = 0.8    # share of the infections at the baseline prevalence from within the cohort
+
+CACHE_ON = True     # reload simulation results from the on-disk cache instead of re-simulating
+CACHE_DIR = '.hookworm_cache'   # directory of the simulation result cache
+CACHE_MAX_SIZE = 2**30  # maximum size of the simulation result cache (bytes)
+
+PROFILE_ON = False  # time the phases of each run (also enabled by the environment variable HOOKWORM_PROFILE)
+
+# save figures to files instead of showing them, and write the reports as csv/json files
+# (also enabled by the environment variable HOOKWORM_HEADLESS)
+HEADLESS = os.environ.get('HOOKWORM_HEADLESS', '') not in ('', '0')
+REPORT_DIR = 'Hookworm_Reports'     # directory of the figures and reports of headless runs
 
 #Transmission Rate (Rate of infection S-->I)
 a = -np.log(1-(6.5/100))
@@ -1,21 +1,62 @@
-import scr.SamplePathClasses as PathCls
+import bisect
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import scr.StatisticalClasses as StatCls
 import scr.RandomVariantGenerators as rndClasses
-import scr.EconEvalClasses as EconCls
 import Hookworm_ParameterClasses as P
 import Hookworm_InputData as Data
+import Hookworm_OnlineStats as Online
+import Hookworm_Profiling as Profiling
+import Hookworm_RandomStreams as Streams
+import Hookworm_Transmission as Transmission
 
 # patient class simulates patient, patient monitor follows patient, cohort simulates a cohort,
 #  cohort outcome extracts info from simulation and returns it back
 
+# how the random number streams of patients are seeded (part of the key of cached simulation results)
+SEED_SCHEME = 'RandomStreams(cohort id): Philox keyed by (kind, step or event), position = patient index'
+
+# integer codes of the health states used by the simulation core (HealthStats is only used at the API boundary)
+WELL = P.HealthStats.WELL.value
+INFECTED = P.HealthStats.INFECTED.value
+TREATMENT = P.HealthStats.TREATMENT.value
+N_STATES = len(P.HealthStats)
+
+# the simulation mode named in errors about parameters without transition rates in dynamic transmission
+_DYNAMIC_MODE = 'The dynamic transmission mode (DYNAMIC_ON)'
+
+# effects of a transition (from, to) during a time step on the bookkeeping of a patient
+COUNTS_INFECTED, COUNTS_TREATED, STARTS_INFECTION, ENDS_INFECTION, STARTS_TREATMENT = range(5)
+
+
+def get_transition_effects():
+    """ :returns: (from x to x effects) int8 array of the effects of each transition during a time step:
+        counts an infected time step, counts a treated time step, starts an infection episode, ends an
+        infection episode and starts a treatment (1 if the transition has the effect, 0 otherwise) """
+    effects = np.zeros((N_STATES, N_STATES, 5), dtype=np.int8)
+    effects[INFECTED, :, COUNTS_INFECTED] = 1
+    effects[TREATMENT, :, COUNTS_TREATED] = 1
+    effects[WELL, INFECTED, STARTS_INFECTION] = 1
+    effects[INFECTED, [WELL, TREATMENT], ENDS_INFECTION] = 1
+    effects[INFECTED, TREATMENT, STARTS_TREATMENT] = 1
+    return effects
+
+
+TRANSITION_EFFECTS = get_transition_effects()
+# the same table as nested lists of tuples of Python integers (from -> to -> effects) for the per-patient engine
+_TRANSITION_EFFECT_TUPLES = [[tuple(effects) for effects in row] for row in TRANSITION_EFFECTS.tolist()]
+# the table flattened to from*n_states+to for the batched engine
+_FLAT_TRANSITION_EFFECTS = TRANSITION_EFFECTS.reshape(N_STATES*N_STATES, -1)
+
 
 class Patient:
+    __slots__ = ('_id', '_rng', '_param', '_stateMonitor', '_delta_t')
+
     def __init__(self, id, parameters):
         """ initiates a patient
         :param id: ID of the patient
         :param parameters: parameter object
         """
-        self._infectionTime = []
         self._id = id
         # random number generator
         self._rng = None
@@ -26,33 +67,97 @@ class Patient:
         # simulate time step
         self._delta_t = parameters.get_delta_t() # length of time step
 
-    def simulate(self, sim_length):
-        """ simulate the patient over the specified simulation length """
+    def simulate(self, sim_length, counter=None, trajectory=None, uniforms=None):
+        """ simulate the patient over the specified simulation length
+        :param counter: (optional) PrevalenceCounter to record the state of this patient at each time step
+        :param trajectory: (optional) uint8 array to record the state of this patient at the start of each
+            time step (and at the end of the simulation)
+        :param uniforms: (optional) uniform random numbers of this patient at each time step (e.g. from
+            RandomStreams.get_uniforms); the new state is then sampled by inversion, with the same numbers
+            as the batched engine. If None, a random number generator seeded with the patient id is used.
+        """
+        if uniforms is not None:
+            self._simulate_uniforms(sim_length, counter, trajectory, uniforms)
+            return
+
         # random number generator for this patient
         self._rng = rndClasses.RNG(self._id)  # from now on use random number generator from support library
 
+        # empirical distribution of the future state from each state
+        empirical_dists = [rndClasses.Empirical(self._param.get_transition_prob(s)) for s in P.HealthStats]
+
         k = 0  # current time step
+        state_index = self._stateMonitor.get_state_code()
+        if trajectory is not None:
+            trajectory[0] = state_index
 
         # while the patient is alive and simulation length is not yet reached
         while k*self._delta_t < sim_length:
-            # find transition probabilities of future state
-            trans_prob = self._param.get_transition_prob(self._stateMonitor.get_current_state())
-            # create an empirical distribution
-            empirical_dist = rndClasses.Empirical(trans_prob)
             # sample from the empirical distribution to get a new state
             # (return an intger from {0, 1, 2, ...}
-            new_state_index = empirical_dist.sample(self._rng) # pass RNG
+            new_state_index = int(empirical_dists[state_index].sample(self._rng))  # pass RNG
+
+            if counter is not None:
+                counter.record_patient(k, state_index, new_state_index)
+            if trajectory is not None:
+                trajectory[k + 1] = new_state_index
+
+            # update health state
+            self._stateMonitor.update(k, new_state_index)
+            state_index = new_state_index
+
+            # increment time step
+            k += 1
+
+    def _simulate_uniforms(self, sim_length, counter, trajectory, uniforms):
+        """ simulate the patient with the given uniform random numbers (see simulate) """
+        # cumulative transition probabilities of each state
+        cum_probs = []
+        for s in P.HealthStats:
+            cum_prob = np.cumsum(self._param.get_transition_prob(s)).tolist()
+            cum_prob[-1] = 1
+            cum_probs.append(cum_prob)
+
+        k = 0  # current time step
+        state_index = self._stateMonitor.get_state_code()
+        if trajectory is not None:
+            trajectory[0] = state_index
+
+        # while the simulation length is not yet reached
+        while k*self._delta_t < sim_length:
+            # sample the new state by inversion (the number of cumulative probabilities below the uniform)
+            new_state_index = bisect.bisect_left(cum_probs[state_index], uniforms[k])
+
+            if counter is not None:
+                counter.record_patient(k, state_index, new_state_index)
+            if trajectory is not None:
+                trajectory[k + 1] = new_state_index
 
             # update health state
-            self._stateMonitor.update(k, P.HealthStats(new_state_index))
+            self._stateMonitor.update(k, new_state_index)
+            state_index = new_state_index
 
             # increment time step
             k += 1
 
+    def get_current_state(self):
+        return self._stateMonitor.get_current_state()
+
+    def get_state_code(self):
+        """ :returns: the integer code of the current health state """
+        return self._stateMonitor.get_state_code()
+
     def get_infection_duration(self):
         """ returns the patient's infection time"""
         return self._stateMonitor.get_infection_duration()
 
+    def get_infection_start(self):
+        return self._stateMonitor.get_infection_start()
+
+    def get_infection_episodes(self):
+        """ returns the (start, end) of the patient's completed infection episodes """
+        return self._stateMonitor.get_infection_episodes()
+
     def get_number_of_infections(self):
         """ returns the patient's time to the POST_STROKE state """
         return self._stateMonitor.get_number_of_infections()
@@ -60,6 +165,12 @@ class Patient:
     def get_number_of_treated(self):
         return self._stateMonitor.get_number_of_treated()
 
+    def get_number_of_infection_episodes(self):
+        return self._stateMonitor.get_number_of_infection_episodes()
+
+    def get_number_of_treatment_episodes(self):
+        return self._stateMonitor.get_number_of_treatment_episodes()
+
     def get_total_discounted_cost(self):
         return self._stateMonitor.get_total_discounted_cost()
 
@@ -69,62 +180,66 @@ class Patient:
 
 class PatientStateMonitor:
     """ to update patient outcomes (years survived, cost, etc.) throughout the simulation """
+    __slots__ = ('_currentState', '_delta_t', '_transmissionTime', '_infectionTime', '_ifDevelopedInfection',
+                 '_infectioncount', '_numberTreated', '_infectionEpisodes', '_treatmentEpisodes', '_episodes',
+                 '_costUtilityOutcomes')
+
     def __init__(self, parameters):
         """
         :param parameters: patient parameters
         """
-        # current health state
-        self._currentState = parameters.get_initial_health_state()
+        # integer code of the current health state
+        self._currentState = parameters.get_initial_health_state().value
         self._delta_t = parameters.get_delta_t()
         self._transmissionTime = 0
         self._infectionTime = 0
         self._ifDevelopedInfection = False
-        self._infectioncount = 0
-        self._numberTreated = 0
+        self._infectioncount = 0    # number of infected time steps
+        self._numberTreated = 0     # number of time steps in treatment
+        self._infectionEpisodes = 0
+        self._treatmentEpisodes = 0
+        self._episodes = []     # (start, end) of completed infection episodes
 
         self._costUtilityOutcomes = PatientCostUtilityMonitor(parameters)
 
     def update(self, k, next_state):
         """
         :param k: current time step
-        :param next_state: next state
+        :param next_state: integer code of the next state
         """
-
-        # update infection count
-        if self._currentState == P.HealthStats.INFECTED:
-            self._ifDevelopedInfection= True
-            self._infectioncount += 1
-
-        #update treatment count
-        if self._currentState ==P.HealthStats.TREATMENT:
-            self._numberTreated +=1
-
+        # effects of the transition (see get_transition_effects)
+        counts_infected, counts_treated, starts_infection, ends_infection, starts_treatment = \
+            _TRANSITION_EFFECT_TUPLES[self._currentState][next_state]
+
+        # update infection and treatment counts
+        if counts_infected:
+            self._ifDevelopedInfection = True
+        self._infectioncount += counts_infected
+        self._numberTreated += counts_treated
+        self._infectionEpisodes += starts_infection
+        self._treatmentEpisodes += starts_treatment
 
         self._costUtilityOutcomes.update(k, self._currentState, next_state)
 
-        self._currentState = next_state
-
-
-        #update start of infection
-        if self._currentState == P.HealthStats.WELL:
-            if next_state == P.HealthStats.INFECTED:
-                self._transmissionTime = (k+0.5) * self._delta_t
+        # update start of infection
+        if starts_infection:
+            self._transmissionTime = (k+0.5) * self._delta_t
 
         # update infection time
-        if self._currentState == P.HealthStats.INFECTED:
-            if next_state in [P.HealthStats.WELL, P.HealthStats.TREATMENT]:
-                self._infectionTime = (k+0.5) * self._delta_t - self._transmissionTime
-                self._infectionTime.append((k+0.5) * self._delta_t - self._transmissionTime)
+        if ends_infection:
+            self._infectionTime = (k+0.5) * self._delta_t - self._transmissionTime
+            self._episodes.append((self._transmissionTime, (k+0.5) * self._delta_t))
 
+        self._currentState = next_state
 
     def get_if_infected(self):
-        if self._currentState == P.HealthStats.INFECTED:
-            result = True
-        if self._currentState in [P.HealthStats.WELL, P.HealthStats.TREATMENT]:
-            result = False
-            return result
+        return self._currentState == INFECTED
 
     def get_current_state(self):
+        return P.HealthStats(self._currentState)
+
+    def get_state_code(self):
+        """ :returns: the integer code of the current health state """
         return self._currentState
 
     def get_infection_duration(self):
@@ -132,12 +247,26 @@ class PatientStateMonitor:
         # return infection time only if the patient has died
         return self._infectionTime
 
+    def get_infection_start(self):
+        """ :returns: the start of the current (or last) infection """
+        return self._transmissionTime
+
+    def get_infection_episodes(self):
+        """ :returns: list of the (start, end) of the completed infection episodes """
+        return self._episodes
+
     def get_number_of_infections(self):
         return self._infectioncount
 
     def get_number_of_treated(self):
         return self._numberTreated
 
+    def get_number_of_infection_episodes(self):
+        return self._infectionEpisodes
+
+    def get_number_of_treatment_episodes(self):
+        return self._treatmentEpisodes
+
     def get_total_discounted_cost(self):
         return self._costUtilityOutcomes.get_total_discounted_cost()
 
@@ -146,30 +275,33 @@ class PatientStateMonitor:
 
 
 class PatientCostUtilityMonitor:
+    __slots__ = ('_param', '_totalDiscountedCost', '_totalDiscountedUtility', '_costTable', '_utilityTable',
+                 '_discountFactors')
 
     def __init__(self, parameters):
         self._param = parameters
         self._totalDiscountedCost = 0
         self._totalDiscountedUtility = 0
 
-    def update(self, k, current_state, next_state):
-
-        # state cost and utility
-        cost = 0.5*(self._param.get_annual_state_cost(current_state)
-                    +(self._param.get_annual_state_cost(next_state))) * self._param.get_delta_t()
-
-        utility = 0.5 * (self._param.get_annual_state_utility(current_state) +
-                         (self._param.get_annual_state_utility(next_state))) * self._param.get_delta_t()
+        # cost and utility of each transition (from, to) over one time step
+        self._costTable = parameters.get_transition_cost_table().tolist()
+        self._utilityTable = parameters.get_transition_utility_table().tolist()
+        # discount factors of time steps
+        self._discountFactors = parameters.get_discount_factors(parameters.get_num_steps(Data.SIM_LENGTH))
 
-        # treatment cost (incurred only in post-stroke state)
-        if current_state is P.HealthStats.TREATMENT:
-            if next_state is P.HealthStats.WELL:
-                cost += 0.5*self._param.get_annual_treatment_cost() * self._param.get_delta_t()
-            else:
-                cost += 1*self._param.get_annual_treatment_cost() * self._param.get_delta_t()
+    def update(self, k, current_state, next_state):
+        """
+        :param k: current time step
+        :param current_state: integer code of the current state
+        :param next_state: integer code of the next state
+        """
+        if k >= len(self._discountFactors):
+            self._discountFactors = self._param.get_discount_factors(2*k+1)
+        discount = self._discountFactors[k]
 
-        self._totalDiscountedCost += EconCls.pv(cost, self._param.get_adj_discount_rate()/2, 2*k+1)
-        self._totalDiscountedUtility += EconCls.pv(utility, self._param.get_adj_discount_rate()/2, 2*k+1)
+        # state cost and utility (including the treatment cost)
+        self._totalDiscountedCost += discount * self._costTable[current_state][next_state]
+        self._totalDiscountedUtility += discount * self._utilityTable[current_state][next_state]
 
     def get_total_discounted_cost(self):
         return self._totalDiscountedCost
@@ -180,82 +312,993 @@ class PatientCostUtilityMonitor:
 
 class Cohort:
 
-    def __init__(self, id, therapy):
+    def __init__(self, id, therapy, pop_size=None, parameters=None):
         """ create a cohort of patients
         :param id: an integer to specify the seed of the random number generator
+        :param pop_size: cohort population size (Data.POP_SIZE if None)
+        :param parameters: (optional) parameter object shared by all patients, e.g. one parameter draw
+            of a probabilistic sensitivity analysis (the parameters of the therapy if None)
         """
-        self._initial_pop_size = Data.POP_SIZE
+        self._id = id
+        self._initial_pop_size = Data.POP_SIZE if pop_size is None else pop_size
         self._patients = []      # list of patients
+        self._params = []        # parameter objects (one shared by all patients or one per patient)
+        self._state = None       # arrays of patient states and outcomes after a batched or parallel simulation
+        self._counter = None     # number of patients in each state at each time step
+        self._trajectoryFile = None  # file of the recorded health states of patients
+        check_settings()
+
+        # populate the cohort (parameters and patients)
+        with Profiling.phase('Cohort.__init__ (parameters and patients)'):
+            if not _uses_patients() and (parameters is not None or not Data.PSA_ON):
+                # the batched and event-driven engines only need the parameters, which all patients share
+                self._params.append(P.get_fixed_parameters(therapy) if parameters is None else parameters)
+                return
+
+            if Data.PSA_ON and parameters is None:
+                # draw the parameters of all patients at once, seeded with the cohort id: each cohort gets its
+                # own draws, and patient i of a cohort has the same cost and utility draws under all therapies
+                sampled_params = P.get_sampled_parameters(
+                    therapy, P.sample_parameters(therapy, self._initial_pop_size, seed=id))
+
+            for i in range(self._initial_pop_size):
+                # create a new patient (use id * pop_size + i as patient id)
+                if parameters is not None:
+                    param = parameters
+                elif Data.PSA_ON:
+                    param = sampled_params[i]
+                else:
+                    param = P.get_fixed_parameters(therapy)
+
+                if (Data.PSA_ON and parameters is None) or not self._params:
+                    self._params.append(param)
+                if _uses_patients():
+                    patient = Patient(id * self._initial_pop_size + i, param)
+                    # add the patient to the cohort
+                    self._patients.append(patient)
+
+    def simulate(self, n_workers=1, streaming=False, trajectory_file=None):
+        """ simulate the cohort of patients over the specified number of time-steps
+        :param n_workers: number of worker processes (None to use all cores); when not 1, patients are
+            split into chunks of Data.CHUNK_SIZE that are simulated in parallel. The outputs do not depend
+            on the number of workers.
+        :param streaming: set to True to fold the outcomes of each chunk into summary statistics as soon as
+            the chunk is simulated instead of keeping the outcomes of every patient
+        :param trajectory_file: (optional) name of a .npy file to record the health state of every patient
+            at the start of each time step into a (patients x time steps + 1) uint8 memory-mapped array
+            (see get_trajectories)
+        :returns outputs from simulating this cohort
+        """
 
-        # populate the cohort
-        for i in range(self._initial_pop_size):
-            # create a new patient (use id * pop_size + i as patient id)
-            if Data.PSA_ON:
-                patient = Patient(id* self._initial_pop_size + i, P.ParametersProbabilistic(i, therapy))
+        if trajectory_file is not None:
+            # create the file, each chunk writes the rows of its patients
+            n_steps = self._params[0].get_num_steps(Data.SIM_LENGTH)
+            trajectories = np.lib.format.open_memmap(trajectory_file, mode='w+', dtype=np.uint8,
+                                                     shape=(self._initial_pop_size, n_steps + 1))
+            del trajectories
+        self._trajectoryFile = trajectory_file
+
+        # simulate the chunks of patients (in the order of chunks)
+        chunks = self._get_chunks(trajectory_file)
+        with Profiling.phase('Cohort.simulate (chunks)'):
+            if n_workers == 1:
+                return self._collect(map(_simulate_chunk, chunks), streaming)
             else:
-                patient = Patient(id * self._initial_pop_size + i, P._ParametersFixed(therapy))
-            # add the patient to the cohort
-            self._patients.append(patient)
+                with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                    return self._collect(executor.map(_simulate_chunk, chunks), streaming)
 
-    def simulate(self):
-        """ simulate the cohort of patients over the specified number of time-steps
-        :returns outputs from simulating this cohort
+    def _collect(self, results, streaming):
+        """ :returns: the cohort outputs from the states of simulated chunks
+        :param results: iterator over the states of simulated chunks (in the order of chunks)
+        :param streaming: set to True to only keep summary statistics
+        """
+        if streaming:
+            outputs = StreamingCohortOutputs(self)
+            for result in results:
+                outputs.add(result)
+            self._counter = outputs.get_prevalence_counter()
+            return outputs
+
+        # merge the states of all chunks
+        self._state = CohortState.concatenate(list(results))
+        self._counter = self._state.counter
+
+        return BatchCohortOutputs(self, self._state)
+
+    def _get_chunks(self, trajectory_file=None):
+        """ :returns: list of arguments to simulate each chunk of Data.CHUNK_SIZE patients (one chunk of all
+        patients in the dynamic transmission mode, where the rate of infection depends on the whole cohort)
+        :param trajectory_file: (optional) name of the .npy file to record the trajectories of patients to
+        """
+        chunks = []
+        chunk_size = _get_chunk_size(self._initial_pop_size)
+        for start in range(0, self._initial_pop_size, chunk_size):
+            stop = min(start + chunk_size, self._initial_pop_size)
+            # the file and first row to record the trajectories of the patients of this chunk to
+            trajectory = None if trajectory_file is None else (trajectory_file, start)
+            if Data.DYNAMIC_ON:
+                chunks.append(('batch', self.get_params(start, stop), stop - start,
+                               self._id, Data.SIM_LENGTH, trajectory, start, Transmission.get_force_of_infection()))
+            elif Data.EVENT_DRIVEN:
+                chunks.append(('events', self.get_params(start, stop), stop - start,
+                               self._id, Data.SIM_LENGTH, trajectory, start))
+            elif Data.BATCH_ON:
+                chunks.append(('batch', self.get_params(start, stop), stop - start,
+                               self._id, Data.SIM_LENGTH, trajectory, start))
+            else:
+                chunks.append(('patients', self._patients[start:stop],
+                               self._params[0].get_num_steps(Data.SIM_LENGTH), self._params[0].get_delta_t(),
+                               Data.SIM_LENGTH, trajectory, self._id, start))
+        return chunks
+
+    def simulate_expected(self):
+        """ calculates the expected outcomes of the cohort by propagating the state-occupancy
+        vector through the transition probability matrix (no Monte Carlo sampling)
+        :returns expected outputs of this cohort
         """
+        force_of_infection = Transmission.get_force_of_infection()
+        return ExpectedCohortOutputs(self, [trace_expected(param, Data.SIM_LENGTH, force_of_infection)
+                                            for param in self._params])
 
-        # simulate all patients
-        for patient in self._patients:
-            patient.simulate(Data.SIM_LENGTH)
+    def get_id(self):
+        return self._id
 
-        # return the cohort outputs
-        return CohortOutputs(self)
+    def get_params(self, start=0, stop=None):
+        """ :returns: the list of parameter objects of patients start to stop (one object if all patients
+        share the same parameters) """
+        if len(self._params) > 1:
+            return self._params[start:stop]
+        return self._params
 
     def get_initial_pop_size(self):
         return self._initial_pop_size
 
+    def get_prevalence_counter(self):
+        """ :returns: the number of patients in each state at each time step of the last simulation """
+        return self._counter
+
+    def get_trajectories(self):
+        """ :returns: the recorded health states (patients x time steps + 1) of the last simulation as a
+        read-only memory-mapped array (None if the trajectories were not recorded) """
+        if self._trajectoryFile is None:
+            return None
+        return load_trajectories(self._trajectoryFile)
+
     def get_patients(self):
+        """ :returns: the patients of this cohort (lightweight views of the cohort state once the cohort
+        is simulated) """
+        if self._state is not None:
+            return self._state.get_patients()
         return self._patients
 
 
-class CohortOutputs:
-    def __init__(self, simulated_cohort):
-        """ extracts outputs from a simulated cohort
-        :param simulated_cohort: a cohort after being simulated
+class PairedCohort:
+
+    def __init__(self, id, therapies, pop_size=None, parameters=None):
+        """ create a cohort of patients that is simulated under several therapies using common random
+        numbers (each patient uses the same random numbers under all therapies)
+        :param id: an integer to specify the seed of the random number generator
+        :param therapies: list of therapies
+        :param pop_size: cohort population size (Data.POP_SIZE if None)
+        :param parameters: (optional) list of the parameter objects of each therapy (see Cohort)
+        """
+        self._id = id
+        if parameters is None:
+            parameters = [None] * len(therapies)
+        self._cohorts = [Cohort(id, therapy, pop_size, param) for therapy, param in zip(therapies, parameters)]
+
+    def get_cohorts(self):
+        """ :returns: the cohorts of the therapies """
+        return self._cohorts
+
+    def simulate(self, n_workers=1):
+        """ simulate the cohort under all therapies in one pass with the batched engine (with the
+        event-driven engine, each patient uses the same random numbers at each event under all therapies;
+        in the dynamic transmission mode, the rate of infection of each therapy depends on its own prevalence)
+        :param n_workers: number of worker processes (see Cohort.simulate)
+        :returns list of outputs from simulating the cohort (one per therapy)
+        """
+        pop_size = self._cohorts[0].get_initial_pop_size()
+        chunk_size = _get_chunk_size(pop_size)
+        chunks = []
+        for start in range(0, pop_size, chunk_size):
+            stop = min(start + chunk_size, pop_size)
+            params_of_arms = [cohort.get_params(start, stop) for cohort in self._cohorts]
+            if Data.DYNAMIC_ON:
+                chunks.append(('paired', params_of_arms, stop - start, self._id, Data.SIM_LENGTH, None, start,
+                               Transmission.get_force_of_infection()))
+            else:
+                chunks.append(('paired_events' if Data.EVENT_DRIVEN else 'paired', params_of_arms, stop - start,
+                               self._id, Data.SIM_LENGTH, None, start))
+
+        if n_workers == 1:
+            results = list(map(_simulate_chunk, chunks))
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                results = list(executor.map(_simulate_chunk, chunks))
+
+        # merge the states of all chunks of each therapy
+        outputs = []
+        for i, cohort in enumerate(self._cohorts):
+            outputs.append(BatchCohortOutputs(cohort, CohortState.concatenate([result[i] for result in results])))
+        return outputs
+
+
+def _uses_patients():
+    """ :returns: True if cohorts are simulated patient by patient with Patient objects (False if the batched,
+    event-driven or dynamic transmission engine simulates them from their parameters) """
+    return not (Data.BATCH_ON or Data.EVENT_DRIVEN or Data.DYNAMIC_ON)
+
+
+def check_settings():
+    """ raises a ValueError if the simulation settings conflict: the dynamic transmission mode simulates
+    all patients together with the batched engine, so it cannot be combined with the event-driven engine """
+    if Data.DYNAMIC_ON and Data.EVENT_DRIVEN:
+        raise ValueError('The dynamic transmission mode (DYNAMIC_ON) runs on the batched engine and cannot be '
+                         'combined with the event-driven engine (turn EVENT_DRIVEN off).')
+
+
+def _get_chunk_size(pop_size):
+    """ :returns: the number of patients in each chunk (all patients in the dynamic transmission mode) """
+    if Data.DYNAMIC_ON:
+        return max(1, pop_size)
+    return Data.CHUNK_SIZE
+
+
+def _simulate_chunk(args):
+    """ simulates a chunk of patients (runs in a worker process when simulating in parallel)
+    :param args: ('patients', patients, n_steps, delta_t, sim_length, trajectory, seed, first_patient),
+        ('batch', *arguments of simulate_batch),
+        ('paired', *arguments of simulate_batch_arms), ('events', *arguments of simulate_events)
+        or ('paired_events', params_of_arms, pop_size, seed, sim_length, trajectory (None), first_patient)
+    :returns: the state of the simulated chunk (list of states of the arms for 'paired' and 'paired_events')
+    """
+    if args[0] == 'patients':
+        patients, n_steps, delta_t, sim_length, trajectory, seed, first_patient = args[1:]
+        counter = PrevalenceCounter(n_steps, delta_t)
+        buffer = None if trajectory is None else np.zeros((len(patients), n_steps + 1), dtype=np.uint8)
+        uniforms = get_patient_uniforms(seed, first_patient, len(patients), n_steps)
+        with Profiling.phase('Patient.simulate'):
+            for i, patient in enumerate(patients):
+                patient.simulate(sim_length, counter, None if buffer is None else buffer[i], uniforms[i].tolist())
+        Profiling.count('patients simulated', len(patients))
+        Profiling.count('patient-steps (PatientCostUtilityMonitor.update calls)', len(patients) * n_steps)
+        if trajectory is not None:
+            write_trajectories(trajectory, buffer)
+        return CohortState.from_patients(patients, counter)
+    elif args[0] == 'paired':
+        return simulate_batch_arms(*args[1:])
+    elif args[0] == 'events':
+        return simulate_events(*args[1:])
+    elif args[0] == 'paired_events':
+        params_of_arms, pop_size, seed, sim_length, trajectory, first_patient = args[1:]
+        return [simulate_events(params, pop_size, seed, sim_length, None, first_patient)
+                for params in params_of_arms]
+    else:
+        return simulate_batch(*args[1:])
+
+
+class CohortState:
+    """ the health states and outcomes of all patients of a cohort, stored as contiguous typed arrays """
+    # arrays with one entry per patient
+    _patient_arrays = ('states', 'count_infections', 'count_treated', 'count_infection_episodes',
+                       'count_treatment_episodes', 'costs', 'utilities', 'transmission_times', 'infection_times')
+    # arrays with one entry per infection episode (ordered by patient and start time)
+    _episode_arrays = ('episode_patients', 'episode_starts', 'episode_ends', 'episode_censored')
+    __slots__ = _patient_arrays + _episode_arrays + ('counter',)
+
+    def __init__(self, pop_size, initial_state=P.HealthStats.WELL, counter=None):
+        """
+        :param pop_size: number of patients
+        :param initial_state: initial health state of all patients
+        :param counter: PrevalenceCounter of these patients
+        """
+        self.counter = counter
+        self.states = np.full(pop_size, initial_state.value, dtype=np.int8)     # current health states
+        # time infected and in treatment, in time steps (float for the event-driven engine)
+        self.count_infections = np.zeros(pop_size, dtype=np.int32)
+        self.count_treated = np.zeros(pop_size, dtype=np.int32)
+        # number of infections and of treatments
+        self.count_infection_episodes = np.zeros(pop_size, dtype=np.int32)
+        self.count_treatment_episodes = np.zeros(pop_size, dtype=np.int32)
+        self.costs = np.zeros(pop_size)             # total discounted costs
+        self.utilities = np.zeros(pop_size)         # total discounted utilities
+        self.transmission_times = np.zeros(pop_size)    # start of the current (or last) infection
+        self.infection_times = np.zeros(pop_size)       # duration of the last completed infection
+
+        # infection episodes of all patients (see set_episodes)
+        self.episode_patients = np.zeros(0, dtype=np.int64)     # index of the patient
+        self.episode_starts = np.zeros(0)                       # time of infection
+        self.episode_ends = np.zeros(0)                         # time of recovery or treatment
+        self.episode_censored = np.zeros(0, dtype=bool)         # True if still infected at the end
+
+    def __len__(self):
+        return len(self.states)
+
+    def set_episodes(self, patients, starts, ends, sim_length):
+        """ sets the infection episodes from the completed episodes recorded during the simulation and the
+        episodes of the patients still infected at the end, which are censored at sim_length
+        :param patients: list of arrays of the patient indices of completed episodes (e.g. one per time step)
+        :param starts: list of arrays of the start times of these episodes
+        :param ends: list of arrays of the end times of these episodes
+        :param sim_length: simulation length (years)
         """
+        open_patients = np.flatnonzero(self.states == INFECTED)
+        open_starts = self.transmission_times[open_patients]
+        n_completed = sum(len(p) for p in patients)
+
+        patients = np.concatenate(patients + [open_patients]).astype(np.int64)
+        starts = np.concatenate(starts + [open_starts]).astype(float)
+        ends = np.concatenate(ends + [np.maximum(open_starts, sim_length)]).astype(float)
+        censored = np.arange(len(patients)) >= n_completed
+
+        # order by patient and start time, so the episodes do not depend on how patients were chunked
+        order = np.lexsort((starts, patients))
+        self.episode_patients = patients[order]
+        self.episode_starts = starts[order]
+        self.episode_ends = ends[order]
+        self.episode_censored = censored[order]
+
+    def get_episode_durations(self):
+        """ :returns: the durations of all infection episodes (censored at the end of the simulation) """
+        return self.episode_ends - self.episode_starts
+
+    @staticmethod
+    def from_patients(patients, counter):
+        """ :returns: the cohort state of simulated Patient objects
+        :param counter: PrevalenceCounter updated while simulating the patients """
+        state = CohortState(len(patients), counter=counter)
+        episode_patients, episode_starts, episode_ends = [], [], []
+        for i, patient in enumerate(patients):
+            state.states[i] = patient.get_state_code()
+            state.count_infections[i] = patient.get_number_of_infections()
+            state.count_treated[i] = patient.get_number_of_treated()
+            state.count_infection_episodes[i] = patient.get_number_of_infection_episodes()
+            state.count_treatment_episodes[i] = patient.get_number_of_treatment_episodes()
+            state.costs[i] = patient.get_total_discounted_cost()
+            state.utilities[i] = patient.get_total_discounted_utility()
+            state.transmission_times[i] = patient.get_infection_start()
+            state.infection_times[i] = patient.get_infection_duration()
+            for start, end in patient.get_infection_episodes():
+                episode_patients.append(i)
+                episode_starts.append(start)
+                episode_ends.append(end)
+        state.set_episodes([np.array(episode_patients, dtype=np.int64)], [np.array(episode_starts)],
+                           [np.array(episode_ends)], Data.SIM_LENGTH)
+        return state
+
+    @staticmethod
+    def concatenate(states):
+        """ :returns: one cohort state containing the patients of the given cohort states (in order) """
+        state = CohortState(0, counter=PrevalenceCounter.sum([s.counter for s in states]))
+        for name in CohortState._patient_arrays + CohortState._episode_arrays:
+            setattr(state, name, np.concatenate([getattr(s, name) for s in states]))
+        # patient indices of the episodes of each state start after the patients of the states before
+        offsets = np.cumsum([0] + [len(s) for s in states[:-1]])
+        state.episode_patients = state.episode_patients + np.repeat(
+            offsets, [len(s.episode_patients) for s in states])
+        return state
+
+    def get_patients(self):
+        """ :returns: lightweight views of all patients """
+        return [PatientView(self, i) for i in range(len(self))]
+
+
+class PatientView:
+    """ a view of one patient of a cohort state with the same getters as Patient """
+    __slots__ = ('_state', '_index')
+
+    def __init__(self, cohort_state, index):
+        self._state = cohort_state
+        self._index = index
 
-        self._infectionTimes = []        # patients' infection times
-        self._count_infections = []
-        self._utilities = []
-        self._costs = []
-        self._count_treated = []
+    def get_current_state(self):
+        return P.HealthStats(self._state.states[self._index])
+
+    def get_infection_duration(self):
+        return self._state.infection_times[self._index]
+
+    def get_number_of_infections(self):
+        return self._state.count_infections[self._index]
+
+    def get_number_of_treated(self):
+        return self._state.count_treated[self._index]
+
+    def get_number_of_infection_episodes(self):
+        return self._state.count_infection_episodes[self._index]
+
+    def get_number_of_treatment_episodes(self):
+        return self._state.count_treatment_episodes[self._index]
+
+    def get_total_discounted_cost(self):
+        return self._state.costs[self._index]
+
+    def get_total_discounted_utility(self):
+        return self._state.utilities[self._index]
 
-        #infection curve
-        self._infectionCurve = \
-            PathCls.SamplePathBatchUpdate('Population size over time', id, simulated_cohort.get_initial_pop_size())
 
-        # find patients' infection times
-        for patient in simulated_cohort.get_patients():
+class PrevalenceCounter:
+    """ number of patients in each health state at each time step, and number of new infections
+    and treatments during each time step """
+    __slots__ = ('occupancy', 'incidence', 'treatments', 'delta_t')
 
-            # get the patient infection time
-            infection_time = patient.get_infection_duration()
-            if not (infection_time is None):
-                self._infectionTimes.append(infection_time)           # store the infection time of this patient
-                self._infectionCurve.record(infection_time, -1)       # update the infection curve
+    def __init__(self, n_steps, delta_t):
+        """
+        :param n_steps: number of time steps
+        :param delta_t: length of time steps (years)
+        """
+        self.occupancy = np.zeros((n_steps + 1, N_STATES), dtype=np.int64)
+        self.incidence = np.zeros(n_steps, dtype=np.int64)
+        self.treatments = np.zeros(n_steps, dtype=np.int64)
+        self.delta_t = delta_t
+
+    def record(self, k, states, new_states):
+        """ records the transitions of a cohort during time step k
+        :param states: array of the health states at the start of the time step
+        :param new_states: array of the health states at the end of the time step
+        """
+        if k == 0:
+            self.occupancy[0] += np.bincount(states, minlength=N_STATES)
+        self.occupancy[k + 1] += np.bincount(new_states, minlength=N_STATES)
+        infected = new_states == INFECTED
+        self.incidence[k] += np.count_nonzero(infected & (states == WELL))
+        self.treatments[k] += np.count_nonzero((new_states == TREATMENT) & (states == INFECTED))
+
+    def record_patient(self, k, state, new_state):
+        """ records the transition of one patient during time step k
+        :param state: health state (integer) at the start of the time step
+        :param new_state: health state (integer) at the end of the time step
+        """
+        if k == 0:
+            self.occupancy[0, state] += 1
+        self.occupancy[k + 1, new_state] += 1
+        effects = _TRANSITION_EFFECT_TUPLES[state][new_state]
+        if effects[STARTS_INFECTION]:
+            self.incidence[k] += 1
+        elif effects[STARTS_TREATMENT]:
+            self.treatments[k] += 1
+
+    def merge(self, other):
+        """ adds the counts of another PrevalenceCounter (of a different group of patients) """
+        self.occupancy += other.occupancy
+        self.incidence += other.incidence
+        self.treatments += other.treatments
+
+    @staticmethod
+    def sum(counters):
+        """ :returns: a PrevalenceCounter with the total counts of the given counters """
+        total = PrevalenceCounter(len(counters[0].incidence), counters[0].delta_t)
+        for counter in counters:
+            total.merge(counter)
+        return total
+
+    def get_times(self):
+        """ :returns: the time (years) at the start of each time step """
+        return np.arange(len(self.occupancy)) * self.delta_t
+
+    def get_prevalence(self):
+        """ :returns: the number of infected patients at each time step """
+        return self.occupancy[:, INFECTED]
+
+    def get_treatment_occupancy(self):
+        """ :returns: the number of patients in treatment at each time step """
+        return self.occupancy[:, TREATMENT]
+
+    def get_sample_path(self, name, itr, state):
+        """ :returns: the number of patients in the given health state over time as a sample path
+        (to use with PathCls.graph_sample_paths) """
+        # imported here, the plotting support library is only loaded when a sample path is needed
+        import scr.SamplePathClasses as PathCls
+
+        counts = self.occupancy[:, state.value]
+        path = PathCls.SamplePathRealTimeUpdate(name, itr, counts[0])
+        for time, change in zip(self.get_times()[1:], np.diff(counts)):
+            path.record(time, change)
+        return path
+
+
+def get_patient_uniforms(seed, first_patient, n_patients, n_steps):
+    """ :returns: (patients x time steps) array of the uniform random numbers of patients first_patient to
+        first_patient + n_patients of a cohort, the same numbers the batched engine uses for these patients
+    :param seed: seed of the random streams of the cohort (the cohort id)
+    """
+    streams = Streams.RandomStreams(seed)
+    return np.array([streams.get_uniforms(Streams.TIME_STEPS, k, first_patient, first_patient + n_patients)
+                     for k in range(n_steps)]).T
+
+
+def simulate_batch(params, pop_size, seed, sim_length, trajectory=None, first_patient=0, force_of_infection=None):
+    """ simulates all patients of a cohort together, advancing the health state of every patient
+    at each time step by sampling from the rows of the transition probability matrix
+    :param params: list of parameter objects (one shared by all patients or one per patient)
+    :param pop_size: number of patients
+    :param seed: seed of the random streams of the cohort (the cohort id)
+    :param sim_length: simulation length (years)
+    :param trajectory: (optional) (file name, first row) to record the health states of the patients to
+        (see Cohort.simulate)
+    :param first_patient: index of the first of these patients in the cohort (the random numbers of a patient
+        only depend on the seed and the patient index, so the cohort can be simulated in chunks of any size)
+    :param force_of_infection: (optional) Transmission.ForceOfInfection to make the rate of infection at each
+        time step depend on the infected fraction of these patients (dynamic transmission; the parameters
+        need transition rates)
+    :returns: the cohort state after the simulation
+    """
+    return simulate_batch_arms([params], pop_size, seed, sim_length, [trajectory], first_patient,
+                               force_of_infection)[0]
+
+
+def simulate_batch_arms(params_of_arms, pop_size, seed, sim_length, trajectories=None, first_patient=0,
+                        force_of_infection=None):
+    """ simulates the same patients under several arms (therapies) in one pass; at each time step
+    every patient uses the same uniform random number in all arms (common random numbers)
+    :param params_of_arms: list of the parameter objects of each arm (see simulate_batch)
+    :param pop_size: number of patients
+    :param seed: seed of the random streams of the cohort (the cohort id)
+    :param sim_length: simulation length (years)
+    :param trajectories: (optional) list of the (file name, first row) to record the health states of the
+        patients of each arm to (None for arms that are not recorded)
+    :param first_patient: index of the first of these patients in the cohort (see simulate_batch)
+    :param force_of_infection: (optional) force of infection of each arm (see simulate_batch)
+    :returns: list of the cohort states of the arms after the simulation
+    """
+    # random streams of the cohort
+    streams = Streams.RandomStreams(seed)
+
+    if trajectories is None:
+        trajectories = [None] * len(params_of_arms)
+    arms = [_BatchArm(params, pop_size, sim_length, trajectory is not None, force_of_infection)
+            for params, trajectory in zip(params_of_arms, trajectories)]
+
+    # for all time steps
+    with Profiling.phase('batched engine (time steps)'):
+        for k in range(len(arms[0].discount_factors)):
+            u = streams.get_uniforms(Streams.TIME_STEPS, k, first_patient, first_patient + pop_size)
+            for arm in arms:
+                arm.step(k, u)
+    Profiling.count('patients simulated', pop_size * len(arms))
+    Profiling.count('patient-steps', pop_size * len(arms) * len(arms[0].discount_factors))
+
+    for arm, trajectory in zip(arms, trajectories):
+        arm.state.set_episodes(*arm.episodes, sim_length)
+        if trajectory is not None:
+            write_trajectories(trajectory, arm.trajectory_buffer)
+
+    return [arm.state for arm in arms]
+
+
+class _BatchArm:
+    """ the parameters and the state of a cohort simulated by the batched engine """
+    __slots__ = ('param_index', 'cum_prob', 'payoff_tables', 'delta_t', 'discount_factors', 'state',
+                 'trajectory_buffer', 'episodes', 'force_of_infection', 'susceptible_rates')
+
+    def __init__(self, params, pop_size, sim_length, record_trajectories=False, force_of_infection=None,
+                 param_index=None):
+        """
+        :param params: list of parameter objects (one shared by all patients or one per patient)
+        :param pop_size: number of patients
+        :param sim_length: simulation length (years)
+        :param record_trajectories: set to True to record the health states of patients at each time step
+        :param force_of_infection: (optional) Transmission.ForceOfInfection (see simulate_batch)
+        :param param_index: (optional) index of the parameter object of each patient (e.g. of its community)
+        """
+        # stack the parameters, param_index maps each patient to its parameters
+        prob, cost_tables, utility_tables = _stack_parameters(params)
+        if param_index is not None:
+            self.param_index = np.asarray(param_index)
+        elif len(params) == 1:
+            self.param_index = np.zeros(pop_size, dtype=int)
+        else:
+            self.param_index = np.arange(pop_size)
+        # cumulative transition probabilities to sample by inversion
+        self.cum_prob = np.cumsum(prob, axis=2)
+        self.cum_prob[:, :, -1] = 1
+        # cost and utility of each transition, flattened to from*n_states+to
+        self.payoff_tables = np.stack([cost_tables, utility_tables], axis=-1).reshape(
+            len(params), N_STATES*N_STATES, 2)
+
+        self.delta_t = params[0].get_delta_t()
+        self.discount_factors = params[0].get_discount_factors(params[0].get_num_steps(sim_length))
+
+        # current health states and outcomes of all patients
+        self.state = CohortState(pop_size, params[0].get_initial_health_state(),
+                                 PrevalenceCounter(len(self.discount_factors), self.delta_t))
+
+        # health states at the start of each time step (patients x time steps + 1)
+        self.trajectory_buffer = None
+        if record_trajectories:
+            self.trajectory_buffer = np.empty((pop_size, len(self.discount_factors) + 1), dtype=np.uint8)
+            self.trajectory_buffer[:, 0] = self.state.states
+
+        # (patients, starts, ends) of the infection episodes completed at each time step
+        self.episodes = ([], [], [])
+
+        # rates of leaving the susceptible state of each parameter object (for dynamic transmission)
+        self.force_of_infection = force_of_infection
+        self.susceptible_rates = None
+        if force_of_infection is not None:
+            self.susceptible_rates = _stack_rates(params, _DYNAMIC_MODE)[0][:, WELL]
+
+    def step(self, k, u, infected_fraction=None):
+        """ advances all patients over time step k
+        :param k: current time step
+        :param u: array of uniform random numbers (one per patient)
+        :param infected_fraction: (optional) infected fraction (or array of fractions, one per parameter object)
+            that drives the force of infection (that of these patients if None)
+        """
+        state = self.state
+        states = state.states
+
+        if self.force_of_infection is not None:
+            # the rate of infection of this time step depends on the infected fraction of the patients
+            if infected_fraction is None:
+                infected_fraction = np.count_nonzero(states == INFECTED) / len(states)
+            self.set_infection_rate(self.force_of_infection.get_rate(infected_fraction))
+
+        # sample the new states (an integer from {0, 1, 2} for every patient)
+        new_states = (u[:, np.newaxis] > self.cum_prob[self.param_index, states]).sum(axis=1).astype(np.int8)
+        # transition of every patient, flattened to from*n_states+to
+        transitions = states*N_STATES + new_states
+
+        # update infection and treatment counts
+        effects = _FLAT_TRANSITION_EFFECTS[transitions]
+        state.count_infections += effects[:, COUNTS_INFECTED]
+        state.count_treated += effects[:, COUNTS_TREATED]
+        state.count_infection_episodes += effects[:, STARTS_INFECTION]
+        state.count_treatment_episodes += effects[:, STARTS_TREATMENT]
+        state.counter.record(k, states, new_states)
+
+        # discounted cost and utility of the transition of every patient
+        discount = self.discount_factors[k]
+        payoffs = self.payoff_tables[self.param_index, transitions]
+        state.costs += discount * payoffs[:, 0]
+        state.utilities += discount * payoffs[:, 1]
+
+        # update start of infection
+        t = (k+0.5) * self.delta_t
+        state.transmission_times[effects[:, STARTS_INFECTION] == 1] = t
+        # update infection time
+        recovered = np.flatnonzero(effects[:, ENDS_INFECTION])
+        state.infection_times[recovered] = t - state.transmission_times[recovered]
+        if len(recovered) > 0:
+            self.episodes[0].append(recovered)
+            self.episodes[1].append(state.transmission_times[recovered])
+            self.episodes[2].append(np.full(len(recovered), t))
+
+        if self.trajectory_buffer is not None:
+            self.trajectory_buffer[:, k + 1] = new_states
+        # in place, so the states can be views of shared arrays
+        states[:] = new_states
+
+    def set_infection_rate(self, infection_rate):
+        """ sets the transition probabilities out of the susceptible state for the given rate of infection
+        :param infection_rate: annual rate of infection (a number, or an array with one rate per parameter object)
+        """
+        probs = Transmission.get_susceptible_probabilities(
+            self.susceptible_rates, infection_rate, self.delta_t)
+        self.cum_prob[:, WELL] = np.cumsum(probs, axis=1)
+        self.cum_prob[:, WELL, -1] = 1
+
+
+def simulate_events(params, pop_size, seed, sim_length, trajectory=None, first_patient=0):
+    """ simulates all patients of a cohort in continuous time from the transition rates: the time a patient
+    stays in a health state is exponentially distributed with the total rate of leaving the state, and the
+    next state is sampled in proportion to the rates of the transitions out of the state. Costs and
+    utilities accrue continuously and are discounted in closed form over each stay (at the continuous rate
+    that matches the discount factors of the time steps), so there is no discretization error and random
+    numbers are only drawn at events.
+    As with the time-step engines, the infection and treatment counts are the time infected and in treatment
+    divided by delta_t (the numbers of infections and treatments are counted separately), and the prevalence
+    counter records the health states at the start of each time step of length delta_t.
+    The outcomes differ from those of the time-step engines (and of trace_expected): there, a patient stays
+    at least one time step in each state, e.g. a whole time step in treatment where the mean stay is a week,
+    which raises the time in treatment and the treatment cost.
+    :param params: list of parameter objects with transition rates (one shared by all patients or one per patient)
+    :param pop_size: number of patients
+    :param seed: seed of the random streams of the cohort (the cohort id)
+    :param sim_length: simulation length (years)
+    :param trajectory: (optional) (file name, first row) to record the health states of the patients at the
+        start of each time step to (see Cohort.simulate)
+    :param first_patient: index of the first of these patients in the cohort (the random numbers of the j-th
+        event of a patient only depend on the seed, j and the patient index)
+    :returns: the cohort state after the simulation
+    """
+    # random streams of the cohort
+    streams = Streams.RandomStreams(seed)
+
+
+    # stack the parameters, param_index maps each patient to its parameters
+    rates, cost_rates, utility_rates = _stack_rates(params)
+    if len(params) == 1:
+        param_index = np.zeros(pop_size, dtype=int)
+    else:
+        param_index = np.arange(pop_size)
+    # total rate of leaving each state and cumulative probabilities of the next state
+    exit_rates = rates.sum(axis=2)
+    cum_jump_prob = np.cumsum(rates / np.where(exit_rates > 0, exit_rates, 1)[:, :, np.newaxis], axis=2)
+    cum_jump_prob[:, :, -1] = 1
+
+    discount_rate = params[0].get_continuous_discount_rate()
+    delta_t = params[0].get_delta_t()
+    n_steps = params[0].get_num_steps(sim_length)
+
+    # current health states and outcomes of all patients
+    state = CohortState(pop_size, params[0].get_initial_health_state(), PrevalenceCounter(n_steps, delta_t))
+    # time infected and in treatment (in time steps)
+    state.count_infections = np.zeros(pop_size)
+    state.count_treated = np.zeros(pop_size)
+    times = np.zeros(pop_size)      # time of entering the current state
+    # changes in the number of patients in each state at the start of each time step
+    occupancy_changes = np.zeros((n_steps + 2, N_STATES), dtype=np.int64)
+    # the state of each stay recorded at the first time step it covers (no_state until then)
+    no_state = np.iinfo(np.uint8).max
+    trajectory_buffer = None
+    if trajectory is not None:
+        trajectory_buffer = np.full((pop_size, n_steps + 1), no_state, dtype=np.uint8)
+
+    # (patients, starts, ends) of the infection episodes completed at each event
+    episodes = ([], [], [])
+
+    # patients whose next event is before the end of the simulation
+    active = np.arange(pop_size)
+    Profiling.count('patients simulated', pop_size)
+    event = 0   # index of the current stay of the active patients
+    with Profiling.phase('event-driven engine (events)'):
+        while len(active) > 0:
+            states = state.states[active]
+            p_index = param_index[active]
+            start = times[active]
+
+            # two uniforms of each active patient for this event (the sojourn time and the next state)
+            uniforms = streams.get_uniforms(Streams.EVENTS, event, first_patient + active[0],
+                                            first_patient + active[-1] + 1, n_per_patient=2)[active - active[0]]
+            event += 1
+
+            # sample the time of leaving the current state (never for absorbing states)
+            exit_rate = exit_rates[p_index, states]
+            with np.errstate(divide='ignore'):
+                end = start - np.log1p(-uniforms[:, 0]) / exit_rate
+            censored = end >= sim_length
+            end = np.minimum(end, sim_length)
+
+            # discounted cost and utility accrued while in the current state
+            discounted_time = _get_discounted_time(start, end, discount_rate)
+            state.costs[active] += cost_rates[p_index, states] * discounted_time
+            state.utilities[active] += utility_rates[p_index, states] * discounted_time
+            # time infected and in treatment
+            state.count_infections[active] += np.where(states == INFECTED, end - start, 0) / delta_t
+            state.count_treated[active] += np.where(states == TREATMENT, end - start, 0) / delta_t
+
+            # the patients are in the current state at the start of the time steps in [start, end)
+            # (until the end of the simulation if the stay is censored)
+            first_step = np.ceil(start / delta_t).astype(int)
+            last_step = np.where(censored, n_steps + 1, np.ceil(end / delta_t)).astype(int)
+            np.add.at(occupancy_changes, (first_step, states), 1)
+            np.add.at(occupancy_changes, (last_step, states), -1)
+            if trajectory_buffer is not None:
+                covers_step = first_step < last_step
+                trajectory_buffer[active[covers_step], first_step[covers_step]] = states[covers_step]
+
+            # sample the next state of the patients that leave their state before the end of the simulation
+            leaving = ~censored
+            active, states, p_index, end = active[leaving], states[leaving], p_index[leaving], end[leaving]
+            u = uniforms[leaving, 1]
+            new_states = (u[:, np.newaxis] > cum_jump_prob[p_index, states]).sum(axis=1).astype(np.int8)
+            step = np.floor(end / delta_t).astype(int)
+
+            # update start of infection and number of infections
+            new_infection = (states == WELL) & (new_states == INFECTED)
+            state.transmission_times[active[new_infection]] = end[new_infection]
+            state.count_infection_episodes[active[new_infection]] += 1
+            np.add.at(state.counter.incidence, step[new_infection], 1)
+
+            # update infection time
+            recovered = (states == INFECTED) & (new_states != INFECTED)
+            state.infection_times[active[recovered]] = end[recovered] - state.transmission_times[active[recovered]]
+            if recovered.any():
+                episodes[0].append(active[recovered])
+                episodes[1].append(state.transmission_times[active[recovered]])
+                episodes[2].append(end[recovered])
+
+            # update number of treatments
+            new_treatment = (states == INFECTED) & (new_states == TREATMENT)
+            state.count_treatment_episodes[active[new_treatment]] += 1
+            np.add.at(state.counter.treatments, step[new_treatment], 1)
+
+            state.states[active] = new_states
+            times[active] = end
+            Profiling.count('events', len(active))
+
+    state.counter.occupancy[:] = np.cumsum(occupancy_changes, axis=0)[:n_steps + 1]
+    state.set_episodes(*episodes, sim_length)
+
+    if trajectory_buffer is not None:
+        # carry the state of each stay forward to the following time steps of the stay
+        recorded_steps = np.where(trajectory_buffer != no_state, np.arange(n_steps + 1), 0)
+        np.maximum.accumulate(recorded_steps, axis=1, out=recorded_steps)
+        write_trajectories(trajectory, np.take_along_axis(trajectory_buffer, recorded_steps, axis=1))
+    return state
+
+
+def write_trajectories(trajectory, buffer):
+    """ writes the recorded health states of a chunk of patients to the rows of a trajectory file
+    :param trajectory: (file name, first row of the chunk)
+    :param buffer: (patients x time steps + 1) uint8 array of health states
+    """
+    file_name, first_row = trajectory
+    trajectories = np.load(file_name, mmap_mode='r+')
+    trajectories[first_row:first_row + len(buffer)] = buffer
+    trajectories.flush()
+    del trajectories
+
+
+def load_trajectories(file_name):
+    """ :returns: the (patients x time steps + 1) uint8 array of health states recorded by Cohort.simulate as
+    a read-only memory-mapped array (rows and columns are views that do not copy the file) """
+    return np.load(file_name, mmap_mode='r')
+
+
+def _get_discounted_time(start, end, discount_rate):
+    """ :returns: the discounted length of the time intervals [start, end] (integral of exp(-rate*t)) """
+    if discount_rate == 0:
+        return end - start
+    return (np.exp(-discount_rate * start) - np.exp(-discount_rate * end)) / discount_rate
+
+
+def _stack_rates(params, mode='The event-driven engine'):
+    """ :returns: transition rate matrices (zero on the diagonal) and the annual cost (including the
+    treatment cost) and utility of each state of the given parameter objects as arrays
+    :param mode: the simulation mode that needs the rates (named in the error if a parameter object has none)
+    """
+    rates = []
+    for param in params:
+        rate_matrix = param.get_rate_matrix()
+        if rate_matrix is None:
+            raise ValueError('{} needs parameters with transition rates (sampled PSA parameters only have '
+                             'transition probabilities).'.format(mode))
+        rates.append([[0 if rate is None else rate for rate in row] for row in rate_matrix])
+
+    cost_rates = np.array([[param.get_annual_state_cost(s) for s in P.HealthStats] for param in params],
+                          dtype=float)
+    cost_rates[:, TREATMENT] += [param.get_annual_treatment_cost() for param in params]
+    utility_rates = np.array([[param.get_annual_state_utility(s) for s in P.HealthStats] for param in params],
+                             dtype=float)
+    return np.array(rates, dtype=float), cost_rates, utility_rates
+
+
+def trace_expected(param, sim_length, force_of_infection=None):
+    """ calculates the expected (cohort-average) outcomes of a patient with the given parameters
+    by repeatedly multiplying the state-occupancy vector by the transition probability matrix
+    :param param: parameter object
+    :param sim_length: simulation length (years)
+    :param force_of_infection: (optional) Transmission.ForceOfInfection to update the probabilities of
+        infection at each time step from the expected infected fraction (dynamic transmission)
+    :returns: dictionary of expected outcomes and the state occupancy at each time step
+    """
+    prob, cost_tables, utility_tables = _stack_parameters([param])
+    prob = prob[0]
+    if force_of_infection is not None:
+        susceptible_rates = _stack_rates([param], _DYNAMIC_MODE)[0][0, WELL]
+    discount_factors = param.get_discount_factors(param.get_num_steps(sim_length))
+
+    # state occupancy at the start of the simulation
+    occupancy = np.zeros(N_STATES)
+    occupancy[param.get_initial_health_state().value] = 1
+    trace = [occupancy]
+    # discounted expected proportion of the cohort making each transition (from, to)
+    discounted_flows = np.zeros(prob.shape)
+
+    # for all time steps
+    for discount in discount_factors:
+        if force_of_infection is not None:
+            prob[WELL] = Transmission.get_susceptible_probabilities(
+                susceptible_rates, force_of_infection.get_rate(occupancy[INFECTED]), param.get_delta_t())
+
+        # expected proportion of the cohort making each transition during this time step
+        flows = occupancy[:, np.newaxis] * prob
+        discounted_flows += discount * flows
+
+        occupancy = flows.sum(axis=0)
+        trace.append(occupancy)
+
+    # expected discounted cost and utility
+    cost = discounted_flows.ravel().dot(cost_tables[0].ravel())
+    utility = discounted_flows.ravel().dot(utility_tables[0].ravel())
+    trace = np.array(trace)
+    return dict(cost=cost,
+                utility=utility,
+                count_infections=trace[:-1, INFECTED].sum(),
+                count_treated=trace[:-1, TREATMENT].sum(),
+                trace=trace)
+
+
+def _stack_parameters(params):
+    """ :returns: transition probability matrices and transition cost and utility tables
+    of the given parameter objects as arrays """
+    prob = np.array([[param.get_transition_prob(s) for s in P.HealthStats] for param in params],
+                    dtype=float)
+    cost_tables = np.array([param.get_transition_cost_table() for param in params])
+    utility_tables = np.array([param.get_transition_utility_table() for param in params])
+    return prob, cost_tables, utility_tables
 
-            count_infections = patient.get_number_of_infections()
-            count_treated = patient.get_number_of_infections()
 
-            self._count_infections.append(count_infections)
-            self._infectionTimes.append(infection_time)
-            self._costs.append(patient.get_total_discounted_cost())
-            self._utilities.append(patient.get_total_discounted_utility())
-            self._count_treated.append(count_treated)
+class CohortOutputs:
+    def __init__(self, simulated_cohort, cohort_state=None):
+        """ extracts outputs from a simulated cohort
+        :param simulated_cohort: a cohort after being simulated
+        :param cohort_state: the cohort state after the simulation (extracted from the patients
+            of the cohort if None)
+        """
+        if cohort_state is None:
+            cohort_state = CohortState.from_patients(simulated_cohort.get_patients(),
+                                                     simulated_cohort.get_prevalence_counter())
+        self._set_state(simulated_cohort.get_id(), cohort_state)
+
+    def _set_state(self, cohort_id, cohort_state):
+        """ keeps the per-patient outcomes of the cohort state and calculates their summary statistics
+        :param cohort_id: id of the simulated cohort
+        :param cohort_state: the cohort state after the simulation
+        """
+        self._cohortState = cohort_state
+        self._cohortId = cohort_id
+
+        self._infectionTimes = cohort_state.infection_times        # patients' infection times
+        self._count_infections = cohort_state.count_infections
+        self._utilities = cohort_state.utilities
+        self._costs = cohort_state.costs
+        self._count_treated = cohort_state.count_treated
+        self._count_infection_episodes = cohort_state.count_infection_episodes
+        self._count_treatment_episodes = cohort_state.count_treatment_episodes
+
+        # infection and treatment curves (built when first needed)
+        self._counter = cohort_state.counter
+        self._infectionCurve = None
+        self._treatmentCurve = None
+
+        self._calculate_summary_stats()
+
+    def _build_curves(self, cohort_id, counter):
+        """ builds the infection and treatment curves from the number of patients in each state
+        at each time step """
+        self._counter = counter
+        with Profiling.phase('CohortOutputs (sample paths)'):
+            self._infectionCurve = counter.get_sample_path('Number of infected patients', cohort_id,
+                                                           P.HealthStats.INFECTED)
+            self._treatmentCurve = counter.get_sample_path('Number of patients in treatment', cohort_id,
+                                                           P.HealthStats.TREATMENT)
+
+    def _calculate_summary_stats(self):
 
         # summary statistics
-        self._sumStat_infectionTime = StatCls.SummaryStat('Patient infection time', self._infectionTimes)
-        self._sumStat_number_infections = StatCls.SummaryStat('Time until infection', self._count_infections)
-        self._sumStat_cost = StatCls.SummaryStat('Patient discounted cost', self._costs)
-        self._sumStat_utility = StatCls.SummaryStat('Patient discounted utility', self._utilities)
-        self._sumStat_treated= StatCls.SummaryStat('Number of Infections Treated', self._count_treated)
+        with Profiling.phase('CohortOutputs (SummaryStat construction)'):
+            self._sumStat_infectionTime = StatCls.SummaryStat('Patient infection time', self._infectionTimes)
+            # folded in chunks, the array of durations is only built by get_episode_durations
+            self._sumStat_episodeDuration = Online.summarize_difference(
+                'Infection episode duration', self._cohortState.episode_ends, self._cohortState.episode_starts)
+            self._sumStat_number_infections = StatCls.SummaryStat('Time until infection', self._count_infections)
+            self._sumStat_cost = StatCls.SummaryStat('Patient discounted cost', self._costs)
+            self._sumStat_utility = StatCls.SummaryStat('Patient discounted utility', self._utilities)
+            self._sumStat_treated= StatCls.SummaryStat('Number of Infections Treated', self._count_treated)
+            self._sumStat_infection_episodes = StatCls.SummaryStat('Number of infections',
+                                                                   self._count_infection_episodes)
+            self._sumStat_treatment_episodes = StatCls.SummaryStat('Number of treatments',
+                                                                   self._count_treatment_episodes)
+            self._sumStat_utilityCost = Online.summarize_covariance('Patient discounted utility and cost',
+                                                                    self._utilities, self._costs)
+
+    def is_streaming(self):
+        """ :returns: True if only the summary statistics (not the outcomes of each patient) are kept """
+        return False
+
+    def is_memory_mapped(self):
+        """ :returns: True if the outcomes of each patient are memory-mapped from files """
+        return False
+
+    def get_cohort_id(self):
+        return self._cohortId
+
+    def get_cohort_state(self):
+        """ :returns: the cohort state these outputs are extracted from """
+        return self._cohortState
 
     def get_if_developed_infection(self):
         return self._count_infections
@@ -263,21 +1306,63 @@ class CohortOutputs:
     def get_if_treated(self):
         return self._count_treated
 
+    def get_infection_episode_counts(self):
+        """ :returns: the number of infections of each patient (get_if_developed_infection is the number of
+        infected time steps) """
+        return self._count_infection_episodes
+
+    def get_treatment_episode_counts(self):
+        """ :returns: the number of treatments of each patient (get_if_treated is the number of time steps
+        in treatment) """
+        return self._count_treatment_episodes
+
     def get_infection_durations(self):
         return self._infectionTimes
 
     def get_sumStat_infection_times(self):
         return self._sumStat_infectionTime
 
+    def get_episode_durations(self):
+        """ :returns: the durations of all infection episodes of all patients (episodes still open at the
+        end of the simulation are censored at Data.SIM_LENGTH, see get_episode_censored) """
+        return self._cohortState.get_episode_durations()
+
+    def get_episode_censored(self):
+        """ :returns: True for the infection episodes still open at the end of the simulation """
+        return self._cohortState.episode_censored
+
+    def get_sumStat_episode_durations(self):
+        return self._sumStat_episodeDuration
+
     def get_infection_curve(self):
+        """ :returns: sample path of the number of infected patients at each time step """
+        if self._infectionCurve is None:
+            self._build_curves(self._cohortId, self._counter)
         return self._infectionCurve
 
+    def get_treatment_curve(self):
+        """ :returns: sample path of the number of patients in treatment at each time step """
+        if self._treatmentCurve is None:
+            self._build_curves(self._cohortId, self._counter)
+        return self._treatmentCurve
+
+    def get_prevalence_counter(self):
+        """ :returns: the number of patients in each state at each time step, and the number of new
+        infections and treatments during each time step """
+        return self._counter
+
     def get_sumStat_count_infections(self):
         return self._sumStat_number_infections
 
     def get_sumStat_count_treated(self):
         return self._sumStat_treated
 
+    def get_sumStat_count_infection_episodes(self):
+        return self._sumStat_infection_episodes
+
+    def get_sumStat_count_treatment_episodes(self):
+        return self._sumStat_treatment_episodes
+
     def get_costs(self):
         return self._costs
 
@@ -289,3 +1374,149 @@ class CohortOutputs:
 
     def get_sumStat_discounted_cost(self):
         return self._sumStat_cost
+
+    def get_sumStat_utility_cost(self):
+        """ :returns: OnlineCovarianceStat of the discounted utility and cost of patients (to summarize the
+        net monetary benefit wtp*utility - cost without the outcomes of each patient) """
+        return self._sumStat_utilityCost
+
+
+class BatchCohortOutputs(CohortOutputs):
+    def __init__(self, simulated_cohort, cohort_state):
+        """ extracts outputs from a cohort simulated with the batched engine (or in parallel)
+        :param simulated_cohort: a cohort after being simulated
+        :param cohort_state: the cohort state after the simulation
+        """
+        CohortOutputs.__init__(self, simulated_cohort, cohort_state)
+
+
+def _no_patient_outcomes():
+    """ raises the error of the per-patient getters of streaming cohort outputs """
+    raise ValueError('Streaming cohort outputs do not keep the outcomes of each patient.')
+
+
+class StreamingCohortOutputs(CohortOutputs):
+    def __init__(self, simulated_cohort):
+        """ summary statistics of a simulated cohort that are updated as chunks of patients are simulated,
+        without keeping the outcomes of each patient
+        :param simulated_cohort: the cohort being simulated
+        """
+        # the number of time steps bounds the infection and treatment counts
+        n_steps = simulated_cohort.get_params()[0].get_num_steps(Data.SIM_LENGTH) + 1
+
+        self._sumStat_infectionTime = Online.OnlineSummaryStat(
+            'Patient infection time', bin_width=1, n_bins=int(np.ceil(Data.SIM_LENGTH)) + 1)
+        self._sumStat_episodeDuration = Online.OnlineSummaryStat(
+            'Infection episode duration', bin_width=1, n_bins=int(np.ceil(Data.SIM_LENGTH)) + 1)
+        self._sumStat_number_infections = Online.OnlineSummaryStat('Time until infection', bin_width=1, n_bins=n_steps)
+        self._sumStat_cost = Online.OnlineSummaryStat('Patient discounted cost')
+        self._sumStat_utility = Online.OnlineSummaryStat('Patient discounted utility')
+        self._sumStat_treated = Online.OnlineSummaryStat('Number of Infections Treated', bin_width=1, n_bins=n_steps)
+        self._sumStat_infection_episodes = Online.OnlineSummaryStat('Number of infections', bin_width=1,
+                                                                    n_bins=n_steps)
+        self._sumStat_treatment_episodes = Online.OnlineSummaryStat('Number of treatments', bin_width=1,
+                                                                    n_bins=n_steps)
+        self._sumStat_utilityCost = Online.OnlineCovarianceStat('Patient discounted utility and cost')
+
+        self._cohortId = simulated_cohort.get_id()
+        self._counter = None
+
+    def add(self, cohort_state):
+        """ folds the outcomes of simulated patients into the summary statistics
+        :param cohort_state: the state of a simulated chunk of patients
+        """
+        if self._counter is None:
+            self._counter = PrevalenceCounter.sum([cohort_state.counter])
+        else:
+            self._counter.merge(cohort_state.counter)
+
+        self._sumStat_infectionTime.add(cohort_state.infection_times)
+        self._sumStat_episodeDuration.add(cohort_state.get_episode_durations())
+        self._sumStat_number_infections.add(cohort_state.count_infections)
+        self._sumStat_cost.add(cohort_state.costs)
+        self._sumStat_utility.add(cohort_state.utilities)
+        self._sumStat_treated.add(cohort_state.count_treated)
+        self._sumStat_infection_episodes.add(cohort_state.count_infection_episodes)
+        self._sumStat_treatment_episodes.add(cohort_state.count_treatment_episodes)
+        self._sumStat_utilityCost.add(cohort_state.utilities, cohort_state.costs)
+
+    def is_streaming(self):
+        return True
+
+    def get_cohort_state(self):
+        _no_patient_outcomes()
+
+    def get_infection_curve(self):
+        self._build_curves(self._cohortId, self._counter)
+        return self._infectionCurve
+
+    def get_treatment_curve(self):
+        self._build_curves(self._cohortId, self._counter)
+        return self._treatmentCurve
+
+    def get_if_developed_infection(self):
+        _no_patient_outcomes()
+
+    def get_if_treated(self):
+        _no_patient_outcomes()
+
+    def get_infection_episode_counts(self):
+        _no_patient_outcomes()
+
+    def get_treatment_episode_counts(self):
+        _no_patient_outcomes()
+
+    def get_infection_durations(self):
+        _no_patient_outcomes()
+
+    def get_episode_durations(self):
+        _no_patient_outcomes()
+
+    def get_episode_censored(self):
+        _no_patient_outcomes()
+
+    def get_costs(self):
+        _no_patient_outcomes()
+
+    def get_utilities(self):
+        _no_patient_outcomes()
+
+
+class ExpectedCohortOutputs:
+    def __init__(self, cohort, traces):
+        """ expected outputs of a cohort calculated by trace_expected
+        :param cohort: the cohort
+        :param traces: list of expected outcomes (one per parameter object of the cohort)
+        """
+        self._pop_size = cohort.get_initial_pop_size()
+        self._delta_t = Data.DELTA_T
+
+        # average over the parameter objects (only one unless PSA is on)
+        self._cost = np.mean([trace['cost'] for trace in traces])
+        self._utility = np.mean([trace['utility'] for trace in traces])
+        self._count_infections = np.mean([trace['count_infections'] for trace in traces])
+        self._count_treated = np.mean([trace['count_treated'] for trace in traces])
+        self._trace = np.mean([trace['trace'] for trace in traces], axis=0)
+
+    def get_expected_discounted_cost(self):
+        return self._cost
+
+    def get_expected_discounted_utility(self):
+        return self._utility
+
+    def get_expected_count_infections(self):
+        return self._count_infections
+
+    def get_expected_count_treated(self):
+        return self._count_treated
+
+    def get_state_occupancy(self):
+        """ :returns: proportion of the cohort in each health state at each time step """
+        return self._trace
+
+    def get_times(self):
+        return np.arange(len(self._trace)) * self._delta_t
+
+    def get_prevalence_curve(self):
+        """ :returns: expected number of infected patients at each time step """
+        return self._trace[:, INFECTED] * self._pop_size
@@ -0,0 +1,439 @@
+import csv
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import Hookworm_InputData as Data
+import Hookworm_ParameterClasses as P
+import Hookworm_MarkovModel as MarkovCls
+import Hookworm_RandomStreams as Streams
+import Hookworm_Transmission as Transmission
+import Hookworm_Profiling as Profiling
+
+# parameters of each community
+PARAMETER_ARRAYS = ('pop_sizes', 'baseline_prevalences', 'coverages', 'mda_rounds', 'infection_rates')
+# arrays of the prevalence counter of each community
+COUNTER_ARRAYS = ('occupancy', 'incidence', 'treatments')
+# columns of the table of community outcomes
+COMMUNITY_COLUMNS = ['community', 'pop_size', 'baseline_prevalence', 'coverage', 'mda_rounds',
+                     'mean_cost', 'mean_utility', 'mean_count_infections', 'mean_count_treated',
+                     'final_prevalence']
+
+
+class SharedArrays:
+    """ numpy arrays in shared memory that worker processes attach to by name (without copying) """
+
+    def __init__(self, specs=None, handles=None):
+        """
+        :param specs: dictionary of the (shape, dtype) of the arrays to create (filled with zeros)
+        :param handles: dictionary returned by get_handles to attach to arrays created by another process
+        """
+        self._owner = handles is None
+        self._memories = {}
+        self._arrays = {}
+        if self._owner:
+            handles = {}
+            for name, (shape, dtype) in specs.items():
+                n_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+                memory = shared_memory.SharedMemory(create=True, size=max(1, n_bytes))
+                handles[name] = (memory.name, shape, np.dtype(dtype).str)
+                self._memories[name] = memory
+        else:
+            for name, (memory_name, shape, dtype) in handles.items():
+                self._memories[name] = shared_memory.SharedMemory(name=memory_name)
+
+        self._handles = handles
+        for name, (memory_name, shape, dtype) in handles.items():
+            self._arrays[name] = np.ndarray(shape, dtype=dtype, buffer=self._memories[name].buf)
+            if self._owner:
+                self._arrays[name].fill(0)
+
+    def __getitem__(self, name):
+        return self._arrays[name]
+
+    def __contains__(self, name):
+        return name in self._arrays
+
+    def get_handles(self):
+        """ :returns: the names, shapes and types of the arrays (to attach to them in another process) """
+        return self._handles
+
+    def close(self):
+        """ detaches from the shared memory (and frees it if this object created the arrays); views of the
+        arrays must not be used afterwards """
+        self._arrays.clear()
+        for memory in self._memories.values():
+            memory.close()
+            if self._owner:
+                memory.unlink()
+        self._memories.clear()
+
+
+class Community:
+    """ a community of a metapopulation (the simulated cohort of its outputs) """
+    __slots__ = ('_id',)
+
+    def __init__(self, id):
+        self._id = id
+
+    def get_id(self):
+        return self._id
+
+
+class Metapopulation:
+    def __init__(self, id, pop_sizes, baseline_prevalences, coverages, mda_rounds, infection_rates=None,
+                 coupling=None):
+        """ many communities (e.g. villages) with their own parameters, simulated together; the parameters are
+        arrays with one entry per community
+        :param id: an integer to specify the seed of the random streams
+        :param pop_sizes: population size of each community
+        :param baseline_prevalences: infected fraction of each community at the start of the simulation (also
+            the baseline prevalence of its force of infection)
+        :param coverages: probability that an infected person is treated in one MDA round in each community
+        :param mda_rounds: number of MDA rounds per year in each community
+        :param infection_rates: rate of infection of each community at its baseline prevalence (if None,
+            Data.a scaled by the baseline prevalence relative to Data.BASELINE_PREVALENCE)
+        :param coupling: (dynamic transmission only) None for independent communities, a number m in [0, 1] for
+            the force of infection of each community to depend on (1 - m) times its own infected fraction plus
+            m times that of the whole metapopulation, or a (communities x communities) matrix whose rows are the
+            weights of the infected fractions of all communities
+        """
+        self._id = id
+        self._parameters = dict(pop_sizes=np.asarray(pop_sizes, dtype=np.int64),
+                                baseline_prevalences=np.asarray(baseline_prevalences, dtype=float),
+                                coverages=np.asarray(coverages, dtype=float),
+                                mda_rounds=np.asarray(mda_rounds, dtype=float))
+        if infection_rates is None:
+            infection_rates = Data.a * self._parameters['baseline_prevalences'] / Data.BASELINE_PREVALENCE
+        self._parameters['infection_rates'] = np.asarray(infection_rates, dtype=float)
+
+        n_communities = len(self._parameters['pop_sizes'])
+        if any(len(values) != n_communities for values in self._parameters.values()):
+            raise ValueError('The parameters of the metapopulation must have one entry per community.')
+        if n_communities == 0 or np.any(self._parameters['pop_sizes'] < 1):
+            raise ValueError('The metapopulation needs communities of at least one person.')
+        baseline_prevalences = self._parameters['baseline_prevalences']
+        if np.any(baseline_prevalences <= 0) or np.any(baseline_prevalences > 1):
+            raise ValueError('The baseline prevalences must be in (0, 1].')
+
+        self._coupling = None
+        if coupling is not None:
+            self._coupling = get_coupling_matrix(self._parameters['pop_sizes'], coupling)
+
+    def simulate(self, n_workers=1, dynamic=None):
+        """ simulates all communities over Data.SIM_LENGTH; each worker process advances a block of communities
+        with the batched engine, on parameter and state arrays in shared memory. With coupling, the workers
+        wait for each other at every time step so that the force of infection of each community uses the
+        infected fractions of all communities at the start of the time step. The outputs do not depend on
+        the number of workers.
+        :param n_workers: number of worker processes (None to use all cores, 1 to run in this process)
+        :param dynamic: set to True for dynamic transmission (see Hookworm_Transmission; Data.DYNAMIC_ON if None)
+        :returns: MetapopulationOutputs
+        """
+        if dynamic is None:
+            dynamic = Data.DYNAMIC_ON
+        if self._coupling is not None and not dynamic:
+            raise ValueError('Coupling between communities needs dynamic transmission.')
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+
+        pop_sizes = self._parameters['pop_sizes']
+        pop_size = int(pop_sizes.sum())
+        n_communities = len(pop_sizes)
+        n_states = MarkovCls.N_STATES
+        n_steps = get_community_parameters(self._parameters, 0).get_num_steps(Data.SIM_LENGTH)
+
+        # parameters, patient states and prevalence counters of all communities in shared memory
+        empty_state = MarkovCls.CohortState(0)
+        specs = {name: (values.shape, values.dtype) for name, values in self._parameters.items()}
+        specs.update({name: ((pop_size,), getattr(empty_state, name).dtype)
+                      for name in MarkovCls.CohortState._patient_arrays})
+        specs.update(communities=((pop_size,), np.int32),
+                     occupancy=((n_communities, n_steps + 1, n_states), np.int64),
+                     incidence=((n_communities, n_steps), np.int64),
+                     treatments=((n_communities, n_steps), np.int64))
+        if self._coupling is not None:
+            specs['coupling'] = (self._coupling.shape, float)
+        arrays = SharedArrays(specs)
+
+        try:
+            for name, values in self._parameters.items():
+                arrays[name][:] = values
+            arrays['communities'][:] = np.repeat(np.arange(n_communities), pop_sizes)
+            if self._coupling is not None:
+                arrays['coupling'][:] = self._coupling
+
+            blocks = _get_blocks(pop_sizes, n_workers)
+            settings = dict(seed=self._id, sim_length=Data.SIM_LENGTH, dynamic=dynamic)
+            if len(blocks) == 1:
+                episodes = [_simulate_block(arrays, blocks[0], settings, None)]
+            else:
+                episodes = _simulate_blocks_in_parallel(arrays, blocks, settings, self._coupling is not None)
+
+            # copy the outcomes out of the shared memory
+            counter = MarkovCls.PrevalenceCounter(0, Data.DELTA_T)
+            state = MarkovCls.CohortState(0, counter=counter)
+            for name in MarkovCls.CohortState._patient_arrays:
+                setattr(state, name, np.array(arrays[name]))
+            for i, name in enumerate(MarkovCls.CohortState._episode_arrays):
+                setattr(state, name, np.concatenate([block_episodes[i] for block_episodes in episodes]))
+            community_counters = {name: np.array(arrays[name]) for name in COUNTER_ARRAYS}
+        finally:
+            arrays.close()
+
+        for name in COUNTER_ARRAYS:
+            setattr(counter, name, community_counters[name].sum(axis=0))
+        return MetapopulationOutputs(self, state, community_counters)
+
+    def get_id(self):
+        return self._id
+
+    def get_parameters(self):
+        """ :returns: dictionary of the parameter arrays of the communities (see PARAMETER_ARRAYS) """
+        return self._parameters
+
+    def get_n_communities(self):
+        return len(self._parameters['pop_sizes'])
+
+
+def get_coupling_matrix(pop_sizes, coupling):
+    """ :returns: the (communities x communities) matrix of the weights of the infected fractions of all
+    communities in the force of infection of each community (see Metapopulation)
+    :param pop_sizes: population size of each community
+    :param coupling: a number m in [0, 1] (mixing with the whole metapopulation) or a matrix
+    """
+    pop_sizes = np.asarray(pop_sizes, dtype=float)
+    if np.ndim(coupling) == 0:
+        if not 0 <= coupling <= 1:
+            raise ValueError('The coupling must be between 0 and 1.')
+        # a share m of the contacts is with the whole metapopulation (in proportion to the population sizes)
+        matrix = np.tile(coupling * pop_sizes / pop_sizes.sum(), (len(pop_sizes), 1))
+        matrix[np.diag_indices(len(pop_sizes))] += 1 - coupling
+        return matrix
+
+    matrix = np.array(coupling, dtype=float)
+    if matrix.shape != (len(pop_sizes), len(pop_sizes)):
+        raise ValueError('The coupling matrix must have one row and one column per community.')
+    return matrix
+
+
+def get_community_parameters(parameters, community):
+    """ :returns: the parameter object of a community
+    :param parameters: dictionary of the parameter arrays of the communities (see Metapopulation.get_parameters)
+    :param community: index of the community
+    """
+    return P.ParametersScenario(coverage=float(parameters['coverages'][community]),
+                                mda_rounds=float(parameters['mda_rounds'][community]),
+                                mda_cost=Data.MDA_COST,
+                                discount=Data.DISCOUNT,
+                                annual_state_utilities=Data.ANNUAL_STATE_UTILITY,
+                                infection_rate=float(parameters['infection_rates'][community]))
+
+
+def _get_blocks(pop_sizes, n_workers):
+    """ :returns: list of the (first, last + 1) communities of each worker, with about the same number of
+    people in each block """
+    n_blocks = max(1, min(n_workers, len(pop_sizes)))
+    ends = np.cumsum(pop_sizes)
+    # the first community of each block
+    firsts = np.searchsorted(ends, ends[-1] * np.arange(1, n_blocks) / n_blocks, side='right')
+    bounds = np.unique(np.concatenate([[0], firsts, [len(pop_sizes)]]))
+    return [(int(first), int(last)) for first, last in zip(bounds[:-1], bounds[1:])]
+
+
+def _simulate_blocks_in_parallel(arrays, blocks, settings, coupled):
+    """ simulates the blocks of communities in worker processes (one per block)
+    :returns: list of the infection episodes of each block """
+    context = multiprocessing.get_context()
+    # with coupling, the workers wait for each other at each time step
+    barrier = context.Barrier(len(blocks)) if coupled else None
+    results = context.SimpleQueue()
+    processes = [context.Process(target=_run_block,
+                                 args=(arrays.get_handles(), i, block, settings, barrier, results))
+                 for i, block in enumerate(blocks)]
+    for process in processes:
+        process.start()
+
+    episodes = [None] * len(blocks)
+    error = None
+    for _ in blocks:
+        i, result = results.get()
+        if isinstance(result, BaseException):
+            error = error or result
+        else:
+            episodes[i] = result
+    for process in processes:
+        process.join()
+    if error is not None:
+        raise error
+    return episodes
+
+
+def _run_block(handles, index, block, settings, barrier, results):
+    """ simulates a block of communities in a worker process and puts (index, episodes or error) to results """
+    arrays = SharedArrays(handles=handles)
+    try:
+        results.put((index, _simulate_block(arrays, block, settings, barrier)))
+    except BaseException as error:
+        if barrier is not None:
+            # release the other workers
+            barrier.abort()
+        results.put((index, error))
+    finally:
+        arrays.close()
+
+
+def _simulate_block(arrays, block, settings, barrier):
+    """ advances a block of communities over all time steps with the batched engine; the patient states and
+    outcomes are updated in place in the shared arrays
+    :param arrays: SharedArrays of the metapopulation
+    :param block: (first, last + 1) communities of the block
+    :param settings: dictionary of the seed, the simulation length and whether transmission is dynamic
+    :param barrier: (optional) barrier to wait for the other workers at each time step (with coupling)
+    :returns: (patients, starts, ends, censored) arrays of the infection episodes of the block
+    """
+    first, last = block
+    pop_sizes = arrays['pop_sizes']
+    lo, hi = int(pop_sizes[:first].sum()), int(pop_sizes[:last].sum())
+    n_states = MarkovCls.N_STATES
+    n_communities = last - first
+
+    # index of the community of each person within the block
+    communities = arrays['communities'][lo:hi] - first
+    parameters = {name: arrays[name] for name in PARAMETER_ARRAYS}
+    force_of_infection = None
+    if settings['dynamic']:
+        force_of_infection = Transmission.ForceOfInfection(
+            base_rate=arrays['infection_rates'][first:last],
+            baseline_prevalence=arrays['baseline_prevalences'][first:last])
+    arm = MarkovCls._BatchArm([get_community_parameters(parameters, i) for i in range(first, last)],
+                              hi - lo, settings['sim_length'], force_of_infection=force_of_infection,
+                              param_index=communities)
+
+    # the states and outcomes of the people of the block are views of the shared arrays
+    state = arm.state
+    for name in MarkovCls.CohortState._patient_arrays:
+        setattr(state, name, arrays[name][lo:hi])
+
+    # initial health states (infected with the baseline prevalence of the community)
+    streams = Streams.RandomStreams(settings['seed'])
+    u = streams.get_uniforms(Streams.INITIAL_STATES, 0, lo, hi)
+    infected = u < arrays['baseline_prevalences'][first:last][communities]
+    state.states[:] = np.where(infected, MarkovCls.INFECTED, MarkovCls.WELL)
+
+    occupancy = arrays['occupancy']
+    incidence = arrays['incidence'][first:last]
+    treatments = arrays['treatments'][first:last]
+    community_sizes = pop_sizes[first:last]
+    occupancy[first:last, 0] = _count_states(communities, state.states, n_communities, n_states)
+    # transitions (flattened to from*n_states+to) that start an infection or a treatment
+    starts_infection = MarkovCls.TRANSITION_EFFECTS[:, :, MarkovCls.STARTS_INFECTION].ravel() == 1
+    starts_treatment = MarkovCls.TRANSITION_EFFECTS[:, :, MarkovCls.STARTS_TREATMENT].ravel() == 1
+
+    with Profiling.phase('metapopulation (time steps)'):
+        for k in range(len(arm.discount_factors)):
+            infected_fraction = None
+            if force_of_infection is not None:
+                if barrier is not None:
+                    # wait until all workers recorded the states at the start of this time step
+                    barrier.wait()
+                if 'coupling' in arrays:
+                    fractions = occupancy[:, k, MarkovCls.INFECTED] / pop_sizes
+                    infected_fraction = arrays['coupling'][first:last].dot(fractions)
+                else:
+                    infected_fraction = occupancy[first:last, k, MarkovCls.INFECTED] / community_sizes
+
+            states = state.states.copy()
+            arm.step(k, streams.get_uniforms(Streams.TIME_STEPS, k, lo, hi), infected_fraction)
+
+            # prevalence counters of the communities
+            occupancy[first:last, k + 1] = _count_states(communities, state.states, n_communities, n_states)
+            transitions = states * n_states + state.states
+            incidence[:, k] = np.bincount(communities[starts_infection[transitions]], minlength=n_communities)
+            treatments[:, k] = np.bincount(communities[starts_treatment[transitions]], minlength=n_communities)
+    Profiling.count('patient-steps', (hi - lo) * len(arm.discount_factors))
+
+    state.set_episodes(*arm.episodes, settings['sim_length'])
+    return state.episode_patients + lo, state.episode_starts, state.episode_ends, state.episode_censored
+
+
+def _count_states(communities, states, n_communities, n_states):
+    """ :returns: (communities x states) number of people of each community in each health state """
+    return np.bincount(communities * n_states + states, minlength=n_communities * n_states).reshape(
+        n_communities, n_states)
+
+
+class MetapopulationOutputs:
+    def __init__(self, metapopulation, cohort_state, community_counters):
+        """ outputs of a simulated metapopulation, per community and overall
+        :param metapopulation: the simulated metapopulation
+        :param cohort_state: the state of all people of the metapopulation (ordered by community)
+        :param community_counters: dictionary of the occupancy (communities x time steps + 1 x states),
+            incidence and treatments (communities x time steps) of each community
+        """
+        self._metapopulation = metapopulation
+        self._cohortState = cohort_state
+        self._communityCounters = community_counters
+        self._parameters = metapopulation.get_parameters()
+        pop_sizes = self._parameters['pop_sizes']
+        # the first person of each community (and the number of people)
+        self._offsets = np.concatenate([[0], np.cumsum(pop_sizes)])
+        self._overallOutputs = None
+
+    def get_overall_outputs(self):
+        """ :returns: the outputs (as a cohort) of all people of the metapopulation """
+        if self._overallOutputs is None:
+            self._overallOutputs = MarkovCls.BatchCohortOutputs(self._metapopulation, self._cohortState)
+        return self._overallOutputs
+
+    def get_community_outputs(self, community):
+        """ :returns: the outputs (as a cohort) of the people of one community
+        :param community: index of the community
+        """
+        lo, hi = self._offsets[community], self._offsets[community + 1]
+        all_states = self._cohortState
+
+        counter = MarkovCls.PrevalenceCounter(0, all_states.counter.delta_t)
+        for name in COUNTER_ARRAYS:
+            setattr(counter, name, self._communityCounters[name][community])
+        state = MarkovCls.CohortState(0, counter=counter)
+        for name in MarkovCls.CohortState._patient_arrays:
+            setattr(state, name, getattr(all_states, name)[lo:hi])
+
+        # the episodes are ordered by person
+        first, last = np.searchsorted(all_states.episode_patients, [lo, hi])
+        for name in MarkovCls.CohortState._episode_arrays:
+            setattr(state, name, getattr(all_states, name)[first:last])
+        state.episode_patients = state.episode_patients - lo
+
+        return MarkovCls.BatchCohortOutputs(Community(community), state)
+
+    def get_community_summary(self):
+        """ :returns: dictionary of arrays with the parameters and mean outcomes of each community
+        (the keys of COMMUNITY_COLUMNS) """
+        state = self._cohortState
+        pop_sizes = self._parameters['pop_sizes']
+        starts = self._offsets[:-1]
+        occupancy = self._communityCounters['occupancy']
+        return dict(community=np.arange(len(pop_sizes)),
+                    pop_size=pop_sizes,
+                    baseline_prevalence=self._parameters['baseline_prevalences'],
+                    coverage=self._parameters['coverages'],
+                    mda_rounds=self._parameters['mda_rounds'],
+                    mean_cost=np.add.reduceat(state.costs, starts) / pop_sizes,
+                    mean_utility=np.add.reduceat(state.utilities, starts) / pop_sizes,
+                    mean_count_infections=np.add.reduceat(state.count_infections, starts) / pop_sizes,
+                    mean_count_treated=np.add.reduceat(state.count_treated, starts) / pop_sizes,
+                    final_prevalence=occupancy[:, -1, MarkovCls.INFECTED] / pop_sizes)
+
+    def get_community_prevalence(self):
+        """ :returns: (communities x time steps + 1) infected fraction of each community at each time step """
+        occupancy = self._communityCounters['occupancy']
+        return occupancy[:, :, MarkovCls.INFECTED] / self._parameters['pop_sizes'][:, np.newaxis]
+
+    def write_community_table(self, file_name):
+        """ writes the parameters and mean outcomes of each community to a csv file (one row per community) """
+        summary = self.get_community_summary()
+        with open(file_name, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(COMMUNITY_COLUMNS)
+            writer.writerows(zip(*[summary[name].tolist() for name in COMMUNITY_COLUMNS]))
@@ -0,0 +1,245 @@
+import numpy as np
+import scipy.stats as stat
+
+
+class OnlineSummaryStat:
+    """ summary statistics of observations that are added in batches without storing them
+    (same getters as scr.StatisticalClasses.SummaryStat) """
+
+    def __init__(self, name, bin_width=None, n_bins=None):
+        """
+        :param name: name of the statistic
+        :param bin_width: width of the histogram bins (no histogram if None)
+        :param n_bins: number of histogram bins (starting at 0); observations beyond the last bin
+            are counted in the last bin
+        """
+        self.name = name
+        self._n = 0
+        self._mean = 0
+        self._sumSquaredDev = 0     # sum of squared deviations from the mean
+        self._min = np.inf
+        self._max = -np.inf
+
+        self._binWidth = bin_width
+        self._histogram = None if bin_width is None else np.zeros(n_bins, dtype=np.int64)
+
+    def add(self, observations):
+        """ folds a batch of observations into the statistics
+        :param observations: array of observations
+        """
+        observations = np.asarray(observations, dtype=float)
+        n = len(observations)
+        if n == 0:
+            return
+
+        # combine the mean and the sum of squared deviations of this batch with those so far
+        mean = observations.mean()
+        sum_squared_dev = np.sum((observations - mean)**2)
+        delta = mean - self._mean
+        total = self._n + n
+        self._mean += delta * n / total
+        self._sumSquaredDev += sum_squared_dev + delta**2 * self._n * n / total
+        self._n = total
+
+        self._min = min(self._min, observations.min())
+        self._max = max(self._max, observations.max())
+
+        if self._histogram is not None:
+            bins = np.clip(np.floor(observations / self._binWidth), 0, len(self._histogram) - 1).astype(int)
+            self._histogram += np.bincount(bins, minlength=len(self._histogram))
+
+    def merge(self, other):
+        """ folds the statistics of another OnlineSummaryStat (of the same kind) into these statistics """
+        if other._n == 0:
+            return
+        delta = other._mean - self._mean
+        total = self._n + other._n
+        self._mean += delta * other._n / total
+        self._sumSquaredDev += other._sumSquaredDev + delta**2 * self._n * other._n / total
+        self._n = total
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+        if self._histogram is not None:
+            self._histogram += other._histogram
+
+    def get_n(self):
+        return self._n
+
+    def get_mean(self):
+        return self._mean
+
+    def get_variance(self):
+        """ :returns: the sample variance (NaN with fewer than 2 observations) """
+        if self._n < 2:
+            return np.nan
+        return self._sumSquaredDev / (self._n - 1)
+
+    def get_stDev(self):
+        return np.sqrt(self.get_variance())
+
+    def get_min(self):
+        return self._min
+
+    def get_max(self):
+        return self._max
+
+    def get_t_half_length(self, alpha):
+        """ :returns: the half-length of the t-confidence interval (NaN with fewer than 2 observations) """
+        if self._n < 2:
+            return np.nan
+        return stat.t.ppf(1 - alpha / 2, self._n - 1) * self.get_stDev() / np.sqrt(self._n)
+
+    def get_t_CI(self, alpha):
+        half_length = self.get_t_half_length(alpha)
+        return [self._mean - half_length, self._mean + half_length]
+
+    def get_histogram(self):
+        """ :returns: the left edges of the histogram bins and the number of observations in each bin """
+        return np.arange(len(self._histogram)) * self._binWidth, self._histogram
+
+
+class OnlineDifferenceStatIndp:
+    """ difference between the means of two independent samples summarized by OnlineSummaryStat """
+
+    def __init__(self, name, x, y_ref):
+        """
+        :param name: name of the statistic
+        :param x: OnlineSummaryStat of the first sample
+        :param y_ref: OnlineSummaryStat of the reference sample
+        """
+        self.name = name
+        self._x = x
+        self._yRef = y_ref
+
+    def get_mean(self):
+        return self._x.get_mean() - self._yRef.get_mean()
+
+    def get_t_half_length(self, alpha):
+        # Welch's t interval (NaN if a sample has fewer than 2 observations)
+        if self._x.get_n() < 2 or self._yRef.get_n() < 2:
+            return np.nan
+        var_x = self._x.get_variance() / self._x.get_n()
+        var_y = self._yRef.get_variance() / self._yRef.get_n()
+        if var_x + var_y == 0:
+            return 0
+        dof = (var_x + var_y)**2 / (var_x**2 / (self._x.get_n() - 1) + var_y**2 / (self._yRef.get_n() - 1))
+        return stat.t.ppf(1 - alpha / 2, dof) * np.sqrt(var_x + var_y)
+
+    def get_t_CI(self, alpha):
+        half_length = self.get_t_half_length(alpha)
+        return [self.get_mean() - half_length, self.get_mean() + half_length]
+
+
+class OnlineCovarianceStat:
+    """ means and covariance of paired observations (x, y) that are added in batches without storing them,
+    to summarize linear combinations a*x + b*y (e.g. the net monetary benefit wtp*utility - cost) """
+
+    def __init__(self, name):
+        """
+        :param name: name of the statistic
+        """
+        self.name = name
+        self._n = 0
+        self._mean = np.zeros(2)
+        self._sumCrossDev = np.zeros((2, 2))   # sums of the products of the deviations from the means
+
+    def add(self, x, y):
+        """ folds a batch of paired observations into the statistics
+        :param x: array of observations of x
+        :param y: array of the paired observations of y
+        """
+        observations = np.stack([np.asarray(x, dtype=float), np.asarray(y, dtype=float)])
+        n = observations.shape[1]
+        if n == 0:
+            return
+
+        # combine the means and the co-moments of this batch with those so far
+        mean = observations.mean(axis=1)
+        deviations = observations - mean[:, np.newaxis]
+        delta = mean - self._mean
+        total = self._n + n
+        self._mean += delta * n / total
+        self._sumCrossDev += deviations.dot(deviations.T) + np.outer(delta, delta) * self._n * n / total
+        self._n = total
+
+    def merge(self, other):
+        """ folds the statistics of another OnlineCovarianceStat into these statistics """
+        if other._n == 0:
+            return
+        delta = other._mean - self._mean
+        total = self._n + other._n
+        self._mean += delta * other._n / total
+        self._sumCrossDev += other._sumCrossDev + np.outer(delta, delta) * self._n * other._n / total
+        self._n = total
+
+    def get_n(self):
+        return self._n
+
+    def get_mean(self):
+        """ :returns: the means of x and y """
+        return self._mean
+
+    def get_covariance(self):
+        """ :returns: the 2 x 2 sample covariance matrix of x and y (NaN with fewer than 2 observations) """
+        if self._n < 2:
+            return np.full((2, 2), np.nan)
+        return self._sumCrossDev / (self._n - 1)
+
+    def get_linear_combination(self, name, a, b):
+        """ :returns: the OnlineSummaryStat of a*x + b*y (without minimum, maximum and histogram)
+        :param name: name of the statistic """
+        weights = np.array([a, b], dtype=float)
+        sum_stat = OnlineSummaryStat(name)
+        sum_stat._n = self._n
+        sum_stat._mean = weights.dot(self._mean)
+        sum_stat._sumSquaredDev = weights.dot(self._sumCrossDev).dot(weights)
+        sum_stat._min = np.nan
+        sum_stat._max = np.nan
+        return sum_stat
+
+
+def summarize(name, observations, chunk_size=1000000):
+    """ :returns: the OnlineSummaryStat of an array of observations, folded in chunks so that only one chunk
+    of a (memory-mapped) array is in memory at a time
+    :param name: name of the statistic
+    :param observations: array of observations
+    :param chunk_size: number of observations in each chunk
+    """
+    sum_stat = OnlineSummaryStat(name)
+    for start in range(0, len(observations), chunk_size):
+        sum_stat.add(observations[start:start + chunk_size])
+    return sum_stat
+
+
+def summarize_difference(name, x, y_ref, chunk_size=1000000):
+    """ :returns: the OnlineSummaryStat of the differences x - y_ref of paired observations, folded in chunks
+    (the statistics of the mean difference of a paired sample)
+    :param name: name of the statistic
+    :param x: array of observations
+    :param y_ref: array of the paired reference observations
+    :param chunk_size: number of observations in each chunk
+    """
+    sum_stat = OnlineSummaryStat(name)
+    for start in range(0, len(x), chunk_size):
+        sum_stat.add(np.subtract(x[start:start + chunk_size], y_ref[start:start + chunk_size]))
+    return sum_stat
+
+
+def summarize_covariance(name, x, y, x_ref=None, y_ref=None, chunk_size=1000000):
+    """ :returns: the OnlineCovarianceStat of paired observations (x, y), or of the paired differences
+    (x - x_ref, y - y_ref) if reference observations are given, folded in chunks
+    :param name: name of the statistic
+    :param x: array of observations of x
+    :param y: array of the paired observations of y
+    :param x_ref: (optional) array of the paired reference observations of x
+    :param y_ref: (optional) array of the paired reference observations of y
+    :param chunk_size: number of observations in each chunk
+    """
+    cov_stat = OnlineCovarianceStat(name)
+    for start in range(0, len(x), chunk_size):
+        x_chunk, y_chunk = x[start:start + chunk_size], y[start:start + chunk_size]
+        if x_ref is not None:
+            x_chunk = np.subtract(x_chunk, x_ref[start:start + chunk_size])
+            y_chunk = np.subtract(y_chunk, y_ref[start:start + chunk_size])
+        cov_stat.add(x_chunk, y_chunk)
+    return cov_stat
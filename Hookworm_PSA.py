@@ -0,0 +1,107 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import Hookworm_InputData as Data
+import Hookworm_ParameterClasses as P
+import Hookworm_MarkovModel as MarkovCls
+import Hookworm_RandomStreams as Streams
+
+
+class PSAOutputs:
+    def __init__(self, therapies, costs, utilities):
+        """ outputs of a probabilistic sensitivity analysis
+        :param therapies: list of the simulated therapies
+        :param costs: (draws x therapies) array of the mean discounted cost of each cohort
+        :param utilities: (draws x therapies) array of the mean discounted utility of each cohort
+        """
+        self._therapies = list(therapies)
+        self._costs = costs
+        self._utilities = utilities
+
+    def get_therapies(self):
+        return self._therapies
+
+    def get_n_draws(self):
+        return len(self._costs)
+
+    def get_mean_costs(self, therapy):
+        """ :returns: the mean discounted cost of the cohort simulated with each parameter draw """
+        return self._costs[:, self._therapies.index(therapy)]
+
+    def get_mean_utilities(self, therapy):
+        """ :returns: the mean discounted utility of the cohort simulated with each parameter draw """
+        return self._utilities[:, self._therapies.index(therapy)]
+
+    def get_incremental_costs(self, therapy, therapy_ref):
+        return self.get_mean_costs(therapy) - self.get_mean_costs(therapy_ref)
+
+    def get_incremental_utilities(self, therapy, therapy_ref):
+        return self.get_mean_utilities(therapy) - self.get_mean_utilities(therapy_ref)
+
+    def get_acceptability(self, wtps):
+        """ cost-effectiveness acceptability curves
+        :param wtps: array of willingness-to-pay values
+        :returns: (wtps x therapies) array of the proportion of parameter draws in which each therapy has
+            the highest net monetary benefit
+        """
+        wtps = np.asarray(wtps, dtype=float)
+        # net monetary benefit of each therapy for each draw and willingness-to-pay (wtps x draws x therapies)
+        nmb = wtps[:, np.newaxis, np.newaxis] * self._utilities[np.newaxis] - self._costs[np.newaxis]
+        best = np.argmax(nmb, axis=2)
+        return np.stack([np.mean(best == i, axis=1) for i in range(len(self._therapies))], axis=1)
+
+
+def simulate_PSA(n_draws=None, pop_size=None, therapies=(P.Therapies.ANNUAL, P.Therapies.SEMI),
+                 seed=0, n_workers=None):
+    """ probabilistic sensitivity analysis: draws parameter sets and simulates the cohort under all therapies
+    for each parameter set (with common random numbers across therapies), one parameter set per task of
+    a process pool. The outputs do not depend on the number of workers.
+    :param n_draws: number of parameter draws (Data.PSA_N_DRAWS if None)
+    :param pop_size: cohort population size for each draw (Data.POP_SIZE if None)
+    :param therapies: list of therapies
+    :param seed: seed of the parameter draws and of the cohorts (the outputs of draw d do not depend on n_draws)
+    :param n_workers: number of worker processes (None to use all cores, 1 to run in this process)
+    :returns: PSAOutputs
+    """
+    if n_draws is None:
+        n_draws = Data.PSA_N_DRAWS
+    if pop_size is None:
+        pop_size = Data.POP_SIZE
+
+    # draw all parameter sets of each therapy at once (with the same seed, so the draws of the shared
+    # cost and utility parameters are the same for all therapies)
+    samples = [P.sample_parameters(therapy, n_draws, seed) for therapy in therapies]
+
+    # id (seed of the random streams) of the cohort of each draw
+    streams = Streams.RandomStreams(seed)
+
+    tasks = []
+    for draw in range(n_draws):
+        draw_samples = [{key: values[draw] for key, values in therapy_samples.items()}
+                        for therapy_samples in samples]
+        tasks.append((streams.get_seed(Streams.COHORTS, draw), list(therapies), draw_samples, pop_size))
+    if n_workers == 1:
+        results = list(map(_simulate_draw, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_simulate_draw, tasks, chunksize=max(1, n_draws // 64)))
+
+    return PSAOutputs(therapies,
+                      costs=np.array([result[0] for result in results]),
+                      utilities=np.array([result[1] for result in results]))
+
+
+def _simulate_draw(args):
+    """ simulates the cohort under all therapies for one parameter draw (runs in a worker process)
+    :param args: (cohort id, therapies, parameter draw of each therapy, pop_size)
+    :returns: the mean discounted costs and utilities of the therapies
+    """
+    cohort_id, therapies, draw_samples, pop_size = args
+
+    parameters = [P.ParametersSampled(therapy, draw['prob_matrix'], draw['annual_state_costs'],
+                                      draw['annual_state_utilities'])
+                  for therapy, draw in zip(therapies, draw_samples)]
+
+    outputs = MarkovCls.PairedCohort(id=cohort_id, therapies=therapies, pop_size=pop_size,
+                                     parameters=parameters).simulate()
+    return ([output.get_sumStat_discounted_cost().get_mean() for output in outputs],
+            [output.get_sumStat_discounted_utility().get_mean() for output in outputs])
@@ -1,7 +1,9 @@
 from enum import Enum
+from functools import lru_cache
 import numpy as np
 import scipy.stats as stat
 import Hookworm_InputData as Data
+import Hookworm_RandomStreams as Streams
 import scr.MarkovClasses as MarkovCls
 import scr.RandomVariantGenerators as Random
 import scr.FittingProbDist_MM as Est
@@ -27,6 +29,7 @@ class _Parameters:
         self._delta_t = Data.DELTA_T
 
         # calculate the adjusted discount rate
+        self._discountRate = Data.DISCOUNT
         self._adjDiscountRate = Data.DISCOUNT*Data.DELTA_T
 
         self._initialHealthState = HealthStats.WELL
@@ -46,6 +49,35 @@ class _Parameters:
         self._annualStateCosts = []
         self._annualStateUtilities = []
 
+        # cost and utility accrued over one time step for each transition (from, to)
+        self._transitionCostTable = None
+        self._transitionUtilityTable = None
+        # discount factors of the time steps of Data.SIM_LENGTH
+        self._discountFactors = None
+
+
+    def _calculate_payoff_tables(self):
+        """ precalculates the cost and utility accrued over one time step for each transition (from, to)
+        (the average of the annual state costs/utilities of the two states, and the treatment cost
+        which is only accrued for half of the time step when treatment ends with recovery) and the discount
+        factors of the time steps; the arrays are read-only, as parameter objects can be shared by many
+        patients and cohorts """
+
+        n = len(HealthStats)
+        costs = np.array([self.get_annual_state_cost(s) for s in HealthStats], dtype=float)
+        utilities = np.array([self.get_annual_state_utility(s) for s in HealthStats], dtype=float)
+
+        self._transitionCostTable = 0.5 * (costs.reshape(n, 1) + costs.reshape(1, n)) * self._delta_t
+        self._transitionUtilityTable = 0.5 * (utilities.reshape(n, 1) + utilities.reshape(1, n)) * self._delta_t
+
+        # treatment cost (incurred only in the treatment state)
+        self._transitionCostTable[HealthStats.TREATMENT.value] += self._annualTreatmentCost * self._delta_t
+        self._transitionCostTable[HealthStats.TREATMENT.value, HealthStats.WELL.value] -= \
+            0.5 * self._annualTreatmentCost * self._delta_t
+
+        self._discountFactors = self._calculate_discount_factors(self.get_num_steps(Data.SIM_LENGTH))
+        for table in (self._transitionCostTable, self._transitionUtilityTable):
+            table.flags.writeable = False
 
     def get_initial_health_state(self):
         return self._initialHealthState
@@ -56,9 +88,23 @@ class _Parameters:
     def get_adj_discount_rate(self):
         return self._adjDiscountRate
 
+    def get_discount_rate(self):
+        """ :returns: the annual (continuous) discount rate """
+        return self._discountRate
+
+    def get_continuous_discount_rate(self):
+        """ :returns: the continuous discount rate whose discount factors at the middle of the time steps are
+        the discount factors of the time steps (see get_discount_factors) """
+        return 2 * np.log1p(self._adjDiscountRate/2) / self._delta_t
+
     def get_transition_prob(self, state):
         return self._prob_matrix[state.value]
 
+    def get_rate_matrix(self):
+        """ :returns: the matrix of transition rates (None on the diagonal), or None if these parameters
+        only specify transition probabilities """
+        return self._rate_matrix if len(self._rate_matrix) > 0 else None
+
     def get_annual_state_cost(self, state):
         if state == HealthStats.WELL:
             return 0
@@ -71,6 +117,37 @@ class _Parameters:
     def get_annual_treatment_cost(self):
         return self._annualTreatmentCost
 
+    def get_transition_cost_table(self):
+        """ :returns: (undiscounted) cost accrued over one time step for each transition (from, to) """
+        return self._transitionCostTable
+
+    def get_transition_utility_table(self):
+        """ :returns: (undiscounted) utility accrued over one time step for each transition (from, to) """
+        return self._transitionUtilityTable
+
+    def get_num_steps(self, sim_length):
+        """ :returns: the number of time steps needed to simulate sim_length years """
+        k = 0
+        while k*self._delta_t < sim_length:
+            k += 1
+        return k
+
+    def get_discount_factors(self, n_steps):
+        """ :returns: the (read-only) discount factors of the first n_steps time steps (payoffs of time step k
+        are discounted to the middle of the time step) """
+        if len(self._discountFactors) < n_steps:
+            # longer than the simulation length of the inputs, calculated without changing this object
+            return self._calculate_discount_factors(n_steps)
+        return self._discountFactors[:n_steps]
+
+    def _calculate_discount_factors(self, n_steps):
+        """ :returns: a read-only array of the discount factors of the first n_steps time steps """
+        # present value of 1 (as scr.EconEvalClasses.pv, which is not imported here because the economic
+        # evaluation library loads the plotting libraries)
+        factors = np.array([1 / pow(1 + self._adjDiscountRate/2, 2*k+1) for k in range(n_steps)])
+        factors.flags.writeable = False
+        return factors
+
 
 class _ParametersFixed(_Parameters):
 
@@ -89,6 +166,88 @@ class _ParametersFixed(_Parameters):
         self._annualStateCosts = Data.ANNUAL_STATE_COST
         self._annualStateUtilities = Data.ANNUAL_STATE_UTILITY
 
+        # these parameters are shared by all patients, so store them as immutable tuples
+        self._prob_matrix = tuple(tuple(row) for row in self._prob_matrix)
+        self._annualStateCosts = tuple(self._annualStateCosts)
+        self._annualStateUtilities = tuple(self._annualStateUtilities)
+
+        self._calculate_payoff_tables()
+
+
+def get_fixed_parameters(therapy):
+    """ returns the fixed parameters of the selected therapy; the parameter object is shared by all
+    patients and only recalculated when the therapy, rate matrix or other inputs change
+    :param therapy: selected therapy
+    """
+    if therapy == Therapies.ANNUAL:
+        rate_matrix = Data.TRANS_MATRIX
+    else:
+        rate_matrix = Data.TRANS_MATRIX_SEMI
+
+    return _get_fixed_parameters(
+        therapy, _to_key(rate_matrix), Data.DELTA_T,
+        (Data.DISCOUNT, Data.MDA_COST, _to_key(Data.ANNUAL_STATE_COST), _to_key(Data.ANNUAL_STATE_UTILITY)))
+
+
+def clear_parameter_cache():
+    """ removes all the cached fixed parameter objects """
+    _get_fixed_parameters.cache_clear()
+
+
+@lru_cache(maxsize=Data.PARAM_CACHE_SIZE)
+def _get_fixed_parameters(therapy, rate_matrix, delta_t, other_inputs):
+    # the arguments are only the cache key, the parameters are read from Hookworm_InputData
+    return _ParametersFixed(therapy)
+
+
+def _to_key(values):
+    """ :returns: a hashable copy of a (nested) list of values """
+    if isinstance(values, (list, tuple, np.ndarray)):
+        return tuple(_to_key(v) for v in values)
+    return values
+
+
+class ParametersScenario(_Parameters):
+    def __init__(self, coverage, mda_rounds, mda_cost, discount, annual_state_utilities, infection_rate=None):
+        """ parameters of a mass drug administration (MDA) scenario
+        :param coverage: probability that an infected person is treated in one MDA round
+        :param mda_rounds: number of MDA rounds per year (1 for annual, 2 for semi-annual, 4 for quarterly, ...)
+        :param mda_cost: cost of one MDA round per person
+        :param discount: annual discount rate
+        :param annual_state_utilities: annual utility of each health state
+        :param infection_rate: rate of infection S-->I (Data.a if None)
+        """
+        #initialize base class
+        _Parameters.__init__(self, therapy=None)
+
+        self._annualTreatmentCost = mda_cost * mda_rounds
+        self._discountRate = discount
+        self._adjDiscountRate = discount * self._delta_t
+
+        self._rate_matrix = build_rate_matrix(coverage, mda_rounds, infection_rate)
+        self._prob_matrix, p = MarkovCls.continuous_to_discrete(self._rate_matrix, self._delta_t)
+
+        self._annualStateCosts = Data.ANNUAL_STATE_COST
+        self._annualStateUtilities = list(annual_state_utilities)
+
+        self._calculate_payoff_tables()
+
+
+def build_rate_matrix(coverage, mda_rounds, infection_rate=None):
+    """ :returns: the transition rate matrix of a mass drug administration scenario (the rate of
+    treatment of infected persons is the coverage times the number of MDA rounds per year)
+    :param coverage: probability that an infected person is treated in one MDA round
+    :param mda_rounds: number of MDA rounds per year
+    :param infection_rate: rate of infection S-->I (Data.a if None)
+    """
+    if infection_rate is None:
+        infection_rate = Data.a
+    return [
+        [None,      infection_rate,     0],                 # Susceptible
+        [Data.b,    None,       coverage * mda_rounds],     # Infected
+        [Data.d,    Data.e,     None]                       # Treatment
+    ]
+
 
 class ParametersProbabilistic(_Parameters):
     def __init__(self, seed, therapy):
@@ -108,8 +267,16 @@ class ParametersProbabilistic(_Parameters):
           #  self._infectionProbMatrixRVG.append(Random.Dirichlet(prob[j:]))
           #  j += 1
 
+        # transition probabilities are not sampled (point estimates of the therapy)
+        self._rate_matrix = get_fixed_parameters(therapy)._rate_matrix
+        self._prob_matrix = get_fixed_parameters(therapy)._prob_matrix
+
         # annual state cost
         for cost in Data.ANNUAL_STATE_COST:
+            # a gamma distribution cannot be fitted to a zero cost (None keeps the cost fixed)
+            if cost == 0:
+                self._annualStateCostRVG.append(None)
+                continue
             # find shape and scale of the assumed gamma distribution
             estDic = Est.get_gamma_params(mean=cost, st_dev=cost/4)
             # append the distribution
@@ -118,6 +285,10 @@ class ParametersProbabilistic(_Parameters):
 
         # annual state utility
         for utility in Data.ANNUAL_STATE_UTILITY:
+            # a beta distribution cannot be fitted to a utility of 0 or 1 (None keeps the utility fixed)
+            if utility in (0, 1):
+                self._annualStateUtilityRVG.append(None)
+                continue
             # find alpha and beta of the assumed beta distribution
             estDic = Est.get_beta_params(mean=utility, st_dev=utility/4)
             # append the distribution
@@ -144,11 +315,91 @@ class ParametersProbabilistic(_Parameters):
 
         # sample from gamma distributions that are assumed for annual state costs
         self._annualStateCosts = []
-        for dist in self._annualStateCostRVG:
-            self._annualStateCosts.append(dist.sample(self._rng))
+        for dist, cost in zip(self._annualStateCostRVG, Data.ANNUAL_STATE_COST):
+            self._annualStateCosts.append(cost if dist is None else dist.sample(self._rng))
 
         # sample from beta distributions that are assumed for annual state utilities
         self._annualStateUtilities = []
-        for dist in self._annualStateUtilityRVG:
-            self._annualStateUtilities.append(dist.sample(self._rng))
+        for dist, utility in zip(self._annualStateUtilityRVG, Data.ANNUAL_STATE_UTILITY):
+            self._annualStateUtilities.append(utility if dist is None else dist.sample(self._rng))
+
+        self._calculate_payoff_tables()
 
+
+class ParametersSampled(_Parameters):
+    def __init__(self, therapy, prob_matrix, annual_state_costs, annual_state_utilities):
+        """ parameters of one draw of sample_parameters
+        :param therapy: selected therapy
+        :param prob_matrix: transition probability matrix
+        :param annual_state_costs: annual cost of each health state
+        :param annual_state_utilities: annual utility of each health state
+        """
+        #initialize base class
+        _Parameters.__init__(self, therapy)
+
+        self._prob_matrix = prob_matrix
+        self._annualStateCosts = annual_state_costs
+        self._annualStateUtilities = annual_state_utilities
+
+        self._calculate_payoff_tables()
+
+
+def sample_parameters(therapy, n_draws, seed):
+    """ fits the parameter distributions once and draws all parameters of n_draws parameter sets
+    (gamma state costs, beta state utilities and Dirichlet transition probabilities) with one NumPy
+    call per parameter group
+    :param therapy: selected therapy
+    :param n_draws: number of parameter sets
+    :param seed: seed of the random streams (the costs and utilities drawn with the same seed are the same
+        for all therapies); each parameter group has its own stream, so draw d is the same for any n_draws
+    :returns: dictionary of arrays 'prob_matrix' (draws x states x states), 'annual_state_costs' and
+        'annual_state_utilities' (draws x states)
+    """
+    streams = Streams.RandomStreams(seed)
+    n_states = len(HealthStats)
+
+    # annual state costs (gamma; zero costs are fixed)
+    costs = np.array(Data.ANNUAL_STATE_COST, dtype=float)
+    shapes = np.zeros(n_states)
+    scales = np.zeros(n_states)
+    for i, cost in enumerate(costs):
+        if cost != 0:
+            estDic = Est.get_gamma_params(mean=cost, st_dev=cost/4)
+            shapes[i] = estDic["a"]
+            scales[i] = estDic["scale"]
+    sampled_costs = np.where(costs == 0, costs,
+                             streams.get_generator(Streams.PARAMETERS, 0).gamma(
+                                 np.where(costs == 0, 1, shapes), np.where(costs == 0, 1, scales),
+                                 size=(n_draws, n_states)))
+
+    # annual state utilities (beta; utilities of 0 or 1 are fixed)
+    utilities = np.array(Data.ANNUAL_STATE_UTILITY, dtype=float)
+    fixed = (utilities == 0) | (utilities == 1)
+    alphas = np.ones(n_states)
+    betas = np.ones(n_states)
+    for i, utility in enumerate(utilities):
+        if not fixed[i]:
+            estDic = Est.get_beta_params(mean=utility, st_dev=utility/4)
+            alphas[i] = estDic["a"]
+            betas[i] = estDic["b"]
+    sampled_utilities = np.where(fixed, utilities, streams.get_generator(Streams.PARAMETERS, 1).beta(
+        alphas, betas, size=(n_draws, n_states)))
+
+    # transition probabilities (a Dirichlet distribution for each row of the transition probability matrix,
+    # sampled as normalized gamma variates; transitions with zero probability stay impossible)
+    concentrations = np.array(get_fixed_parameters(therapy)._prob_matrix) * Data.PSA_TRANS_SAMPLE_SIZE
+    gammas = streams.get_generator(Streams.PARAMETERS, 2).gamma(np.where(concentrations > 0, concentrations, 1),
+                                                                size=(n_draws, n_states, n_states))
+    gammas[:, concentrations == 0] = 0
+    sampled_probs = gammas / gammas.sum(axis=2, keepdims=True)
+
+    return dict(prob_matrix=sampled_probs,
+                annual_state_costs=sampled_costs,
+                annual_state_utilities=sampled_utilities)
+
+
+def get_sampled_parameters(therapy, samples):
+    """ :returns: list of parameter objects of the draws returned by sample_parameters """
+    return [ParametersSampled(therapy, samples['prob_matrix'][i], samples['annual_state_costs'][i],
+                              samples['annual_state_utilities'][i])
+            for i in range(len(samples['prob_matrix']))]
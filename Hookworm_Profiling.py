@@ -0,0 +1,147 @@
+import atexit
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import Hookworm_InputData as Data
+
+# instrumentation is enabled by Data.PROFILE_ON or the environment variable HOOKWORM_PROFILE
+# (HOOKWORM_PROFILE=cprofile also captures a cProfile of the whole run); at the end of the run the per-phase
+# breakdown is printed, and exported to json if HOOKWORM_PROFILE_FILE names a file
+
+
+class _Phase:
+    """ times one occurrence of a phase (a context manager) """
+    __slots__ = ('_name', '_start')
+
+    def __init__(self, name):
+        self._name = name
+        self._start = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self._start
+        calls, total = _phases.get(self._name, (0, 0))
+        _phases[self._name] = (calls + 1, total + seconds)
+        return False
+
+
+class _NoPhase:
+    """ the phase returned when the instrumentation is off (does nothing) """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+_enabled = False
+_startTime = 0
+_phases = {}        # name: (number of calls, total seconds)
+_counters = {}      # name: count
+_profiler = None    # cProfile.Profile when capturing a profile
+_atExitRegistered = False
+
+
+def enable(profile=False):
+    """ turns the instrumentation on (and resets the timers and counters)
+    :param profile: set to True to also capture a cProfile of the run
+    """
+    global _enabled, _startTime, _profiler, _atExitRegistered
+    _enabled = True
+    _startTime = time.perf_counter()
+    _phases.clear()
+    _counters.clear()
+    if profile and _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    if not _atExitRegistered:
+        atexit.register(_report_at_exit)
+        _atExitRegistered = True
+
+
+def disable():
+    """ turns the instrumentation off """
+    global _enabled
+    _enabled = False
+    if _profiler is not None:
+        _profiler.disable()
+
+
+def is_enabled():
+    return _enabled
+
+
+def phase(name):
+    """ :returns: a context manager that adds the time spent in its block to the phase with the given name
+    (phases can be nested, the time of a phase includes the time of the phases within it) """
+    if not _enabled:
+        return _NO_PHASE
+    return _Phase(name)
+
+
+def count(name, n=1):
+    """ adds n to the counter with the given name """
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def get_breakdown():
+    """ :returns: dictionary with the wall time since the instrumentation was enabled, the number of calls and
+    total time of each phase, and the counters """
+    return dict(wall_time=time.perf_counter() - _startTime,
+                phases={name: dict(calls=calls, seconds=seconds) for name, (calls, seconds) in _phases.items()},
+                counters=dict(_counters))
+
+
+def print_breakdown(n_profile_lines=20):
+    """ prints the time of each phase, the counters and (if captured) the functions with the largest
+    cumulative time in the cProfile """
+    breakdown = get_breakdown()
+    wall_time = breakdown['wall_time']
+    print("Phase breakdown (wall time {:.3f} s)".format(wall_time))
+    for name, phase_stats in sorted(breakdown['phases'].items(), key=lambda item: -item[1]['seconds']):
+        print("  {:<56} {:>9} calls {:>10.3f} s {:>7.1%}".format(
+            name, phase_stats['calls'], phase_stats['seconds'], phase_stats['seconds'] / wall_time))
+    if breakdown['counters']:
+        print("Counters")
+        for name, value in sorted(breakdown['counters'].items()):
+            print("  {:<56} {:>15,}".format(name, value))
+
+    if _profiler is not None:
+        stream = io.StringIO()
+        pstats.Stats(_profiler, stream=stream).sort_stats('cumulative').print_stats(n_profile_lines)
+        print(stream.getvalue())
+    print("")
+
+
+def export_breakdown(file_name):
+    """ writes the breakdown (see get_breakdown) to a json file, and the cProfile (if captured) to
+    file_name + '.prof' (to read with pstats or snakeviz) """
+    with open(file_name, 'w') as file:
+        json.dump(get_breakdown(), file, indent=2)
+    if _profiler is not None:
+        _profiler.dump_stats(file_name + '.prof')
+
+
+def _report_at_exit():
+    if not _enabled:
+        return
+    disable()
+    print_breakdown()
+    if os.environ.get('HOOKWORM_PROFILE_FILE'):
+        export_breakdown(os.environ['HOOKWORM_PROFILE_FILE'])
+
+
+# turn the instrumentation on if requested
+if Data.PROFILE_ON or os.environ.get('HOOKWORM_PROFILE', '') not in ('', '0'):
+    enable(profile=os.environ.get('HOOKWORM_PROFILE', '').lower() == 'cprofile')
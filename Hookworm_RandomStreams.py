@@ -0,0 +1,53 @@
+import numpy as np
+
+# kinds of random streams
+TIME_STEPS = 0      # uniforms of the time steps of the per-patient and batched engines
+EVENTS = 1          # uniforms of the events of the event-driven engine
+PARAMETERS = 2      # parameter draws
+COHORTS = 3         # seeds of the cohorts of a set of simulations (e.g. one per PSA draw)
+INITIAL_STATES = 4  # uniforms to sample the initial health states of patients (e.g. of a metapopulation)
+
+
+class RandomStreams:
+    """ reproducible, independent random streams derived from one seed: a stream is identified by its kind and
+    ids (e.g. the time step and the patient index), never by the order in which numbers are drawn, so the
+    numbers a patient receives do not depend on the number of workers, on the chunk size or on other patients """
+
+    def __init__(self, seed):
+        """
+        :param seed: seed of all streams (e.g. the cohort id)
+        """
+        self._seed = seed
+        self._keys = {}     # Philox key of each kind of stream
+
+    def get_seed(self, kind, *ids):
+        """ :returns: a 64-bit integer seed of the stream with the given kind and ids """
+        return int(np.random.SeedSequence([self._seed, kind, *ids]).generate_state(1, np.uint64)[0])
+
+    def get_generator(self, kind, *ids):
+        """ :returns: a numpy Generator of the stream with the given kind and ids """
+        return np.random.Generator(np.random.PCG64(np.random.SeedSequence([self._seed, kind, *ids])))
+
+    def get_uniforms(self, kind, step, start, stop, n_per_patient=1):
+        """ bulk uniform random numbers of patients start to stop at a time step (or event), generated by a
+        counter-based generator (Philox) that jumps straight to the numbers of patient start: the numbers of a
+        patient only depend on the seed, the kind, the step and the patient index
+        :param kind: kind of stream (TIME_STEPS or EVENTS)
+        :param step: index of the time step (or event)
+        :param start: index of the first patient
+        :param stop: index after the last patient
+        :param n_per_patient: number of uniforms of each patient at each step
+        :returns: array of (stop - start) uniforms, or (stop - start) x n_per_patient array if n_per_patient > 1
+        """
+        if kind not in self._keys:
+            self._keys[kind] = self.get_seed(kind)
+        bit_generator = np.random.Philox(key=np.array([self._keys[kind], step], dtype=np.uint64))
+
+        # each value of the counter gives 4 numbers
+        first = int(start) * n_per_patient
+        bit_generator.advance(first // 4)
+        uniforms = np.random.Generator(bit_generator).random(first % 4 + int(stop - start) * n_per_patient)
+        uniforms = uniforms[first % 4:]
+        if n_per_patient > 1:
+            return uniforms.reshape(stop - start, n_per_patient)
+        return uniforms
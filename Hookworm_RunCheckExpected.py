@@ -0,0 +1,29 @@
+import Hookworm_InputData as Settings
+import Hookworm_ParameterClasses as P
+import Hookworm_MarkovModel as MarkovCls
+import Hookworm_SupportMarkov as SupportMarkov
+
+# number of patients of the stochastic runs (large enough for narrow confidence intervals)
+POP_SIZE = 20000
+# number of expected outcomes checked for each therapy (cost, utility, infections and treated)
+N_OUTCOMES = 4
+
+# checks that the expected outcomes of the deterministic Markov trace fall within the confidence intervals of
+# a stochastic simulation of the same cohort (fails with an AssertionError if an expected outcome is outside its CI)
+if __name__ == '__main__':
+    therapies = ((P.Therapies.ANNUAL, 'Annual MDA'), (P.Therapies.SEMI, 'Semi-Annual MDA'))
+    # Bonferroni correction, so that the check only fails by chance with probability Settings.ALPHA
+    alpha = Settings.ALPHA / (N_OUTCOMES * len(therapies))
+
+    all_within = True
+    for id, (therapy, therapy_name) in enumerate(therapies):
+        # simulate the cohort and calculate its expected outcomes
+        cohort = MarkovCls.Cohort(id=id, therapy=therapy, pop_size=POP_SIZE)
+        simOutputs = cohort.simulate()
+        expectedOutputs = cohort.simulate_expected()
+
+        all_within = SupportMarkov.check_expected_outcomes(
+            simOutputs, expectedOutputs, therapy_name, alpha) and all_within
+
+    assert all_within, 'An expected outcome is outside the confidence interval of the simulated cohort.'
+    print('All expected outcomes are within the confidence intervals of the simulated cohorts.')
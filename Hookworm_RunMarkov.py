@@ -1,20 +1,18 @@
 import Hookworm_ParameterClasses as P
-import Hookworm_MarkovModel as MarkovCls
+import Hookworm_Cache as Cache
 import scr.SamplePathClasses as PathCls
 import scr.FigureSupport as Figs
 
-# create and cohort
-cohort = MarkovCls.Cohort(
+# simulate a cohort (or reload it from the cache)
+simOutputs = Cache.simulate_cohort(
     id=0,
     therapy=P.Therapies.ANNUAL)
 
-simOutputs = cohort.simulate()
-
 # graph infection curve
 PathCls.graph_sample_path(
     sample_path=simOutputs.get_infection_curve(),
     title='infection curve',
-    x_label='Simulation time step',
+    x_label='Simulation time (year)',
     y_label='Number of infected patients')
 
 # graph histogram of infection durations
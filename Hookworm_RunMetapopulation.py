@@ -0,0 +1,25 @@
+import numpy as np
+import Hookworm_Metapopulation as Meta
+import Hookworm_SupportMarkov as Support
+
+if __name__ == '__main__':
+    # villages with different population sizes, baseline prevalences, MDA coverages and frequencies
+    rng = np.random.default_rng(0)
+    n_villages = 300
+    metapopulation = Meta.Metapopulation(
+        id=1,
+        pop_sizes=rng.integers(200, 2000, n_villages),
+        baseline_prevalences=rng.uniform(0.02, 0.2, n_villages),
+        coverages=rng.uniform(0.4, 0.85, n_villages),
+        mda_rounds=rng.choice([1, 2], n_villages),
+        coupling=0.1)     # a tenth of the transmission is with the whole district
+
+    # simulate all villages with dynamic transmission (on all cores)
+    outputs = metapopulation.simulate(n_workers=None, dynamic=True)
+
+    # outcomes of the whole district and of each village
+    Support.print_outcomes(outputs.get_overall_outputs(), 'All villages:')
+    summary = outputs.get_community_summary()
+    print('Villages with a final prevalence above 10%:', int(np.sum(summary['final_prevalence'] > 0.1)))
+    outputs.write_community_table('Hookworm_Villages.csv')
+    print('Mean outcomes of each village written to Hookworm_Villages.csv')
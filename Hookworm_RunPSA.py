@@ -0,0 +1,10 @@
+import Hookworm_ParameterClasses as P
+import Hookworm_PSA as PSA
+import Hookworm_SupportMarkov as SupportMarkov
+
+if __name__ == '__main__':
+    # simulate a cohort under both therapies for each parameter draw (on all cores)
+    psaOutputs = PSA.simulate_PSA(therapies=[P.Therapies.ANNUAL, P.Therapies.SEMI])
+
+    # report the cost-effectiveness plane and acceptability
+    SupportMarkov.report_PSA(psaOutputs, ['Annual MDA', 'Semi-Annual MDA'])
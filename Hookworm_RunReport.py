@@ -0,0 +1,11 @@
+import Hookworm_ParameterClasses as P
+import Hookworm_Cache as Cache
+import Hookworm_SupportMarkov as SupportMarkov
+
+# headless batch run: simulate (or reload) both therapies with common random numbers and write the report files
+# (estimates.json, CE_table.csv, NMB_lines.csv and the figures) without showing anything on screen
+if __name__ == '__main__':
+    simOutputs_annual, simOutputs_semi = Cache.simulate_paired_cohort(
+        id=0, therapies=[P.Therapies.ANNUAL, P.Therapies.SEMI])
+
+    SupportMarkov.write_report(simOutputs_annual, simOutputs_semi, paired=True)
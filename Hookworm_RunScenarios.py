@@ -0,0 +1,8 @@
+import Hookworm_Scenarios as Scenarios
+
+if __name__ == '__main__':
+    # grid of coverages and MDA frequencies (annual, semi-annual, quarterly)
+    scenarios = Scenarios.get_scenarios(coverages=[0.4, 0.562, 0.7, 0.85], mda_rounds=[1, 2, 4])
+
+    # simulate all scenarios (on all cores) and write the results table
+    Scenarios.sweep(scenarios, file_name='Hookworm_Scenarios.csv')
@@ -0,0 +1,102 @@
+import csv
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import Hookworm_InputData as Data
+import Hookworm_ParameterClasses as P
+import Hookworm_MarkovModel as MarkovCls
+
+# columns of the results table of a scenario sweep
+SCENARIO_COLUMNS = ['coverage', 'mda_rounds', 'mda_cost', 'discount', 'infected_utility']
+OUTCOME_COLUMNS = ['pop_size',
+                   'mean_cost', 'cost_CI_lower', 'cost_CI_upper',
+                   'mean_utility', 'utility_CI_lower', 'utility_CI_upper',
+                   'mean_infection_duration', 'mean_count_infections', 'mean_count_treated',
+                   'final_prevalence']
+
+
+def get_scenarios(coverages=None, mda_rounds=(1, 2), mda_costs=None, discounts=None, infected_utilities=None):
+    """ :returns: list of all scenarios of the grid (dictionaries with the keys of SCENARIO_COLUMNS)
+    :param coverages: list of probabilities that an infected person is treated in one MDA round (Data.c if None)
+    :param mda_rounds: list of numbers of MDA rounds per year (1: annual, 2: semi-annual, 4: quarterly, ...)
+    :param mda_costs: list of costs of one MDA round per person (Data.MDA_COST if None)
+    :param discounts: list of annual discount rates (Data.DISCOUNT if None)
+    :param infected_utilities: list of annual utilities of the infected state (Data.ANNUAL_STATE_UTILITY if None)
+    """
+    grid = [[Data.c] if coverages is None else coverages,
+            mda_rounds,
+            [Data.MDA_COST] if mda_costs is None else mda_costs,
+            [Data.DISCOUNT] if discounts is None else discounts,
+            [Data.ANNUAL_STATE_UTILITY[P.HealthStats.INFECTED.value]] if infected_utilities is None
+            else infected_utilities]
+    return [dict(zip(SCENARIO_COLUMNS, values)) for values in itertools.product(*grid)]
+
+
+def get_scenario_parameters(scenario):
+    """ :returns: the parameter object of a scenario returned by get_scenarios """
+    utilities = list(Data.ANNUAL_STATE_UTILITY)
+    utilities[P.HealthStats.INFECTED.value] = scenario['infected_utility']
+    return P.ParametersScenario(coverage=scenario['coverage'], mda_rounds=scenario['mda_rounds'],
+                                mda_cost=scenario['mda_cost'], discount=scenario['discount'],
+                                annual_state_utilities=utilities)
+
+
+def sweep(scenarios, pop_size=None, seed=0, n_workers=None, file_name=None):
+    """ simulates a cohort for every scenario, one scenario per task of a process pool; all scenarios
+    are simulated with the same cohort id (common random numbers across scenarios), so the results do not
+    depend on the number of workers or on the order of the scenarios
+    :param scenarios: list of scenarios (see get_scenarios)
+    :param pop_size: cohort population size of each scenario (Data.POP_SIZE if None)
+    :param seed: cohort id of all scenarios
+    :param n_workers: number of worker processes (None to use all cores, 1 to run in this process)
+    :param file_name: (optional) name of the csv file to write the results table to
+    :returns: the results table as a list of rows (dictionaries with the keys SCENARIO_COLUMNS + OUTCOME_COLUMNS)
+    """
+    if pop_size is None:
+        pop_size = Data.POP_SIZE
+
+    tasks = [(scenario, pop_size, seed) for scenario in scenarios]
+    if n_workers == 1:
+        rows = list(map(_simulate_scenario, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            rows = list(executor.map(_simulate_scenario, tasks, chunksize=max(1, len(tasks) // 64)))
+
+    if file_name is not None:
+        write_table(rows, file_name)
+    return rows
+
+
+def write_table(rows, file_name):
+    """ writes the results table of a scenario sweep to a csv file (one row per scenario) """
+    with open(file_name, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=SCENARIO_COLUMNS + OUTCOME_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _simulate_scenario(args):
+    """ simulates the cohort of one scenario (runs in a worker process)
+    :param args: (scenario, pop_size, seed)
+    :returns: the row of the results table of the scenario
+    """
+    scenario, pop_size, seed = args
+
+    cohort = MarkovCls.Cohort(id=seed, therapy=None, pop_size=pop_size,
+                              parameters=get_scenario_parameters(scenario))
+    outputs = cohort.simulate()
+
+    cost_CI = outputs.get_sumStat_discounted_cost().get_t_CI(alpha=Data.ALPHA)
+    utility_CI = outputs.get_sumStat_discounted_utility().get_t_CI(alpha=Data.ALPHA)
+    prevalence = outputs.get_prevalence_counter().get_prevalence()
+
+    row = dict(scenario)
+    row.update(pop_size=pop_size,
+               mean_cost=outputs.get_sumStat_discounted_cost().get_mean(),
+               cost_CI_lower=cost_CI[0], cost_CI_upper=cost_CI[1],
+               mean_utility=outputs.get_sumStat_discounted_utility().get_mean(),
+               utility_CI_lower=utility_CI[0], utility_CI_upper=utility_CI[1],
+               mean_infection_duration=outputs.get_sumStat_infection_times().get_mean(),
+               mean_count_infections=outputs.get_sumStat_count_infections().get_mean(),
+               mean_count_treated=outputs.get_sumStat_count_treated().get_mean(),
+               final_prevalence=float(prevalence[-1]) / pop_size)
+    return row
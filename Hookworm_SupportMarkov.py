@@ -1,9 +1,17 @@
+import csv
+import json
+import os
 import Hookworm_InputData as Settings
 import scr.FormatFunctions as F
 import scr.StatisticalClasses as Stat
-import scr.EconEvalClasses as Econ
-import scr.SamplePathClasses as PathCls
-import scr.FigureSupport as Figs
+import Hookworm_OnlineStats as Online
+import Hookworm_Profiling as Profiling
+
+# the plotting and economic evaluation libraries (which load matplotlib) are only imported by the
+# functions that draw figures or build CEA/CBA objects
+
+# willingness-to-pay values of the net monetary benefit lines
+WTPS = list(range(0, 901, 100))
 
 
 def print_outcomes(simOutput, therapy_name):
@@ -51,55 +59,116 @@ def print_outcomes(simOutput, therapy_name):
     print("")
 
 
-def draw_infection_curves_and_histograms(simOutputs_ANNUAL, simOutputs_SEMI):
+def check_expected_outcomes(simOutput, expectedOutput, therapy_name, alpha=None):
+    """ checks that the expected outcomes of a cohort fall within the confidence intervals
+    estimated from simulating the cohort
+    :param simOutput: output of a simulated cohort
+    :param expectedOutput: expected output of the same cohort (from Cohort.simulate_expected)
+    :param therapy_name: the name of the selected therapy
+    :param alpha: significance level of the confidence intervals (Settings.ALPHA if None)
+    :returns: True if all expected outcomes are within the confidence intervals
+    """
+    if Settings.EVENT_DRIVEN:
+        # the trace steps through time like the time-step engines, whose outcomes differ from those of the
+        # continuous-time engine (see MarkovModel.simulate_events)
+        raise ValueError('The expected outcomes can only be checked against the time-step engines '
+                         '(turn EVENT_DRIVEN off).')
+    if alpha is None:
+        alpha = Settings.ALPHA
+    pairs = [
+        ('discounted cost', expectedOutput.get_expected_discounted_cost(), simOutput.get_sumStat_discounted_cost()),
+        ('discounted utility', expectedOutput.get_expected_discounted_utility(),
+         simOutput.get_sumStat_discounted_utility()),
+        ('number of infections', expectedOutput.get_expected_count_infections(),
+         simOutput.get_sumStat_count_infections()),
+        ('number treated', expectedOutput.get_expected_count_treated(), simOutput.get_sumStat_count_treated())
+    ]
+
+    print(therapy_name)
+    all_within = True
+    for name, expected, sum_stat in pairs:
+        interval = sum_stat.get_t_CI(alpha=alpha)
+        within = interval[0] <= expected <= interval[1]
+        all_within = all_within and within
+        print("  Expected {} {:.4f} {} the {:.{prec}%} CI:".format(
+            name, expected, 'within' if within else 'OUTSIDE', 1 - alpha, prec=1),
+            F.format_estimate_interval(estimate=sum_stat.get_mean(), interval=interval, deci=4))
+    print("")
+
+    return all_within
+
+
+def draw_infection_curves_and_histograms(simOutputs_ANNUAL, simOutputs_SEMI, report_dir=None):
     """ draws the infection curves and the histograms of time until HIV deaths
     :param simOutputs_mono: output of a cohort simulated under mono therapy
     :param simOutputs_combo: output of a cohort simulated under combination therapy
+    :param report_dir: (optional) directory to save the figures to instead of showing them
+        (Settings.REPORT_DIR in headless mode)
     """
+    report_dir = _get_report_dir(report_dir)
+    _prepare_figures(report_dir)
+    import scr.FigureSupport as Figs
 
-    # histograms of infection times
+    # histograms of the durations of all infection episodes (open episodes censored at the end)
     set_of_infection_times = [
-        simOutputs_ANNUAL.get_infection_durations(),
-        simOutputs_SEMI.get_infection_durations()
+        simOutputs_ANNUAL.get_episode_durations(),
+        simOutputs_SEMI.get_episode_durations()
     ]
 
     # graph histograms
-    Figs.graph_histograms(
-        data_sets=set_of_infection_times,
-        title='Histogram of Infection Duration',
-        x_label='Infection Duration (Year)',
-        y_label='Counts',
-        bin_width=1,
-        legend=['Annual Treatment', 'Semi-Annual Treatment'],
-        transparency=0.6
-    )
-
-
+    with Profiling.phase('figures (matplotlib)'):
+        Figs.graph_histograms(
+            data_sets=set_of_infection_times,
+            title='Histogram of Infection Duration',
+            x_label='Infection Duration (Year)',
+            y_label='Counts',
+            bin_width=1,
+            legend=['Annual Treatment', 'Semi-Annual Treatment'],
+            transparency=0.6
+        )
+    _finish_figures('infection_duration_histograms', report_dir)
+
+    draw_infection_curves(simOutputs_ANNUAL, simOutputs_SEMI, report_dir)
+
+
+def draw_infection_curves(simOutputs_ANNUAL, simOutputs_SEMI, report_dir=None):
+    """ draws the infection curves of both therapies (also for streaming outputs)
+    :param report_dir: (optional) directory to save the figures to instead of showing them
+        (Settings.REPORT_DIR in headless mode)
+    """
+    report_dir = _get_report_dir(report_dir)
+    _prepare_figures(report_dir)
+    import scr.SamplePathClasses as PathCls
 
     #get infection curves of both treatments
     infection_curves = [
        simOutputs_ANNUAL.get_infection_curve(), simOutputs_SEMI.get_infection_curve()]
 
     # graph infection curve
-    PathCls.graph_sample_paths(
-        sample_paths=infection_curves,
-        title='infection curve',
-        x_label='Simulation time step (year)',
-        y_label='Number of infected patients',
-        legends=['ANNUAL', '6-month'])
+    with Profiling.phase('figures (matplotlib)'):
+        PathCls.graph_sample_paths(
+            sample_paths=infection_curves,
+            title='infection curve',
+            x_label='Simulation time step (year)',
+            y_label='Number of infected patients',
+            legends=['ANNUAL', '6-month'])
+    _finish_figures('infection_curves', report_dir)
 
 
-def print_comparative_outcomes(simOutputs_ANNUAL, simOutputs_SEMI):
+def print_comparative_outcomes(simOutputs_ANNUAL, simOutputs_SEMI, paired=False):
     """ prints average increase in infection time, discounted cost, and discounted utility
     under combination therapy compared to mono therapy
     :param simOutputs_mono: output of a cohort simulated under mono therapy
     :param simOutputs_combo: output of a cohort simulated under combination therapy
+    :param paired: set to True if the two outputs are from the same patients (PairedCohort)
     """
 
 
-    decrease_infection_time = Stat.DifferenceStatIndp(name="decrease in infection time",
-                                                     x=simOutputs_SEMI.get_infection_durations(),
-                                                     y_ref=simOutputs_ANNUAL.get_infection_durations())
+    decrease_infection_time = get_difference_stat(name="decrease in infection time",
+                                                  simOutputs_x=simOutputs_SEMI,
+                                                  simOutputs_y_ref=simOutputs_ANNUAL,
+                                                  outcome='infection_times',
+                                                  paired=paired)
 
     estimate_CI = F.format_estimate_interval(estimate=decrease_infection_time.get_mean(),
                                              interval=decrease_infection_time.get_t_CI(alpha=Settings.ALPHA),
@@ -114,10 +183,12 @@ def print_comparative_outcomes(simOutputs_ANNUAL, simOutputs_SEMI):
           estimate_CI)
 
     # increase in discounted total cost under combination therapy with respect to mono therapy
-    increase_discounted_cost = Stat.DifferenceStatIndp(
+    increase_discounted_cost = get_difference_stat(
         name='Increase in discounted cost',
-        x=simOutputs_SEMI.get_costs(),
-        y_ref=simOutputs_ANNUAL.get_costs())
+        simOutputs_x=simOutputs_SEMI,
+        simOutputs_y_ref=simOutputs_ANNUAL,
+        outcome='costs',
+        paired=paired)
 
     # estimate and CI
     estimate_CI = F.format_estimate_interval(
@@ -130,10 +201,12 @@ def print_comparative_outcomes(simOutputs_ANNUAL, simOutputs_SEMI):
           estimate_CI)
 
     # increase in discounted total utility under combination therapy with respect to mono therapy
-    increase_discounted_utility = Stat.DifferenceStatIndp(
+    increase_discounted_utility = get_difference_stat(
         name='Increase in discounted cost',
-        x=simOutputs_SEMI.get_utilities(),
-        y_ref=simOutputs_ANNUAL.get_utilities())
+        simOutputs_x=simOutputs_SEMI,
+        simOutputs_y_ref=simOutputs_ANNUAL,
+        outcome='utilities',
+        paired=paired)
 
     # estimate and CI
     estimate_CI = F.format_estimate_interval(
@@ -145,7 +218,49 @@ def print_comparative_outcomes(simOutputs_ANNUAL, simOutputs_SEMI):
           estimate_CI)
 
 
-def report_CEA_CBA(simOutputs_ANNUAL, simOutputs_SEMI):
+def get_difference_stat(name, simOutputs_x, simOutputs_y_ref, outcome, paired=False):
+    """ :returns: the statistics of the difference in an outcome between two cohorts
+    (from the outcomes of each patient, or from the summary statistics of streaming outputs; memory-mapped
+    outcomes are folded in chunks)
+    :param outcome: 'infection_times', 'costs' or 'utilities'
+    :param paired: set to True if the two cohorts have the same patients (not for streaming outputs)
+    """
+    _check_pairing(simOutputs_x, simOutputs_y_ref, paired)
+    if simOutputs_x.is_streaming() or simOutputs_y_ref.is_streaming():
+        get_sum_stat = {'infection_times': lambda o: o.get_sumStat_infection_times(),
+                        'costs': lambda o: o.get_sumStat_discounted_cost(),
+                        'utilities': lambda o: o.get_sumStat_discounted_utility()}[outcome]
+        return Online.OnlineDifferenceStatIndp(name=name,
+                                               x=get_sum_stat(simOutputs_x),
+                                               y_ref=get_sum_stat(simOutputs_y_ref))
+
+    get_data = {'infection_times': lambda o: o.get_infection_durations(),
+                'costs': lambda o: o.get_costs(),
+                'utilities': lambda o: o.get_utilities()}[outcome]
+    if simOutputs_x.is_memory_mapped() or simOutputs_y_ref.is_memory_mapped():
+        # fold the memory-mapped outcomes in chunks instead of reading them into memory
+        if paired:
+            return Online.summarize_difference(name=name, x=get_data(simOutputs_x), y_ref=get_data(simOutputs_y_ref))
+        return Online.OnlineDifferenceStatIndp(name=name,
+                                               x=Online.summarize(name, get_data(simOutputs_x)),
+                                               y_ref=Online.summarize(name, get_data(simOutputs_y_ref)))
+    if paired:
+        return Stat.DifferenceStatPaired(name=name, x=get_data(simOutputs_x), y_ref=get_data(simOutputs_y_ref))
+    return Stat.DifferenceStatIndp(name=name, x=get_data(simOutputs_x), y_ref=get_data(simOutputs_y_ref))
+
+
+def report_CEA_CBA(simOutputs_ANNUAL, simOutputs_SEMI, paired=False, report_dir=None):
+    """ reports the cost-effectiveness and cost-benefit analyses of semi-annual vs. annual MDA
+    (with a report directory, the figures are saved and the CE table and net monetary benefit lines are
+    written to files there)
+    :param paired: set to True if the two outputs are from the same patients (PairedCohort)
+    :param report_dir: (optional) directory to write to instead of showing the figures
+        (Settings.REPORT_DIR in headless mode)
+    """
+    report_dir = _get_report_dir(report_dir)
+    _prepare_figures(report_dir)
+    import scr.EconEvalClasses as Econ
+
     annual_MDA=Econ.Strategy(
         name="Annual MDA",
         cost_obs=simOutputs_ANNUAL.get_costs(),
@@ -158,41 +273,260 @@ def report_CEA_CBA(simOutputs_ANNUAL, simOutputs_SEMI):
 
     listofStrategies = [annual_MDA, semiannual_MDA]
 
-    CEA = Econ. CEA(listofStrategies, if_paired=False)
-
-    CEA.show_CE_plane(
-        title='Cost-Effectiveness Analysis',
-        x_label='Additional discounted utility',
-        y_label='Additional discounted cost',
-        show_names=True,
-        show_clouds=True,
-        show_legend=True,
-        figure_size=6,
-        transparency=0.3
-    )
+    CEA = Econ. CEA(listofStrategies, if_paired=paired)
+
+    with Profiling.phase('figures (matplotlib)'):
+        CEA.show_CE_plane(
+            title='Cost-Effectiveness Analysis',
+            x_label='Additional discounted utility',
+            y_label='Additional discounted cost',
+            show_names=True,
+            show_clouds=True,
+            show_legend=True,
+            figure_size=6,
+            transparency=0.3
+        )
+    _finish_figures('CE_plane', report_dir)
     # report the CE table
-    CEA.build_CE_table(
-        interval=Econ.Interval.CONFIDENCE,
-        alpha=Settings.ALPHA,
-        cost_digits=2,
-        effect_digits=2,
-        icer_digits=2,
-    )
+    with Profiling.phase('CE table'):
+        CEA.build_CE_table(
+            interval=Econ.Interval.CONFIDENCE,
+            alpha=Settings.ALPHA,
+            cost_digits=2,
+            effect_digits=2,
+            icer_digits=2,
+        )
 
-    CBA = Econ.CBA(listofStrategies, if_paired=False)
+    CBA = Econ.CBA(listofStrategies, if_paired=paired)
 
     NBA = Econ.CBA(
         strategies = [annual_MDA, semiannual_MDA],
-        if_paired= False
+        if_paired= paired
     )
 
-    NBA.graph_deltaNMB_lines(
-        min_wtp=0,
-        max_wtp=900,
-        x_label="Willingness-to-pay for one unit reduction in DALY ($)",
-        y_label="Incremental Net Monetary Benefit ($)",
-        interval=Econ.Interval.CONFIDENCE,
-        transparency=0.4,
-        show_legend=True,
-        figure_size=6,
-        title='Cost Benefit Analysis')
+    with Profiling.phase('figures (matplotlib)'):
+        NBA.graph_deltaNMB_lines(
+            min_wtp=0,
+            max_wtp=900,
+            x_label="Willingness-to-pay for one unit reduction in DALY ($)",
+            y_label="Incremental Net Monetary Benefit ($)",
+            interval=Econ.Interval.CONFIDENCE,
+            transparency=0.4,
+            show_legend=True,
+            figure_size=6,
+            title='Cost Benefit Analysis')
+    _finish_figures('NMB_lines', report_dir)
+
+    if report_dir is not None:
+        os.makedirs(report_dir, exist_ok=True)
+        write_CE_table(simOutputs_ANNUAL, simOutputs_SEMI, os.path.join(report_dir, 'CE_table.csv'),
+                       paired=paired)
+        write_NMB_lines(simOutputs_ANNUAL, simOutputs_SEMI, os.path.join(report_dir, 'NMB_lines.csv'),
+                        paired=paired)
+
+
+def report_PSA(psaOutputs, therapy_names, wtps=(0, 100, 200, 300, 400, 500, 600, 700, 800, 900), report_dir=None):
+    """ reports the results of a probabilistic sensitivity analysis: the cost-effectiveness plane of the
+    parameter draws and the cost-effectiveness acceptability of each therapy
+    :param psaOutputs: PSAOutputs of Hookworm_PSA.simulate_PSA
+    :param therapy_names: names of the therapies (in the order of psaOutputs.get_therapies())
+    :param wtps: willingness-to-pay values of the acceptability table
+    :param report_dir: (optional) directory to save the figure to instead of showing it
+        (Settings.REPORT_DIR in headless mode)
+    """
+    report_dir = _get_report_dir(report_dir)
+    _prepare_figures(report_dir)
+    import scr.EconEvalClasses as Econ
+
+    strategies = []
+    for therapy, name in zip(psaOutputs.get_therapies(), therapy_names):
+        strategies.append(Econ.Strategy(
+            name=name,
+            cost_obs=psaOutputs.get_mean_costs(therapy),
+            effect_obs=psaOutputs.get_mean_utilities(therapy)))
+
+    # each parameter draw is paired across therapies
+    CEA = Econ.CEA(strategies, if_paired=True)
+    with Profiling.phase('figures (matplotlib)'):
+        CEA.show_CE_plane(
+            title='Probabilistic Sensitivity Analysis',
+            x_label='Additional discounted utility',
+            y_label='Additional discounted cost',
+            show_names=True,
+            show_clouds=True,
+            show_legend=True,
+            figure_size=6,
+            transparency=0.3
+        )
+    _finish_figures('PSA_CE_plane', report_dir)
+
+    # acceptability table
+    acceptability = psaOutputs.get_acceptability(wtps)
+    print("Probability of being the most cost-effective ({} parameter draws)".format(psaOutputs.get_n_draws()))
+    print("  WTP ($)  " + "  ".join("{:>16}".format(name) for name in therapy_names))
+    for wtp, probs in zip(wtps, acceptability):
+        print("  {:>7}  ".format(wtp) + "  ".join("{:>16.2f}".format(prob) for prob in probs))
+    print("")
+
+
+def write_estimates(simOutputs_ANNUAL, simOutputs_SEMI, file_name, paired=False):
+    """ writes the estimates (mean and Settings.ALPHA-level CI) of the outcomes of both therapies and of
+    the differences between them to a json file
+    :param paired: set to True if the two outputs are from the same patients (PairedCohort)
+    """
+    estimates = {}
+    for name, simOutput in (('Annual MDA', simOutputs_ANNUAL), ('Semi-Annual MDA', simOutputs_SEMI)):
+        estimates[name] = {
+            'infection time': _get_estimate(simOutput.get_sumStat_infection_times()),
+            'infection episode duration': _get_estimate(simOutput.get_sumStat_episode_durations()),
+            'number of infections': _get_estimate(simOutput.get_sumStat_count_infections()),
+            'number treated': _get_estimate(simOutput.get_sumStat_count_treated()),
+            'discounted cost': _get_estimate(simOutput.get_sumStat_discounted_cost()),
+            'discounted utility': _get_estimate(simOutput.get_sumStat_discounted_utility())}
+
+    # semi-annual with respect to annual MDA
+    estimates['Semi-Annual vs. Annual MDA'] = {
+        name: _get_estimate(get_difference_stat(name, simOutputs_SEMI, simOutputs_ANNUAL, outcome, paired))
+        for name, outcome in (('increase in infection time', 'infection_times'),
+                              ('increase in discounted cost', 'costs'),
+                              ('increase in discounted utility', 'utilities'))}
+
+    with open(file_name, 'w') as file:
+        json.dump(dict(alpha=Settings.ALPHA, paired=paired, estimates=estimates), file, indent=2)
+
+
+def write_CE_table(simOutputs_ANNUAL, simOutputs_SEMI, file_name, paired=False):
+    """ writes the cost-effectiveness table (mean and Settings.ALPHA-level CI of the discounted cost and
+    utility of each therapy, the increments with respect to annual MDA and the ICER) to a csv file
+    :param paired: set to True if the two outputs are from the same patients (PairedCohort)
+    """
+    rows = []
+    for name, simOutput in (('Annual MDA', simOutputs_ANNUAL), ('Semi-Annual MDA', simOutputs_SEMI)):
+        cost = _get_estimate(simOutput.get_sumStat_discounted_cost())
+        utility = _get_estimate(simOutput.get_sumStat_discounted_utility())
+        row = dict(strategy=name,
+                   cost=cost['mean'], cost_CI_lower=cost['CI'][0], cost_CI_upper=cost['CI'][1],
+                   utility=utility['mean'], utility_CI_lower=utility['CI'][0], utility_CI_upper=utility['CI'][1],
+                   incremental_cost=None, incremental_cost_CI_lower=None, incremental_cost_CI_upper=None,
+                   incremental_utility=None, incremental_utility_CI_lower=None, incremental_utility_CI_upper=None,
+                   ICER=None)
+        if simOutput is simOutputs_SEMI:
+            delta_cost = _get_estimate(get_difference_stat('cost', simOutputs_SEMI, simOutputs_ANNUAL,
+                                                           'costs', paired))
+            delta_utility = _get_estimate(get_difference_stat('utility', simOutputs_SEMI, simOutputs_ANNUAL,
+                                                              'utilities', paired))
+            row.update(incremental_cost=delta_cost['mean'],
+                       incremental_cost_CI_lower=delta_cost['CI'][0],
+                       incremental_cost_CI_upper=delta_cost['CI'][1],
+                       incremental_utility=delta_utility['mean'],
+                       incremental_utility_CI_lower=delta_utility['CI'][0],
+                       incremental_utility_CI_upper=delta_utility['CI'][1],
+                       ICER=delta_cost['mean'] / delta_utility['mean'] if delta_utility['mean'] != 0 else None)
+        rows.append(row)
+
+    with open(file_name, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_NMB_lines(simOutputs_ANNUAL, simOutputs_SEMI, file_name, paired=False, wtps=None):
+    """ writes the incremental net monetary benefit of semi-annual with respect to annual MDA (mean and
+    Settings.ALPHA-level CI) at each willingness-to-pay value to a csv file; the net monetary benefit
+    wtp*utility - cost is summarized from the means and covariance of the utilities and costs, so the
+    outcomes of each patient are read at most once (and not at all for streaming outputs)
+    :param paired: set to True if the two outputs are from the same patients (PairedCohort; not for
+        streaming outputs)
+    :param wtps: willingness-to-pay values (WTPS if None)
+    """
+    if wtps is None:
+        wtps = WTPS
+
+    _check_pairing(simOutputs_SEMI, simOutputs_ANNUAL, paired)
+    if paired:
+        # means and covariance of the paired differences in utility and cost (folded in chunks)
+        delta_stat = Online.summarize_covariance(
+            'incremental utility and cost', simOutputs_SEMI.get_utilities(), simOutputs_SEMI.get_costs(),
+            simOutputs_ANNUAL.get_utilities(), simOutputs_ANNUAL.get_costs())
+
+    with open(file_name, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['wtp', 'incremental_NMB', 'CI_lower', 'CI_upper'])
+        for wtp in wtps:
+            if paired:
+                stat = delta_stat.get_linear_combination('incremental NMB', wtp, -1)
+            else:
+                stat = Online.OnlineDifferenceStatIndp(
+                    'incremental NMB',
+                    x=simOutputs_SEMI.get_sumStat_utility_cost().get_linear_combination('NMB', wtp, -1),
+                    y_ref=simOutputs_ANNUAL.get_sumStat_utility_cost().get_linear_combination('NMB', wtp, -1))
+            estimate = _get_estimate(stat)
+            writer.writerow([wtp, estimate['mean'], estimate['CI'][0], estimate['CI'][1]])
+
+
+def write_report(simOutputs_ANNUAL, simOutputs_SEMI, report_dir=None, paired=False, figures=True):
+    """ writes the estimates (json), the CE table and the net monetary benefit lines (csv) and, if requested,
+    the figures (png) of semi-annual vs. annual MDA without showing anything on screen
+    :param report_dir: directory to write to (Settings.REPORT_DIR if None)
+    :param paired: set to True if the two outputs are from the same patients (PairedCohort)
+    :param figures: set to True to also draw and save the figures (imports matplotlib); for streaming
+        outputs, only the infection curves are drawn (the other figures need the outcomes of each patient)
+    """
+    if report_dir is None:
+        report_dir = Settings.REPORT_DIR
+    os.makedirs(report_dir, exist_ok=True)
+
+    write_estimates(simOutputs_ANNUAL, simOutputs_SEMI, os.path.join(report_dir, 'estimates.json'), paired)
+    write_CE_table(simOutputs_ANNUAL, simOutputs_SEMI, os.path.join(report_dir, 'CE_table.csv'), paired)
+    write_NMB_lines(simOutputs_ANNUAL, simOutputs_SEMI, os.path.join(report_dir, 'NMB_lines.csv'), paired)
+
+    if figures:
+        if simOutputs_ANNUAL.is_streaming() or simOutputs_SEMI.is_streaming():
+            draw_infection_curves(simOutputs_ANNUAL, simOutputs_SEMI, report_dir)
+        else:
+            draw_infection_curves_and_histograms(simOutputs_ANNUAL, simOutputs_SEMI, report_dir)
+            # the figures only (the CE table and net monetary benefit lines are written above)
+            report_CEA_CBA(simOutputs_ANNUAL, simOutputs_SEMI, paired=paired, report_dir=report_dir)
+
+
+def _check_pairing(simOutputs_x, simOutputs_y_ref, paired):
+    """ raises a ValueError if a paired comparison is asked for streaming outputs, which do not keep the
+    outcomes of each patient to pair """
+    if paired and (simOutputs_x.is_streaming() or simOutputs_y_ref.is_streaming()):
+        raise ValueError('Streaming cohort outputs can only be compared as independent samples '
+                         '(use paired=False).')
+
+
+def _get_estimate(stat):
+    """ :returns: the mean and Settings.ALPHA-level t-CI of a summary or difference statistic """
+    interval = stat.get_t_CI(alpha=Settings.ALPHA)
+    return dict(mean=float(stat.get_mean()), CI=[float(interval[0]), float(interval[1])])
+
+
+def _get_report_dir(report_dir):
+    """ :returns: the directory to save the figures to (report_dir, else Settings.REPORT_DIR in headless mode),
+        or None to show the figures on screen """
+    if report_dir is None and Settings.HEADLESS:
+        return Settings.REPORT_DIR
+    return report_dir
+
+
+def _prepare_figures(report_dir):
+    """ selects the non-interactive matplotlib backend when the figures are saved to report_dir
+    (before figures are drawn) """
+    if report_dir is not None:
+        import matplotlib
+        matplotlib.use('Agg')
+
+
+def _finish_figures(name, report_dir):
+    """ saves the open figures to png files named after the figure in report_dir and closes them
+    (nothing to do if report_dir is None, when the figures are shown on screen) """
+    if report_dir is None:
+        return
+    import matplotlib.pyplot as plt
+    os.makedirs(report_dir, exist_ok=True)
+    for i, number in enumerate(plt.get_fignums()):
+        suffix = '' if i == 0 else '_{}'.format(i + 1)
+        plt.figure(number).savefig(os.path.join(report_dir, name + suffix + '.png'))
+    plt.close('all')
@@ -0,0 +1,72 @@
+import numpy as np
+import Hookworm_InputData as Data
+import Hookworm_ParameterClasses as P
+
+# shapes of the force of infection
+SHAPES = ('linear', 'saturating')
+
+
+class ForceOfInfection:
+    """ the rate at which susceptible persons are infected (S-->I) as a function of the infected fraction of
+    their population: a share of the infections comes from infected members of the population (so it falls
+    when mass drug administration lowers the prevalence) and the rest from outside (e.g. the environment) """
+
+    def __init__(self, base_rate=None, baseline_prevalence=None, within_share=None, shape=None):
+        """
+        :param base_rate: rate of infection at the baseline prevalence (Data.a if None)
+        :param baseline_prevalence: infected fraction at which the rate of infection is base_rate
+            (Data.BASELINE_PREVALENCE if None)
+        :param within_share: share of the rate of infection at the baseline prevalence that comes from infected
+            members of the population (Data.WITHIN_POPULATION_TRANSMISSION if None)
+        :param shape: 'linear' (the infections from within the population are proportional to the infected
+            fraction) or 'saturating' (they level off at twice their baseline value); Data.FORCE_OF_INFECTION
+            if None
+        The parameters can also be arrays (e.g. one value per community).
+        """
+        self._baseRate = Data.a if base_rate is None else base_rate
+        self._baselinePrevalence = Data.BASELINE_PREVALENCE if baseline_prevalence is None else baseline_prevalence
+        self._withinShare = Data.WITHIN_POPULATION_TRANSMISSION if within_share is None else within_share
+        self._shape = Data.FORCE_OF_INFECTION if shape is None else shape
+        if self._shape not in SHAPES:
+            raise ValueError('Unknown force of infection {!r} (use one of {}).'.format(self._shape, SHAPES))
+
+    def get_rate(self, infected_fraction):
+        """ :returns: the annual rate of infection of susceptible persons
+        :param infected_fraction: fraction of the population that is infected (or an array of fractions) """
+        relative_prevalence = np.asarray(infected_fraction) / self._baselinePrevalence
+        if self._shape == 'saturating':
+            relative_prevalence = 2 * relative_prevalence / (1 + relative_prevalence)
+        return self._baseRate * ((1 - self._withinShare) + self._withinShare * relative_prevalence)
+
+    def get_settings(self):
+        """ :returns: dictionary of the parameters of this force of infection (e.g. for cache keys) """
+        return dict(base_rate=self._baseRate, baseline_prevalence=self._baselinePrevalence,
+                    within_share=self._withinShare, shape=self._shape)
+
+
+def get_force_of_infection():
+    """ :returns: the force of infection of the dynamic transmission mode (None if Data.DYNAMIC_ON is False) """
+    return ForceOfInfection() if Data.DYNAMIC_ON else None
+
+
+def get_susceptible_probabilities(susceptible_rates, infection_rate, delta_t):
+    """ :returns: the transition probabilities out of the susceptible state over one time step when the
+    rate of infection is infection_rate (competing risks, as scr.MarkovClasses.continuous_to_discrete)
+    :param susceptible_rates: (... x states) array of the transition rates out of the susceptible state
+        (the rate of infection is replaced by infection_rate)
+    :param infection_rate: rate of infection (a number or an array that broadcasts to the leading dimensions
+        of susceptible_rates)
+    :param delta_t: length of the time step (years)
+    """
+    well = P.HealthStats.WELL.value
+    infected = P.HealthStats.INFECTED.value
+    rates = np.array(susceptible_rates, dtype=float)
+    rates[..., well] = 0
+    rates[..., infected] = infection_rate
+    total_rate = rates.sum(axis=-1, keepdims=True)
+
+    # probability of leaving the susceptible state, split in proportion to the rates
+    prob_leaving = 1 - np.exp(-total_rate * delta_t)
+    probs = rates / np.where(total_rate > 0, total_rate, 1) * prob_leaving
+    probs[..., well] = 1 - prob_leaving[..., 0]
+    return probs